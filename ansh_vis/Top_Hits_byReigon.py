@@ -4,7 +4,8 @@ import altair as alt
 df = pd.read_csv('../data/visualizations/top_tracks_by_region.csv')
 
 df = df[df['streams'] > 0]
-df_top = df.groupby('region').apply(lambda x: x.nlargest(10, 'streams')).reset_index(drop=True)
+df_top = (df.sort_values(['region', 'streams'], ascending=[True, False], kind='stable')
+          .groupby('region').head(10).reset_index(drop=True))
 
 all_regions = df_top['region'].unique().tolist()
 
@@ -0,0 +1,127 @@
+import pandas as pd
+
+# Statistics a request can ask for; all are derived from additive per-group
+# row counts, sums, non-null counts and sums of squares
+STATS = ['size', 'sum', 'count', 'sumsq', 'mean', 'var']
+
+
+class AggregationPlanner:
+    """
+    Collects (keys, measures) aggregation requests and answers all of them with as few
+    grouped scans as possible. Requests whose keys are a subset of another request's keys
+    are rolled up from that finer result instead of rescanning the rows.
+
+    planner = AggregationPlanner()
+    planner.add('regional_means', ['region'], ['energy', 'valence'])
+    planner.add('genre_year', ['year', 'macro_genre'])             # row counts
+    results = planner.execute(df)
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.derived_keys = {}
+
+    def add(self, name, keys, measures=None, stat='mean'):
+        """
+        Register an aggregation
+        :param name: Name of the result in execute()'s output
+        :param keys: Group-by columns (or derived keys registered with derive())
+        :param measures: Columns to aggregate; None returns the row count per group
+        :param stat: One of STATS, applied to every measure
+        """
+        if stat not in STATS:
+            raise ValueError(f"Unknown statistic '{stat}', expected one of {STATS}")
+        if measures is None:
+            stat = 'size'
+        self.requests[name] = {'keys': list(keys), 'measures': list(measures or []), 'stat': stat}
+        return self
+
+    def derive(self, name, func):
+        """Register a key computed from the frame once, e.g. the month period of 'date'"""
+        self.derived_keys[name] = func
+        return self
+
+    def plan(self):
+        """
+        Assign every request to a base grouping that is actually scanned
+        :return: list of bases, each {'keys', 'measures', 'squares', 'requests'}
+        """
+        bases = []
+        # Finest requests first, so coarser ones can find a base to roll up from
+        for name, request in sorted(self.requests.items(), key=lambda item: -len(item[1]['keys'])):
+            candidates = [base for base in bases if set(request['keys']) <= set(base['keys'])]
+            if candidates:
+                base = min(candidates, key=lambda b: len(b['keys']))
+            else:
+                base = {'keys': request['keys'], 'measures': [], 'squares': False, 'requests': []}
+                bases.append(base)
+
+            base['requests'].append(name)
+            base['measures'] += [m for m in request['measures'] if m not in base['measures']]
+            base['squares'] = base['squares'] or request['stat'] in ('sumsq', 'var')
+
+        return bases
+
+    def _scan(self, frame, base):
+        """One grouped pass computing the additive statistics for a base"""
+        keys, measures = base['keys'], base['measures']
+        work = frame[keys].copy()
+        for m in measures:
+            work[m] = frame[m].astype('float64')
+            if base['squares']:
+                work[f'{m}__sumsq'] = work[m] ** 2
+
+        # base['dropna'] = False keeps rows with missing keys as their own groups
+        grouped = work.groupby(keys, observed=True, sort=True, dropna=base.get('dropna', True))
+        sums = grouped.sum()
+        sums.columns = [c if c.endswith('__sumsq') else f'{c}__sum' for c in sums.columns]
+        counts = grouped[measures].count().add_suffix('__count') if measures else None
+
+        return pd.concat([grouped.size().rename('_size'), sums, counts], axis=1)
+
+    @staticmethod
+    def _finish(table, request):
+        """Turn additive statistics into the requested statistic"""
+        if request['stat'] == 'size':
+            return table['_size'].rename('size')
+
+        result = {}
+        for m in request['measures']:
+            total, count = table[f'{m}__sum'], table[f'{m}__count']
+            if request['stat'] == 'sum':
+                result[m] = total
+            elif request['stat'] == 'count':
+                result[m] = count
+            elif request['stat'] == 'sumsq':
+                result[m] = table[f'{m}__sumsq']
+            elif request['stat'] == 'mean':
+                result[m] = total / count
+            else:
+                result[m] = (table[f'{m}__sumsq'] - total ** 2 / count) / (count - 1)
+        return pd.DataFrame(result, index=table.index)
+
+    def execute(self, df=None, scan=None):
+        """
+        Run the plan over df
+        :param df: Rows to aggregate
+        :param scan: Alternative scan(base) -> table of additive statistics (e.g. a lazy
+            backend); it must return the same layout as _scan()
+        :return: dict of request name -> Series (row counts) or DataFrame indexed by the keys
+        """
+        if scan is None:
+            frame = df.assign(**{name: func(df) for name, func in self.derived_keys.items()})
+            scan = lambda base: self._scan(frame, base)
+
+        results = {}
+        for base in self.plan():
+            table = scan(base)
+            for name in base['requests']:
+                request = self.requests[name]
+                if request['keys'] == base['keys']:
+                    rolled = table
+                else:
+                    # Every base statistic is additive, so coarser groups are plain sums
+                    rolled = table.groupby(level=request['keys'], observed=True, sort=True).sum()
+                results[name] = self._finish(rolled, request)
+
+        return results
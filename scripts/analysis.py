@@ -1,27 +1,96 @@
 import pandas as pd
-import numpy as np
+import argparse
 import os
-from scipy import stats
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
-import json
 
-# Get the project root directory
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-
-def load_data():
-    """Load the engineered dataset"""
-    input_path = os.path.join(PROJECT_ROOT, 'data/processed/final_dataset_engineered.csv')
-    df = pd.read_csv(input_path)
-    df['date'] = pd.to_datetime(df['date'])
+import anova
+import clustering
+import correlation
+import cube
+import instrumentation
+import scatter
+import star_schema
+import storage
+import topk
+from aggregation import AggregationPlanner
+from schema import apply_schema
+
+
+@instrumentation.instrumented()
+def load_data(columns=None, regions=None, years=None):
+    """
+    Load the engineered dataset
+    :param columns: Only load these columns (default: all)
+    :param regions: Only load these regions
+    :param years: Only load these years
+    :return: pd.DataFrame
+    """
+    # The star layout only joins the track/date dimensions the requested columns need
+    if star_schema.engineered_layout() == 'star':
+        df = star_schema.read_star(columns=columns, regions=regions, years=years)
+    else:
+        df = storage.read_table('final_dataset_engineered', columns=columns, regions=regions, years=years)
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'])
+    df = apply_schema(df)
     print(f"Loaded: {df.shape[0]:,} rows, {df.shape[1]} columns")
     return df
 
 
-def regional_audio_analysis(df):
+def iter_data(columns=None, batch_rows=storage.ROW_GROUP_ROWS):
+    """
+    Stream the engineered dataset in batches instead of loading it
+    :param columns: Only load these columns (default: all)
+    :param batch_rows: Maximum rows per batch
+    :return: Generator of pd.DataFrame
+    """
+    if star_schema.engineered_layout() == 'star':
+        batches = star_schema.iter_star(columns=columns, batch_rows=batch_rows)
+    else:
+        batches = storage.iter_table('final_dataset_engineered', columns=columns, batch_rows=batch_rows)
+    for batch in batches:
+        if 'date' in batch.columns and not pd.api.types.is_datetime64_any_dtype(batch['date']):
+            batch['date'] = pd.to_datetime(batch['date'])
+        yield apply_schema(batch)
+
+
+def plan_aggregations(names=None):
+    """
+    Every grouped aggregate the analyses need, in one plan.
+    Requests sharing (or rolling up from) the same keys are answered by a single scan.
+    :param names: Only plan these requests (default: all of them)
+    :return: AggregationPlanner
+    """
+    planner = AggregationPlanner()
+    planner.add('regional_means', ['region'], ['danceability', 'energy', 'valence', 'tempo',
+                                               'acousticness', 'loudness', 'speechiness', 'instrumentalness'])
+    planner.add('region_profiles', ['region'], ['danceability', 'energy', 'valence', 'tempo',
+                                                'acousticness', 'loudness', 'speechiness'])
+    planner.add('region_anova_count', ['region'], anova.AUDIO_FEATURES, stat='count')
+    planner.add('region_anova_sum', ['region'], anova.AUDIO_FEATURES, stat='sum')
+    planner.add('region_anova_sumsq', ['region'], anova.AUDIO_FEATURES, stat='sumsq')
+    planner.add('genre_time', ['year', 'quarter', 'macro_genre'])
+    planner.add('genre_year', ['year', 'macro_genre'])
+
+    if names is not None:
+        planner.requests = {name: planner.requests[name] for name in names}
+    return planner
+
+
+def _aggregates(df, aggregates, names):
+    """Use the shared aggregates when given, otherwise compute just the ones a function needs"""
+    if aggregates is None:
+        aggregates = plan_aggregations(names).execute(df)
+    return aggregates
+
+
+@instrumentation.instrumented()
+def regional_audio_analysis(df, aggregates=None, anova_method='classic'):
     """
     Analyze audio feature differences across regions
+    :param aggregates: Shared results of plan_aggregations() (computed here if not given)
+    :param anova_method: 'classic', 'welch' or 'kruskal'
     """
     print("REGIONAL AUDIO FEATURE ANALYSIS")
 
@@ -30,7 +99,9 @@ def regional_audio_analysis(df):
                       'acousticness', 'loudness', 'speechiness', 'instrumentalness']
 
     # Calculate mean audio features by region
-    regional_means = df.groupby('region')[audio_features].mean()
+    aggregates = _aggregates(df, aggregates, ['regional_means', 'region_anova_count',
+                                              'region_anova_sum', 'region_anova_sumsq'])
+    regional_means = aggregates['regional_means']
 
     print("\nMean Audio Features by Region:")
     print(regional_means.round(3))
@@ -39,13 +110,13 @@ def regional_audio_analysis(df):
     print("\nANOVA Tests (testing if regions differ significantly):")
     anova_results = {}
 
-    for feature in audio_features:
-        # Get data for each region
-        region_groups = [df[df['region'] == region][feature].dropna()
-                         for region in df['region'].unique()]
+    # Per-region count, sum and sum of squares from the shared scan; no per-region subsets
+    moments = {stat: aggregates[f'region_anova_{stat}'] for stat in ['count', 'sum', 'sumsq']}
+    tests = anova.group_anova(df, 'region', audio_features, anova_method, moments=moments)
+    stat_label = 'H' if anova_method == 'kruskal' else 'F'
 
-        # Perform ANOVA
-        f_stat, p_value = stats.f_oneway(*region_groups)
+    for feature in audio_features:
+        f_stat, p_value = tests.loc[feature, 'statistic'], tests.loc[feature, 'p_value']
 
         anova_results[feature] = {
             'f_statistic': f_stat,
@@ -54,46 +125,51 @@ def regional_audio_analysis(df):
         }
 
         sig_marker = "SIGNIFICANT" if p_value < 0.05 else "Not significant"
-        print(f"   {feature:20s}: F={f_stat:8.2f}, p={p_value:.6f} [{sig_marker}]")
+        print(f"   {feature:20s}: {stat_label}={f_stat:8.2f}, p={p_value:.6f} [{sig_marker}]")
 
     # Save regional means
-    output_path = os.path.join(PROJECT_ROOT, 'data/processed/regional_audio_means.csv')
+    output_path = os.path.join(storage.data_dir(), 'processed', 'regional_audio_means.csv')
     regional_means.to_csv(output_path)
     print(f"\nRegional means saved to: {output_path}")
 
     return regional_means, anova_results
 
 
-def genre_evolution_analysis(df):
+@instrumentation.instrumented()
+def genre_evolution_analysis(df, aggregates=None):
     """Analyze how genre popularity changes over time"""
     print("\n" + "=" * 60)
     print("GENRE EVOLUTION ANALYSIS")
     print("=" * 60)
 
     # Count tracks by macro_genre and time period
-    genre_time = df.groupby(['year', 'quarter', 'macro_genre']).size().reset_index(name='track_count')
+    aggregates = _aggregates(df, aggregates, ['genre_time', 'genre_year'])
+    genre_time_counts = aggregates['genre_time']
+    genre_time = genre_time_counts.reset_index(name='track_count')
 
+    # Yearly totals are rolled up from the quarterly counts instead of one scan per year
+    genre_year = aggregates['genre_year']
     print("\nTop 5 Genres by Year:")
-    for year in sorted(df['year'].unique()):
-        year_data = genre_time[genre_time['year'] == year]
-        top_genres = year_data.groupby('macro_genre')['track_count'].sum().nlargest(5)
+    for year in genre_year.index.unique(level='year'):
+        top_genres = genre_year.xs(year, level='year').nlargest(5)
         print(f"\n{year}:")
         for genre, count in top_genres.items():
             print(f"   {genre:20s}: {count:6,} tracks")
 
     # Calculate genre market share over time
-    genre_time_pivot = df.groupby(['year', 'quarter', 'macro_genre']).size().unstack(fill_value=0)
+    genre_time_pivot = genre_time_counts.unstack(fill_value=0)
     genre_time_pct = genre_time_pivot.div(genre_time_pivot.sum(axis=1), axis=0) * 100
 
     # Save for visualization
-    output_path = os.path.join(PROJECT_ROOT, 'data/processed/genre_evolution.csv')
+    output_path = os.path.join(storage.data_dir(), 'processed', 'genre_evolution.csv')
     genre_time.to_csv(output_path, index=False)
     print(f"\nGenre evolution data saved to: {output_path}")
 
     return genre_time
 
 
-def clustering_analysis(df):
+@instrumentation.instrumented()
+def clustering_analysis(df, aggregates=None):
     """Perform k-means clustering on regional music preferences"""
     print("\n" + "=" * 60)
     print("GEOGRAPHIC TASTE CLUSTERING")
@@ -103,7 +179,7 @@ def clustering_analysis(df):
     audio_features = ['danceability', 'energy', 'valence', 'tempo',
                       'acousticness', 'loudness', 'speechiness']
 
-    region_profiles = df.groupby('region')[audio_features].mean()
+    region_profiles = _aggregates(df, aggregates, ['region_profiles'])['region_profiles'][audio_features]
 
     print(f"\nClustering {len(region_profiles)} regions...")
 
@@ -129,58 +205,68 @@ def clustering_analysis(df):
         print(f"      Acousticness: {cluster_means['acousticness']:.3f}")
 
     # Save clustering results
-    output_path = os.path.join(PROJECT_ROOT, 'data/processed/regional_clusters.csv')
+    output_path = os.path.join(storage.data_dir(), 'processed', 'regional_clusters.csv')
     region_profiles.to_csv(output_path)
     print(f"\nClustering results saved to: {output_path}")
 
+    # Six region means are too few vectors to say much, so the same features are also clustered
+    # per (region, week) and per track, in batches, with k chosen by silhouette
+    rows = clustering.frame_batches(df[clustering.ROW_COLUMNS])
+    _, week_mix = clustering.cluster(rows, 'region_week')
+    print("\nWeeks per region in each cluster:")
+    print(week_mix.rename(columns=lambda c: f"Cluster {c + 1}").to_string())
+    clustering.cluster(rows, 'track')
+
     return region_profiles
 
 
-def top_tracks_analysis(df):
+@instrumentation.instrumented()
+def top_tracks_analysis(df, k=10):
     """Identify top tracks by various metrics"""
     print("\n" + "=" * 60)
     print("TOP TRACKS ANALYSIS")
     print("=" * 60)
 
-    # Get unique tracks (one row per track)
-    unique_tracks = df.drop_duplicates(subset='track_id')
+    # One row per track: its first row, plus its longest chart run and total streams
+    tracks = df.drop_duplicates(subset='track_id').set_index('track_id')
+    totals = df.groupby('track_id', observed=True, sort=False).agg({'weeks_in_chart': 'max', 'streams': 'sum'})
+    tracks = tracks.assign(weeks_in_chart=totals['weeks_in_chart'], streams=totals['streams']).reset_index()
+
+    # Every list in one call: a partial selection per metric instead of sorting the tracks
+    leaders = topk.top_k(tracks, ['popularity', 'party_score', 'chill_score', 'weeks_in_chart', 'streams'], k=k)
 
     # Top by popularity
-    print("\nTop 10 Most Popular Tracks:")
-    top_popular = unique_tracks.nlargest(10, 'popularity')[
-        ['track_name', 'artist_spotify', 'popularity', 'macro_genre']]
+    print(f"\nTop {k} Most Popular Tracks:")
+    top_popular = leaders['popularity'][['track_name', 'artist_spotify', 'popularity', 'macro_genre']]
     for idx, row in top_popular.iterrows():
         print(f"   {row['track_name'][:30]:30s} - {row['artist_spotify'][:25]:25s} ({row['popularity']})")
 
     # Top by party score
-    print("\nTop 10 'Party' Tracks (high energy + danceability + positivity):")
-    top_party = unique_tracks.nlargest(10, 'party_score')[
-        ['track_name', 'artist_spotify', 'party_score', 'macro_genre']]
+    print(f"\nTop {k} 'Party' Tracks (high energy + danceability + positivity):")
+    top_party = leaders['party_score'][['track_name', 'artist_spotify', 'party_score', 'macro_genre']]
     for idx, row in top_party.iterrows():
         print(f"   {row['track_name'][:30]:30s} - {row['artist_spotify'][:25]:25s} ({row['party_score']:.3f})")
 
     # Top by chill score
-    print("\nTop 10 'Chill' Tracks (low energy + acoustic + neutral mood):")
-    top_chill = unique_tracks.nlargest(10, 'chill_score')[
-        ['track_name', 'artist_spotify', 'chill_score', 'macro_genre']]
+    print(f"\nTop {k} 'Chill' Tracks (low energy + acoustic + neutral mood):")
+    top_chill = leaders['chill_score'][['track_name', 'artist_spotify', 'chill_score', 'macro_genre']]
     for idx, row in top_chill.iterrows():
         print(f"   {row['track_name'][:30]:30s} - {row['artist_spotify'][:25]:25s} ({row['chill_score']:.3f})")
 
     # Tracks with longest chart runs
-    print("\nTop 10 Longest Charting Tracks:")
-    longest_charting = df.groupby('track_id').agg({
-        'track_name': 'first',
-        'artist_spotify': 'first',
-        'weeks_in_chart': 'max',
-        'macro_genre': 'first'
-    }).nlargest(10, 'weeks_in_chart')
-
-    for idx, row in longest_charting.iterrows():
+    print(f"\nTop {k} Longest Charting Tracks:")
+    for idx, row in leaders['weeks_in_chart'].iterrows():
         print(f"   {row['track_name'][:30]:30s} - {row['weeks_in_chart']} weeks")
 
+    # Most streamed tracks over all charted regions
+    print(f"\nTop {k} Most Streamed Tracks:")
+    for idx, row in leaders['streams'].iterrows():
+        print(f"   {row['track_name'][:30]:30s} - {row['streams']:,.0f} streams")
+
     return top_popular, top_party, top_chill
 
 
+@instrumentation.instrumented()
 def correlation_analysis(df):
     """Analyze correlations between audio features and chart performance"""
     print("\n" + "=" * 60)
@@ -188,90 +274,83 @@ def correlation_analysis(df):
     print("=" * 60)
 
     # Features to analyze
-    audio_features = ['danceability', 'energy', 'valence', 'tempo',
-                      'acousticness', 'loudness', 'speechiness']
+    audio_features = correlation.AUDIO_FEATURES
+    performance_metrics = [m for m in correlation.PERFORMANCE_METRICS if m in df.columns]
 
-    performance_metrics = ['popularity', 'peak_position', 'weeks_in_chart', 'streams']
+    # One pass of pairwise co-moments covers every feature/metric pair below
+    corr_all = correlation.correlation_matrix(df, audio_features + performance_metrics)
 
     print("\nCorrelation between Audio Features and Chart Performance:")
     print("(Pearson correlation coefficient)")
 
     for metric in performance_metrics:
-        if metric in df.columns:
-            print(f"\n{metric.upper()}:")
-            correlations = df[audio_features + [metric]].corr()[metric].drop(metric).sort_values(ascending=False)
+        print(f"\n{metric.upper()}:")
+        correlations = corr_all.loc[audio_features, metric].sort_values(ascending=False)
 
-            for feature, corr in correlations.items():
-                direction = "positive" if corr > 0 else "negative"
-                strength = "Strong" if abs(corr) > 0.3 else ("Moderate" if abs(corr) > 0.1 else "Weak")
-                print(f"   {feature:20s}: {corr:7.3f} [{direction}, {strength}]")
+        for feature, corr in correlations.items():
+            direction = "positive" if corr > 0 else "negative"
+            strength = "Strong" if abs(corr) > 0.3 else ("Moderate" if abs(corr) > 0.1 else "Weak")
+            print(f"   {feature:20s}: {corr:7.3f} [{direction}, {strength}]")
 
     # Save correlation matrix
-    corr_matrix = df[audio_features + ['popularity', 'peak_position']].corr()
-    output_path = os.path.join(PROJECT_ROOT, 'data/processed/correlation_matrix.csv')
+    saved = audio_features + ['popularity', 'peak_position']
+    corr_matrix = corr_all.loc[saved, saved]
+    output_path = os.path.join(storage.data_dir(), 'processed', 'correlation_matrix.csv')
     corr_matrix.to_csv(output_path)
     print(f"\nCorrelation matrix saved to: {output_path}")
 
     return corr_matrix
 
 
-def create_visualization_data(df):
-    """Create pre-aggregated data files for visualizations"""
+@instrumentation.instrumented()
+def create_visualization_data(df, data_cube=None):
+    """
+    Create pre-aggregated data files for visualizations
+    :param data_cube: Rollup cube of df (built here if not given, e.g. by a lazy backend)
+    """
     print("\n" + "=" * 60)
     print("CREATING VISUALIZATION DATA FILES")
     print("=" * 60)
 
-    viz_dir = os.path.join(PROJECT_ROOT, 'data/visualizations')
+    viz_dir = os.path.join(storage.data_dir(), 'visualizations')
     os.makedirs(viz_dir, exist_ok=True)
 
-    # 1. Monthly genre trends
-    print("\n   1. Monthly genre trends...")
-    monthly_genre = df.groupby([df['date'].dt.to_period('M'), 'macro_genre']).size().reset_index(name='count')
-    monthly_genre['month'] = monthly_genre['date'].astype(str)
-    monthly_genre = monthly_genre.drop('date', axis=1)
-    monthly_genre.to_csv(os.path.join(viz_dir, 'monthly_genre_trends.csv'), index=False)
-
-    # 2. Regional audio feature comparison
-    print("   2. Regional audio feature comparison...")
-    audio_features = ['danceability', 'energy', 'valence', 'tempo', 'acousticness']
-    regional_comparison = df.groupby('region')[audio_features].mean().reset_index()
-    regional_comparison.to_csv(os.path.join(viz_dir, 'regional_audio_comparison.csv'), index=False)
-
-    # 3. Energy vs Valence by genre (for scatter plot)
-    print("   3. Energy vs Valence scatter data...")
-    scatter_data = df[['track_id', 'track_name', 'artist_spotify', 'macro_genre',
-                       'danceability', 'energy', 'valence', 'popularity', 'year']].drop_duplicates(subset='track_id')
-    scatter_data.to_csv(os.path.join(viz_dir, 'energy_valence_scatter.csv'), index=False)
-
-    # 4. Top tracks by region
-    print("   4. Top tracks by region...")
-    top_by_region = df.groupby(['region', 'track_id']).agg({
-        'track_name': 'first',
-        'artist_spotify': 'first',
-        'peak_position': 'min',
-        'weeks_in_chart': 'max',
-        'streams': 'sum'
-    }).reset_index()
-
-    top_by_region = top_by_region.sort_values(['region', 'peak_position']).groupby('region').head(20)
-    top_by_region.to_csv(os.path.join(viz_dir, 'top_tracks_by_region.csv'), index=False)
-
-    # 5. Mood distribution over time
-    print("   5. Mood trends over time...")
-    mood_time = df.groupby([df['date'].dt.to_period('M'), 'mood']).size().reset_index(name='count')
-    mood_time['month'] = mood_time['date'].astype(str)
-    mood_time = mood_time.drop('date', axis=1)
-    mood_time.to_csv(os.path.join(viz_dir, 'mood_trends.csv'), index=False)
+    # Monthly genre trends, regional comparison, top tracks and mood trends are rollups of
+    # the (month, region, macro_genre, mood) cube and the per-(region, track) rollup, which
+    # are stored so new chart days can be folded in without rescanning the rows
+    print("\n   Building the rollup cube...")
+    if data_cube is None:
+        data_cube = cube.build_cube(df)
+    track_rollup = cube.build_track_rollup(df)
+    cube.save_rollups(data_cube, track_rollup,
+                      fmt=storage.stored_format('final_dataset_engineered') or storage.DEFAULT_FORMAT)
+    cube.write_visualizations(data_cube, track_rollup, viz_dir)
+
+    # Energy vs Valence by genre (for scatter plot): one point per track, downsampled to a point
+    # budget with full-resolution tiles for zooming in
+    print("   Energy vs Valence scatter data...")
+    scatter.write_scatter(df, viz_dir)
 
     print(f"\nVisualization data files created in: {viz_dir}")
     print("Files created:")
     print("   - monthly_genre_trends.csv")
     print("   - regional_audio_comparison.csv")
-    print("   - energy_valence_scatter.csv")
+    print("   - energy_valence_scatter.csv (+ energy_valence_density.csv, energy_valence_tiles/)")
     print("   - top_tracks_by_region.csv")
     print("   - mood_trends.csv")
 
 
+def run_analyses(df, aggregates=None):
+    """Run the statistical analyses (everything except the visualization files)"""
+    regional_means, anova_results = regional_audio_analysis(df, aggregates)
+    genre_evolution = genre_evolution_analysis(df, aggregates)
+    clusters = clustering_analysis(df, aggregates)
+    top_tracks = top_tracks_analysis(df)
+    correlations = correlation_analysis(df)
+
+    return regional_means, genre_evolution, clusters, top_tracks, correlations
+
+
 def main():
     """Run all analyses"""
     print("=" * 60)
@@ -281,18 +360,21 @@ def main():
     # Load data
     df = load_data()
 
+    # One grouped scan per distinct key set, shared by every analysis
+    with instrumentation.step('aggregates', rows_in=len(df)):
+        aggregates = plan_aggregations().execute(df)
+
     # Run analyses
-    regional_means, anova_results = regional_audio_analysis(df)
-    genre_evolution = genre_evolution_analysis(df)
-    clusters = clustering_analysis(df)
-    top_tracks = top_tracks_analysis(df)
-    correlations = correlation_analysis(df)
+    run_analyses(df, aggregates)
 
     # Create visualization data
     create_visualization_data(df)
 
 
-
-
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the analyses and write the visualization data")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumentation.run('analysis', enabled=args.profile or args.cprofile, cprofile=args.cprofile):
+        main()
\ No newline at end of file
@@ -0,0 +1,190 @@
+import pandas as pd
+import numpy as np
+import argparse
+import inspect
+from scipy import stats
+
+import storage
+from aggregation import AggregationPlanner
+
+METHODS = ['classic', 'welch', 'kruskal']
+
+AUDIO_FEATURES = ['danceability', 'energy', 'valence', 'tempo',
+                  'acousticness', 'loudness', 'speechiness', 'instrumentalness']
+
+
+def group_moments(df, group_col, features):
+    """
+    Per-group count, sum and sum of squares of every feature in one grouped pass
+    :return: dict of 'count', 'sum', 'sumsq' -> pd.DataFrame (groups x features)
+    """
+    planner = AggregationPlanner()
+    for stat in ['count', 'sum', 'sumsq']:
+        planner.add(stat, [group_col], features, stat=stat)
+    return planner.execute(df)
+
+
+def merge_moments(*parts):
+    """Combine moments computed on separate chunks or partitions of the same table"""
+    return {stat: pd.concat([part[stat] for part in parts]).groupby(level=0, observed=True).sum()
+            for stat in ['count', 'sum', 'sumsq']}
+
+
+def anova_from_moments(moments, method='classic'):
+    """
+    One-way ANOVA of every feature across groups from sufficient statistics
+    :param moments: Output of group_moments() / merge_moments()
+    :param method: 'classic' (equal variances, like scipy.stats.f_oneway) or 'welch'
+    :return: pd.DataFrame indexed by feature with statistic, p_value, df_between, df_within
+    """
+    results = {}
+    for feature in moments['count'].columns:
+        n = moments['count'][feature].to_numpy(dtype=np.float64)
+        total = moments['sum'][feature].to_numpy(dtype=np.float64)
+        sumsq = moments['sumsq'][feature].to_numpy(dtype=np.float64)
+
+        # Groups without a single value do not take part, as in scipy
+        keep = n > 0
+        n, total, sumsq = n[keep], total[keep], sumsq[keep]
+        k = len(n)
+        means = total / n
+        within_ss = sumsq - total ** 2 / n
+
+        if method == 'classic':
+            grand_mean = total.sum() / n.sum()
+            between_ss = (n * (means - grand_mean) ** 2).sum()
+            df_between, df_within = k - 1, n.sum() - k
+            statistic = (between_ss / df_between) / (within_ss.sum() / df_within)
+        elif method == 'welch':
+            weights = n / (within_ss / (n - 1))
+            weighted_mean = (weights * means).sum() / weights.sum()
+            spread = (weights * (means - weighted_mean) ** 2).sum() / (k - 1)
+            correction = ((1 - weights / weights.sum()) ** 2 / (n - 1)).sum()
+            df_between, df_within = k - 1, (k ** 2 - 1) / (3 * correction)
+            statistic = spread / (1 + 2 * (k - 2) / (k ** 2 - 1) * correction)
+        else:
+            raise ValueError(f"Unknown method '{method}', expected 'classic' or 'welch'")
+
+        results[feature] = {'statistic': statistic, 'p_value': stats.f.sf(statistic, df_between, df_within),
+                            'df_between': df_between, 'df_within': df_within}
+
+    return pd.DataFrame.from_dict(results, orient='index')
+
+
+def rank_counts(df, group_col, features):
+    """
+    Rows per (group, value) of every feature: the mergeable input of Kruskal-Wallis,
+    since global ranks can be rebuilt from the combined value counts
+    :return: dict of feature -> pd.Series indexed by (group, value)
+    """
+    return {feature: df.groupby([group_col, feature], observed=True).size() for feature in features}
+
+
+def merge_rank_counts(*parts):
+    """Combine rank_counts() of separate chunks or partitions of the same table"""
+    return {feature: pd.concat([part[feature] for part in parts]).groupby(level=[0, 1], observed=True).sum()
+            for feature in parts[0]}
+
+
+def kruskal_from_counts(counts):
+    """
+    Kruskal-Wallis H test of every feature across groups, with the tie correction scipy uses
+    :param counts: Output of rank_counts() / merge_rank_counts()
+    :return: pd.DataFrame indexed by feature with statistic, p_value, df_between
+    """
+    results = {}
+    for feature, per_group in counts.items():
+        # Average rank of every distinct value over all groups
+        ties = per_group.groupby(level=1, observed=True).sum().sort_index()
+        tie_counts = ties.to_numpy(dtype=np.float64)
+        first_rank = np.cumsum(tie_counts) - tie_counts
+        value_rank = pd.Series(first_rank + (tie_counts + 1) / 2, index=ties.index)
+
+        rank_sums = (per_group * value_rank.reindex(per_group.index.get_level_values(1)).to_numpy()) \
+            .groupby(level=0, observed=True).sum()
+        group_sizes = per_group.groupby(level=0, observed=True).sum()
+
+        n = tie_counts.sum()
+        k = len(group_sizes)
+        h = 12 / (n * (n + 1)) * (rank_sums ** 2 / group_sizes).sum() - 3 * (n + 1)
+        h /= 1 - (tie_counts ** 3 - tie_counts).sum() / (n ** 3 - n)
+
+        results[feature] = {'statistic': h, 'p_value': stats.chi2.sf(h, k - 1), 'df_between': k - 1}
+
+    return pd.DataFrame.from_dict(results, orient='index')
+
+
+def group_anova(df, group_col, features, method='classic', moments=None):
+    """
+    Test whether every feature differs across the groups of group_col
+    :param method: 'classic', 'welch' or 'kruskal'
+    :param moments: Precomputed group_moments() (computed here if not given)
+    :return: pd.DataFrame indexed by feature with statistic and p_value
+    """
+    if method == 'kruskal':
+        return kruskal_from_counts(rank_counts(df, group_col, features))
+    return anova_from_moments(moments or group_moments(df, group_col, features), method)
+
+
+def verify_against_scipy(df, group_col='region', features=AUDIO_FEATURES, chunks=4):
+    """
+    Compare every method with scipy.stats on the same data, once from a single pass and once
+    merged from separate chunks
+    :return: bool: True if all statistics and p-values match to float tolerance
+    """
+    print("=" * 60)
+    print("ANOVA PARITY CHECK AGAINST SCIPY")
+    print("=" * 60)
+
+    parts = np.array_split(np.arange(len(df)), chunks)
+    chunk_moments = merge_moments(*[group_moments(df.iloc[rows], group_col, features) for rows in parts])
+    chunk_counts = merge_rank_counts(*[rank_counts(df.iloc[rows], group_col, features) for rows in parts])
+
+    from_chunks = {
+        'classic': anova_from_moments(chunk_moments, 'classic'),
+        'welch': anova_from_moments(chunk_moments, 'welch'),
+        'kruskal': kruskal_from_counts(chunk_counts),
+    }
+
+    all_match = True
+    for method in METHODS:
+        if method == 'welch' and 'equal_var' not in inspect.signature(stats.f_oneway).parameters:
+            print("\nwelch: skipped (needs scipy >= 1.15 for f_oneway(equal_var=False))")
+            continue
+        single_pass = group_anova(df, group_col, features, method)
+        print(f"\n{method}:")
+        for feature in features:
+            samples = [values.dropna().to_numpy(dtype=np.float64)
+                       for _, values in df.groupby(group_col, observed=True)[feature]]
+            if method == 'kruskal':
+                expected = stats.kruskal(*samples)
+            elif method == 'welch':
+                expected = stats.f_oneway(*samples, equal_var=False)
+            else:
+                expected = stats.f_oneway(*samples)
+
+            match = all(np.isclose(result.loc[feature, 'statistic'], expected.statistic, rtol=1e-6)
+                        and np.isclose(result.loc[feature, 'p_value'], expected.pvalue, rtol=1e-6, atol=1e-12)
+                        for result in [single_pass, from_chunks[method]])
+            all_match = all_match and match
+            print(f"   {feature:20s}: ours={single_pass.loc[feature, 'statistic']:12.4f} "
+                  f"scipy={expected.statistic:12.4f} [{'OK' if match else 'MISMATCH'}]")
+
+    print(f"\nAll methods match scipy: {all_match}")
+    return all_match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regional ANOVA from per-group sufficient statistics")
+    parser.add_argument('--method', default='classic', choices=METHODS,
+                        help="Test to run (default: classic)")
+    parser.add_argument('--verify', action='store_true',
+                        help="Check every method against scipy.stats on the engineered dataset")
+    args = parser.parse_args()
+
+    df = storage.read_table('final_dataset_engineered', columns=['region'] + AUDIO_FEATURES)
+
+    if args.verify:
+        verify_against_scipy(df)
+    else:
+        print(group_anova(df, 'region', AUDIO_FEATURES, args.method))
@@ -0,0 +1,283 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import scaling
+import storage
+import synthetic
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SCALES = ['10K', '100K', '1M']
+
+# Every sample keeps the whole top-200 chart of every region it has, from its first day on
+CHART_SIZE = 200
+START = '2020-01-01'
+
+# A step is a regression when it is this much slower (or bigger) than in the baseline and the
+# difference is above the floor, which keeps timer noise on millisecond steps from being flagged
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+MIN_REGRESSION_MB = 25
+
+ROW_SUFFIXES = {'K': 1_000, 'M': 1_000_000}
+
+
+def parse_rows(value):
+    """Row count from '10000', '10K' or '2.5M'"""
+    suffix = value[-1:].upper()
+    if suffix in ROW_SUFFIXES:
+        return int(float(value[:-1]) * ROW_SUFFIXES[suffix])
+    return int(value)
+
+
+def format_rows(rows):
+    for suffix, size in sorted(ROW_SUFFIXES.items(), key=lambda item: -item[1]):
+        if rows >= size and rows % size == 0:
+            return f"{rows // size}{suffix}"
+    return str(rows)
+
+
+def results_dir():
+    return os.path.join(storage.data_dir(), 'benchmarks')
+
+
+def default_baseline_path():
+    return os.path.join(results_dir(), 'baseline.json')
+
+
+def _machine():
+    """What a timing depends on besides the code, to warn when a baseline came from elsewhere"""
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(), 'python': platform.python_version(),
+            'pandas': pd.__version__, 'numpy': np.__version__}
+
+
+def prepare_sample(workdir, rows, seed=0):
+    """
+    Generate the synthetic raw files of one scale, or reuse them if an earlier run generated the
+    same sample with the same generator code
+    :return: (data directory, sample description)
+    """
+    import pipeline
+
+    data_dir = os.path.join(workdir, f'rows_{rows}_seed_{seed}')
+    sample = {**synthetic.plan_rows(rows, chart_size=CHART_SIZE, start=START), 'chart_size': CHART_SIZE,
+              'seed': seed, 'generator': pipeline._hash_code([('synthetic.py', None)])}
+    marker = os.path.join(data_dir, 'sample.json')
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == sample:
+                return data_dir, sample
+
+    start = time.perf_counter()
+    plan = {key: sample[key] for key in ['n_regions', 'n_tracks', 'start', 'end', 'max_rows']}
+    counts = synthetic.write_dataset(data_dir, chart_size=CHART_SIZE, seed=seed, **plan)
+    scaling._write_scope(os.path.join(data_dir, 'scope.json'), CHART_SIZE, START)
+    with open(marker, 'w') as f:
+        json.dump(sample, f, indent=2)
+    print(f"   generated {counts['chart_rows']:,} chart rows ({sample['n_regions']} regions, "
+          f"{sample['n_tracks']:,} tracks, {sample['start']} to {sample['end']}) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return data_dir, sample
+
+
+def _run_child(data_dir, settings):
+    """Run every stage on one sample in a fresh process, so each run starts cold"""
+    env = dict(os.environ, DS4200_DATA_DIR=data_dir, DS4200_SCOPE=os.path.join(data_dir, 'scope.json'))
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--format', settings['format'],
+               '--filter-mode', settings['filter_mode'], '--backend', settings['backend']]
+    result = subprocess.run(command, env=env, cwd=SCRIPTS_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Pipeline failed on {data_dir}:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _child(fmt, filter_mode, backend):
+    """Entry point of the child process: run every stage under one instrumented run, print one JSON line"""
+    import contextlib
+    import io
+
+    import instrumentation
+    import pipeline
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        with instrumentation.run('benchmark') as log:
+            pipeline.run_pipeline(force=pipeline.STAGE_NAMES, fmt=fmt, filter_mode=filter_mode, backend=backend)
+    print(json.dumps({'seconds': log['seconds'], 'peak_rss_mb': log['peak_rss_mb'], 'steps': log['steps']}))
+
+
+def _best_of(runs):
+    """Fastest time and smallest peak of each step over the repeats"""
+    steps = {}
+    for run in runs:
+        for record in run['steps']:
+            best = steps.setdefault(record['step'], {'rows_in': record['rows_in'], 'rows_out': record['rows_out']})
+            for measure in ['wall_s', 'cpu_s', 'peak_rss_mb']:
+                best[measure] = min(best.get(measure, record[measure]), record[measure])
+    return {'seconds': min(run['seconds'] for run in runs),
+            'peak_rss_mb': min(run['peak_rss_mb'] for run in runs),
+            'steps': steps}
+
+
+def run_benchmark(workdir, scales=DEFAULT_SCALES, repeats=1, fmt='parquet', filter_mode='streaming',
+                  backend='pandas', seed=0):
+    """
+    Time every pipeline stage, and every step and analysis function inside it, on synthetic
+    samples of the given sizes
+    :param workdir: Directory for the samples, kept so later runs reuse them
+    :param scales: Raw chart rows per sample, e.g. ['10K', '1M', '100M']
+    :param repeats: Runs per scale; the best time of each step is kept
+    :return: dict with the machine, settings and per-scale results (saved to data/benchmarks/)
+    """
+    print("=" * 60)
+    print("PIPELINE BENCHMARK")
+    print("=" * 60)
+
+    settings = {'format': fmt, 'filter_mode': filter_mode, 'backend': backend, 'repeats': repeats}
+    results = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': _machine(), 'settings': settings,
+               'scales': {}}
+
+    for rows in sorted(parse_rows(scale) for scale in scales):
+        label = format_rows(rows)
+        print(f"\n[{label} rows]")
+        data_dir, sample = prepare_sample(workdir, rows, seed)
+        runs = []
+        for repeat in range(repeats):
+            runs.append(_run_child(data_dir, settings))
+            print(f"   run {repeat + 1}/{repeats}: {runs[-1]['seconds']:.1f}s, "
+                  f"peak {runs[-1]['peak_rss_mb']:,.0f} MB")
+        results['scales'][label] = {'rows': rows, 'sample': sample, **_best_of(runs)}
+
+    print_results(results)
+
+    os.makedirs(results_dir(), exist_ok=True)
+    path = os.path.join(results_dir(), f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to: {path}")
+    return results
+
+
+def print_results(results):
+    """One table per scale: the stages and analysis functions, then throughput"""
+    for label, scale in results['scales'].items():
+        print("\n" + "=" * 60)
+        print(f"{label} RAW CHART ROWS")
+        print("=" * 60)
+        print(f"   {'step':52s} {'wall s':>8s} {'cpu s':>8s} {'peak MB':>8s} {'rows out':>12s}")
+        for step, record in scale['steps'].items():
+            rows_out = f"{record['rows_out']:,}" if record['rows_out'] is not None else '-'
+            print(f"   {step:52s} {record['wall_s']:8.2f} {record['cpu_s']:8.2f} "
+                  f"{record['peak_rss_mb']:8,.0f} {rows_out:>12s}")
+        print(f"   {'total':52s} {scale['seconds']:8.2f} {'':8s} {scale['peak_rss_mb']:8,.0f}")
+        print(f"   Throughput: {scale['rows'] / scale['seconds']:,.0f} raw rows/s")
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Flag the steps that got slower or bigger than in the baseline
+    :param tolerance: Allowed growth as a share of the baseline (0.25 = 25%)
+    :return: list of dicts, one per regression
+    """
+    print("\n" + "=" * 60)
+    print(f"COMPARISON WITH BASELINE ({baseline['created']})")
+    print("=" * 60)
+
+    for key in ['machine', 'settings']:
+        changed = {name: (baseline[key].get(name), value) for name, value in results[key].items()
+                   if baseline[key].get(name) != value and name != 'repeats'}
+        if changed:
+            print(f"   Warning: {key} differs from the baseline: "
+                  + ", ".join(f"{name} {old} -> {new}" for name, (old, new) in changed.items()))
+
+    regressions = []
+    for label, scale in results['scales'].items():
+        before = baseline['scales'].get(label)
+        if before is None:
+            print(f"\n   {label}: not in the baseline")
+            continue
+        if before['sample'] != scale['sample']:
+            print(f"\n   Warning: the {label} sample differs from the baseline's (generator or plan changed)")
+
+        print(f"\n   {label} rows")
+        print(f"   {'step':52s} {'base s':>8s} {'now s':>8s} {'change':>8s} {'base MB':>8s} {'now MB':>8s}")
+        rows = [(step, before['steps'].get(step), record) for step, record in scale['steps'].items()]
+        rows.append(('total', before, scale))
+        for step, old, new in rows:
+            if old is None:
+                print(f"   {step:52s} {'-':>8s} {new['wall_s']:8.2f}     new")
+                continue
+            old_s, new_s = old.get('wall_s', old.get('seconds')), new.get('wall_s', new.get('seconds'))
+            flags = []
+            if new_s > old_s * (1 + tolerance) and new_s - old_s > MIN_REGRESSION_SECONDS:
+                flags.append('SLOWER')
+            if new['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance) \
+                    and new['peak_rss_mb'] - old['peak_rss_mb'] > MIN_REGRESSION_MB:
+                flags.append('BIGGER')
+            for flag in flags:
+                regressions.append({'scale': label, 'step': step, 'flag': flag, 'baseline_s': old_s, 'seconds': new_s,
+                                    'baseline_mb': old['peak_rss_mb'], 'peak_mb': new['peak_rss_mb']})
+            change = f"{(new_s / old_s - 1) * 100:+.0f}%" if old_s > 0 else '-'
+            print(f"   {step:52s} {old_s:8.2f} {new_s:8.2f} {change:>8s} {old['peak_rss_mb']:8,.0f} "
+                  f"{new['peak_rss_mb']:8,.0f}  {' '.join(flags)}".rstrip())
+
+        for step in before['steps']:
+            if step not in scale['steps']:
+                print(f"   {step:52s} {before['steps'][step]['wall_s']:8.2f} {'-':>8s}  removed")
+
+    print(f"\n   Regressions (over {tolerance:.0%}): {len(regressions)}")
+    for regression in regressions:
+        print(f"      {regression['scale']} {regression['step']}: {regression['flag']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data of a given size")
+    parser.add_argument('workdir', nargs='?', default=os.path.join(tempfile.gettempdir(), 'ds4200_benchmark'),
+                        help="Directory for the synthetic samples, reused between runs "
+                             "(default: ds4200_benchmark in the temp directory)")
+    parser.add_argument('--scales', nargs='+', default=DEFAULT_SCALES,
+                        help=f"Raw chart rows per sample, 10K to 100M (default: {' '.join(DEFAULT_SCALES)})")
+    parser.add_argument('--repeats', type=int, default=1, help="Runs per scale, best kept (default: 1)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data (default: 0)")
+    parser.add_argument('--format', choices=storage.FORMATS, default=storage.DEFAULT_FORMAT,
+                        help=f"Storage format for intermediate tables (default: {storage.DEFAULT_FORMAT})")
+    parser.add_argument('--filter-mode', choices=['eager', 'streaming', 'parallel'], default='streaming',
+                        help="How the raw charts file is filtered (default: streaming)")
+    parser.add_argument('--backend', choices=['pandas', 'polars'], default='pandas',
+                        help="Execution backend (default: pandas)")
+    parser.add_argument('--baseline', default=None,
+                        help="Baseline results to compare against (default: data/benchmarks/baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Slowdown or memory growth flagged as a regression (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.format, args.filter_mode, args.backend)
+    else:
+        results = run_benchmark(args.workdir, args.scales, args.repeats, fmt=args.format,
+                                filter_mode=args.filter_mode, backend=args.backend, seed=args.seed)
+        baseline_path = args.baseline or default_baseline_path()
+        regressions = []
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+        elif not args.save_baseline:
+            print(f"\nNo baseline at {baseline_path}, run with --save-baseline to create one")
+        if args.save_baseline:
+            with open(baseline_path, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"\nBaseline saved to: {baseline_path}")
+        elif regressions:
+            # A non-zero exit lets a nightly job fail on a regression
+            sys.exit(1)
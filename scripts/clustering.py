@@ -0,0 +1,272 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import time
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+
+import storage
+import topk
+from aggregation import AggregationPlanner
+
+FEATURES = ['danceability', 'energy', 'valence', 'tempo', 'acousticness', 'loudness', 'speechiness']
+
+# What one clustered vector is: a track's audio features, or the mean features of a
+# region's chart over a week or a day (the pandas period of the chart date)
+GRANULARITIES = {'track': None, 'region_week': 'W', 'region_day': 'D'}
+
+# Engineered columns the vectors are built from
+ROW_COLUMNS = ['track_id', 'region', 'date'] + FEATURES
+
+# Rows read per batch; together with the sample below this bounds memory whatever the table size
+BATCH_ROWS = 64 * 1024
+
+# Candidate cluster counts, the uniform sample of vectors they are compared on, and the part
+# of that sample silhouette is computed on (it is quadratic in the points)
+K_RANGE = range(2, 9)
+SAMPLE_SIZE = 20_000
+SILHOUETTE_SAMPLE = 3000
+
+# Passes of mini-batch updates over the stream after the centroids are seeded from the sample
+EPOCHS = 2
+
+
+def frame_batches(df, batch_rows=BATCH_ROWS):
+    """Batches of an in-memory frame, for callers that already loaded the rows"""
+    return lambda: (df.iloc[start:start + batch_rows] for start in range(0, len(df), batch_rows))
+
+
+def track_vectors(row_batches):
+    """One vector per track, from the first batch it appears in; only the seen ids are kept"""
+    seen = set()
+    for batch in row_batches:
+        batch = batch.drop_duplicates(subset='track_id')
+        # Set lookups stay O(batch); Series.isin() would rebuild a lookup of every seen id per batch
+        new = np.fromiter((track_id not in seen for track_id in batch['track_id']), bool, len(batch))
+        batch = batch[new]
+        seen.update(batch['track_id'])
+        if len(batch):
+            yield batch[['track_id'] + FEATURES].reset_index(drop=True)
+
+
+def profile_vectors(row_batches, period):
+    """
+    Mean features per (region, period): additive sums and counts per batch, merged as they arrive
+    :param period: pandas period alias, 'W' or 'D'
+    :return: pd.DataFrame with region, period (its start date), rows and the mean features
+    """
+    planner = AggregationPlanner()
+    base = {'keys': ['region', 'period'], 'measures': FEATURES, 'squares': False}
+    totals = None
+    for batch in row_batches:
+        frame = pd.DataFrame({
+            'region': batch['region'].astype(str).to_numpy(),
+            'period': pd.to_datetime(batch['date']).dt.to_period(period).dt.start_time.dt.strftime('%Y-%m-%d'),
+        })
+        frame[FEATURES] = batch[FEATURES].to_numpy('float64')
+        table = planner._scan(frame, base)
+        totals = table if totals is None else pd.concat([totals, table]).groupby(level=[0, 1]).sum()
+
+    if totals is None:
+        return pd.DataFrame(columns=['region', 'period', 'rows'] + FEATURES)
+    means = AggregationPlanner._finish(totals, {'measures': FEATURES, 'stat': 'mean'})
+    return means.assign(rows=totals['_size']).reset_index()[['region', 'period', 'rows'] + FEATURES]
+
+
+def vector_batches(rows, granularity, batch_rows=BATCH_ROWS):
+    """
+    The vectors of a granularity as a re-iterable stream of batches
+    :param rows: Callable returning a fresh iterator of engineered row batches
+    :return: Callable returning a fresh iterator of vector batches (one pass over the rows per call)
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {list(GRANULARITIES)}")
+    if granularity == 'track':
+        return lambda: track_vectors(rows())
+
+    # Profiles are one row per (region, period), far fewer than the rows, so they are built once
+    profiles = profile_vectors(rows(), GRANULARITIES[granularity])
+    return frame_batches(profiles, batch_rows)
+
+
+def _complete(batch):
+    return batch[FEATURES].dropna().to_numpy('float64')
+
+
+def fit(vectors, k=None, k_range=K_RANGE, epochs=EPOCHS, seed=0):
+    """
+    Mini-batch k-means over standardized feature vectors that arrive in batches.
+    Pass 1 accumulates the scaler statistics and a fixed-size uniform sample; k is the best
+    silhouette on that sample, its centroids seed the model, and the later passes refine them
+    one batch at a time.
+    :param vectors: Callable returning a fresh iterator of DataFrames with the FEATURES columns
+    :param k: Number of clusters (default: chosen from k_range)
+    :param epochs: Passes of mini-batch updates
+    :return: dict: The model, as saved by save_model()
+    """
+    rng = np.random.default_rng(seed)
+    scaler = StandardScaler()
+    sample = sample_keys = None
+    n_vectors = 0
+    for batch in vectors():
+        values = _complete(batch)
+        if not len(values):
+            continue
+        scaler.partial_fit(values)
+        n_vectors += len(values)
+
+        # The vectors with the smallest random keys so far are a uniform sample of the stream
+        keys = rng.random(len(values))
+        if sample is not None:
+            values, keys = np.vstack([sample, values]), np.concatenate([sample_keys, keys])
+        keep = topk.select_top(keys, SAMPLE_SIZE, largest=False)
+        sample, sample_keys = values[keep], keys[keep]
+
+    if sample is None:
+        raise ValueError("No complete feature vectors to cluster")
+    sample = scaler.transform(sample)
+
+    scores = {}
+    if k is None:
+        silhouette_size = min(SILHOUETTE_SAMPLE, len(sample))
+        for candidate in k_range:
+            if candidate >= len(sample):
+                break
+            labels = MiniBatchKMeans(candidate, n_init=3, random_state=seed).fit_predict(sample)
+            if len(np.unique(labels)) > 1:
+                scores[candidate] = float(silhouette_score(sample, labels, sample_size=silhouette_size,
+                                                           random_state=seed))
+        if not scores:
+            raise ValueError(f"Too few distinct vectors ({len(sample)}) to choose k")
+        k = max(scores, key=scores.get)
+
+    seeds = MiniBatchKMeans(k, n_init=3, random_state=seed).fit(sample).cluster_centers_
+    model = MiniBatchKMeans(k, init=seeds, n_init=1, random_state=seed)
+    for _ in range(epochs):
+        for batch in vectors():
+            values = _complete(batch)
+            # A partial fit needs at least k vectors; a short tail batch is left out of the pass
+            if len(values) >= k:
+                model.partial_fit(scaler.transform(values))
+    centroids = model.cluster_centers_ if hasattr(model, 'cluster_centers_') else seeds
+
+    return {'features': FEATURES, 'k': int(k), 'vectors': n_vectors,
+            'mean': scaler.mean_.tolist(), 'scale': scaler.scale_.tolist(),
+            'centroids': np.asarray(centroids).tolist(),
+            'silhouette': {str(c): s for c, s in scores.items()}}
+
+
+def assign(df, model):
+    """
+    Nearest persisted centroid of every row, without refitting
+    :param df: Rows (or vectors) with the model's feature columns
+    :param model: dict from fit() or load_model()
+    :return: pd.Series of cluster numbers (Int64, missing where a feature is missing)
+    """
+    values = (df[model['features']].to_numpy('float64') - np.array(model['mean'])) / np.array(model['scale'])
+    centroids = np.array(model['centroids'])
+    distances = ((values[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    labels = pd.Series(np.nan_to_num(distances, nan=np.inf).argmin(axis=1), index=df.index)
+    return labels.where(~np.isnan(values).any(axis=1)).astype('Int64')
+
+
+def centroid_profiles(model):
+    """Centroids back in the original feature units, one row per cluster"""
+    centroids = np.array(model['centroids']) * np.array(model['scale']) + np.array(model['mean'])
+    return pd.DataFrame(centroids, columns=model['features']).rename_axis('cluster')
+
+
+def model_path(granularity):
+    return os.path.join(storage.data_dir(), 'processed', f'{granularity}_clusters.json')
+
+
+def save_model(model):
+    with open(model_path(model['granularity']), 'w') as f:
+        json.dump(model, f, indent=2)
+
+
+def load_model(granularity):
+    path = model_path(granularity)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No {granularity} clustering stored, run clustering.py --granularity {granularity}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_assignments(vectors, model):
+    """
+    Label every vector with its cluster and stream them to data/processed/{granularity}_clusters.csv
+    :return: pd.DataFrame of vector counts per cluster (and per region for profiles)
+    """
+    path = os.path.join(storage.data_dir(), 'processed', f"{model['granularity']}_clusters.csv")
+    counts = None
+    header = True
+    for batch in vectors():
+        labelled = batch.assign(cluster=assign(batch, model))
+        labelled.to_csv(path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+        keys = ['region', 'cluster'] if 'region' in labelled.columns else ['cluster']
+        part = labelled.groupby(keys).size()
+        counts = part if counts is None else counts.add(part, fill_value=0)
+
+    if counts is None:
+        return pd.DataFrame()
+    counts = counts.astype(int)
+    return counts.unstack(fill_value=0) if counts.index.nlevels > 1 else counts.to_frame('vectors')
+
+
+def cluster(rows, granularity='region_week', k=None, epochs=EPOCHS, seed=0, refit=True):
+    """
+    Fit (or load), persist and apply the clustering at one granularity
+    :param rows: Callable returning a fresh iterator of engineered row batches
+    :param granularity: One of GRANULARITIES
+    :param k: Number of clusters (default: chosen by silhouette)
+    :param refit: False assigns with the stored centroids instead of fitting new ones
+    :return: (model, counts per cluster)
+    """
+    start = time.perf_counter()
+    vectors = vector_batches(rows, granularity)
+    if refit:
+        model = fit(vectors, k, epochs=epochs, seed=seed)
+        model['granularity'] = granularity
+        save_model(model)
+    else:
+        model = load_model(granularity)
+    counts = write_assignments(vectors, model)
+
+    print(f"\n{granularity}: {model['vectors']:,} vectors, k={model['k']}"
+          f"{' (by silhouette)' if model['silhouette'] else ''}, {time.perf_counter() - start:.1f}s")
+    if model['silhouette']:
+        print("   Silhouette: " + ", ".join(f"k={c}: {s:.3f}" for c, s in model['silhouette'].items()))
+
+    profiles = centroid_profiles(model)
+    sizes = counts.sum(axis=0) if 'region' in counts.index.names else counts['vectors']
+    for label, centroid in profiles.iterrows():
+        print(f"   Cluster {label + 1} ({int(sizes.get(label, 0)):,}): "
+              f"danceability {centroid['danceability']:.3f}, energy {centroid['energy']:.3f}, "
+              f"valence {centroid['valence']:.3f}, acousticness {centroid['acousticness']:.3f}")
+    return model, counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming mini-batch k-means on audio-feature vectors")
+    parser.add_argument('--granularity', choices=list(GRANULARITIES), default='region_week',
+                        help="Cluster tracks, or region profiles per week or day (default: region_week)")
+    parser.add_argument('--k', type=int, default=None, help="Number of clusters (default: best silhouette)")
+    parser.add_argument('--epochs', type=int, default=EPOCHS, help=f"Mini-batch passes (default: {EPOCHS})")
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS,
+                        help=f"Rows read per batch (default: {BATCH_ROWS:,})")
+    parser.add_argument('--assign', action='store_true',
+                        help="Label the current data with the stored centroids instead of refitting")
+    args = parser.parse_args()
+
+    import analysis
+    model, counts = cluster(lambda: analysis.iter_data(ROW_COLUMNS, args.batch_rows), args.granularity,
+                            args.k, args.epochs, refit=not args.assign)
+    if 'region' in counts.index.names:
+        print("\nVectors per region and cluster:")
+        print(counts.rename(columns=lambda c: c + 1).to_string())
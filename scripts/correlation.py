@@ -0,0 +1,210 @@
+import pandas as pd
+import numpy as np
+import argparse
+import time
+
+METHODS = ['pearson', 'spearman']
+
+AUDIO_FEATURES = ['danceability', 'energy', 'valence', 'tempo',
+                  'acousticness', 'loudness', 'speechiness']
+PERFORMANCE_METRICS = ['popularity', 'peak_position', 'weeks_in_chart', 'streams']
+
+# Batch size when the CLI streams the stored table
+BATCH_ROWS = 256 * 1024
+
+
+def _block_moments(values):
+    """
+    Pairwise-complete moments of one block of rows. Entry [i, j] only uses the rows where both
+    column i and column j are present, as DataFrame.corr() does.
+    :param values: 2-D float64 array, NaN where missing
+    :return: dict of 'n', 'mean' (mean of column i over the pair's rows), 'm2' (squared deviations
+        of column i over the pair's rows) and 'cxy' (co-moment), each a (columns x columns) array
+    """
+    present = ~np.isnan(values)
+    w = present.astype(np.float64)
+    counts = w.sum(axis=0)
+
+    # Sums of values centred on the block means avoid cancellation in the sums of squares
+    shift = np.divide(np.where(present, values, 0).sum(axis=0), counts, out=np.zeros(len(counts)), where=counts > 0)
+    x = np.where(present, values - shift, 0.0)
+
+    n = w.T @ w
+    sums = x.T @ w
+    mean = np.divide(sums, n, out=np.zeros_like(sums), where=n > 0)
+    return {'n': n,
+            'mean': mean + shift[:, None],
+            'm2': (x * x).T @ w - sums * mean,
+            'cxy': x.T @ x - sums * mean.T}
+
+
+def _merge_block(a, b):
+    """Chan et al. pairwise update: combine the moments of two disjoint sets of rows"""
+    n = a['n'] + b['n']
+    share = np.divide(b['n'], n, out=np.zeros_like(n), where=n > 0)
+    delta = b['mean'] - a['mean']
+    weight = a['n'] * share
+    return {'n': n,
+            'mean': a['mean'] + delta * share,
+            'm2': a['m2'] + b['m2'] + delta ** 2 * weight,
+            'cxy': a['cxy'] + b['cxy'] + delta * delta.T * weight}
+
+
+def comoments(df, columns, by=None):
+    """
+    Count, means and co-moments of every column pair in one pass, per group if by is given
+    :param df: Rows (a whole table, or one chunk/partition of it)
+    :param columns: Numeric columns to correlate
+    :param by: Optional grouping column(s), e.g. ['region', 'year']
+    :return: dict with 'columns', 'by' and 'groups' (group key tuple -> moments; () when ungrouped)
+    """
+    by = [by] if isinstance(by, str) else list(by or [])
+    values = df[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    if not by:
+        return {'columns': list(columns), 'by': by, 'groups': {(): _block_moments(values)}}
+
+    grouped = df.groupby(by, observed=True, sort=True)
+    # Rows with a missing key are in no group (-1), as in groupby().corr()
+    codes = grouped.ngroup().fillna(-1).to_numpy().astype(np.int64)
+    keys = grouped.size().index
+    keys = keys.tolist() if len(by) > 1 else [(key,) for key in keys]
+
+    # One stable sort of the group codes, then a block of matrix products per group
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    segments = np.split(order, np.flatnonzero(np.diff(codes[order])) + 1)
+    groups = {keys[codes[segment[0]]]: _block_moments(values[segment]) for segment in segments if len(segment)}
+    return {'columns': list(columns), 'by': by, 'groups': groups}
+
+
+def merge_comoments(*parts):
+    """Combine comoments() of separate chunks, partitions or workers of the same table"""
+    groups = {}
+    for part in parts:
+        for key, block in part['groups'].items():
+            groups[key] = block if key not in groups else _merge_block(groups[key], block)
+    return {'columns': parts[0]['columns'], 'by': parts[0]['by'], 'groups': dict(sorted(groups.items()))}
+
+
+def _corr_block(block, columns):
+    denominator = np.sqrt(block['m2'] * block['m2'].T)
+    corr = np.divide(block['cxy'], denominator, out=np.full_like(denominator, np.nan), where=denominator > 0)
+    # Co-moment and variance of a column with itself are the same sum, but not the same float ops
+    np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1.0))
+    return pd.DataFrame(np.clip(corr, -1, 1), index=columns, columns=columns)
+
+
+def corr_from_comoments(moments):
+    """
+    Pearson matrix from co-moments
+    :return: pd.DataFrame (columns x columns), or per group with a (by..., column) row index
+        like DataFrame.groupby(by).corr()
+    """
+    columns = moments['columns']
+    if not moments['by']:
+        return _corr_block(moments['groups'][()], columns)
+
+    frames = [_corr_block(block, columns) for block in moments['groups'].values()]
+    keys = [key[0] if len(key) == 1 else key for key in moments['groups']]
+    return pd.concat(frames, keys=keys, names=moments['by'] + [None])
+
+
+def rank_transform(df, columns, by=None):
+    """
+    Average ranks of every column (within each group if by is given), missing values kept missing.
+    Ranks need every row of a column (or group) at once, so for Spearman on chunks each chunk
+    must hold whole groups, e.g. one (region, year) partition per chunk with by=['region', 'year'].
+    """
+    by = [by] if isinstance(by, str) else list(by or [])
+    ranks = df.groupby(by, observed=True)[columns].rank() if by else df[columns].rank()
+    return pd.concat([df[by], ranks], axis=1) if by else ranks
+
+
+def correlation_matrix(df, columns, method='pearson', by=None):
+    """
+    Correlation matrix of columns in one pass
+    :param method: 'pearson', or 'spearman' (Pearson of the ranks; it equals DataFrame.corr('spearman')
+        when there are no missing values, which pandas re-ranks per column pair instead)
+    :param by: Optional grouping column(s); one matrix per group
+    :return: pd.DataFrame, see corr_from_comoments()
+    """
+    if method == 'spearman':
+        df = rank_transform(df, columns, by)
+    elif method != 'pearson':
+        raise ValueError(f"Unknown method '{method}', expected one of {METHODS}")
+    return corr_from_comoments(comoments(df, columns, by))
+
+
+def verify_against_pandas(df, columns, by=('region', 'year'), chunks=4):
+    """
+    Compare correlation_matrix() with DataFrame.corr() and groupby().corr(), once from a single
+    pass and once merged from separate chunks
+    :return: bool: True if every matrix matches to float tolerance
+    """
+    print("=" * 60)
+    print("CORRELATION PARITY CHECK AGAINST PANDAS")
+    print("=" * 60)
+
+    by = list(by)
+    parts = np.array_split(np.arange(len(df)), chunks)
+    complete = df.dropna(subset=columns)
+
+    start = time.perf_counter()
+    ours = {
+        'pearson': correlation_matrix(df, columns),
+        'pearson (chunks)': corr_from_comoments(merge_comoments(*[comoments(df.iloc[rows], columns)
+                                                                  for rows in parts])),
+        f'pearson by {by}': correlation_matrix(df, columns, by=by),
+        f'pearson by {by} (chunks)': corr_from_comoments(merge_comoments(*[comoments(df.iloc[rows], columns, by)
+                                                                           for rows in parts])),
+        'spearman': correlation_matrix(complete, columns, 'spearman'),
+    }
+    seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pearson = df[columns].corr()
+    grouped = df.groupby(by, observed=True)[columns].corr()
+    expected = {
+        'pearson': pearson,
+        'pearson (chunks)': pearson,
+        f'pearson by {by}': grouped,
+        f'pearson by {by} (chunks)': grouped,
+        'spearman': complete[columns].corr(method='spearman'),
+    }
+    pandas_seconds = time.perf_counter() - start
+
+    all_match = True
+    for name, result in ours.items():
+        match = (result.shape == expected[name].shape
+                 and np.allclose(result.to_numpy(), expected[name].to_numpy(), rtol=1e-9, atol=1e-12,
+                                 equal_nan=True))
+        all_match = all_match and match
+        print(f"   {name:40s}: [{'MATCH' if match else 'MISMATCH'}]")
+    # The five in-memory matrices are not expected to beat pandas; co-moments are for merging
+    # chunks, partitions or workers and for streaming tables that do not fit in memory
+    print(f"\n   Co-moments: {seconds:.2f}s, pandas: {pandas_seconds:.2f}s")
+    print(f"   All matrices match: {all_match}")
+    return all_match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Correlation matrices from mergeable co-moments")
+    parser.add_argument('--method', default='pearson', choices=METHODS, help="Correlation (default: pearson)")
+    parser.add_argument('--by', nargs='*', default=[], help="Grouping columns, e.g. --by region year")
+    parser.add_argument('--verify', action='store_true', help="Check against pandas on the engineered dataset")
+    args = parser.parse_args()
+
+    import analysis
+    columns = AUDIO_FEATURES + PERFORMANCE_METRICS
+    if args.verify:
+        verify_against_pandas(analysis.load_data(columns + ['region', 'year']), columns)
+    elif args.method == 'pearson':
+        # Pearson streams: one batch in memory at a time, merged as it goes
+        moments = None
+        for batch in analysis.iter_data(columns + args.by, BATCH_ROWS):
+            part = comoments(batch, columns, args.by)
+            moments = part if moments is None else merge_comoments(moments, part)
+        print(corr_from_comoments(moments).round(3).to_string())
+    else:
+        print(correlation_matrix(analysis.load_data(columns + args.by), columns, 'spearman', args.by)
+              .round(3).to_string())
@@ -0,0 +1,178 @@
+import pandas as pd
+import argparse
+import os
+import time
+
+import storage
+import topk
+from aggregation import AggregationPlanner
+from schema import apply_schema
+
+CUBE_TABLE = 'rollup_cube'
+TRACK_ROLLUP_TABLE = 'region_track_rollup'
+
+# Cells of the cube; every visualization aggregate is a rollup over a subset of these
+DIMENSIONS = ['year_month', 'region', 'macro_genre', 'mood']
+
+# Additive measures per cell: row count ('_size'), and the sum and non-null count of each of these
+MEASURES = ['streams', 'danceability', 'energy', 'valence', 'tempo', 'acousticness',
+            'loudness', 'speechiness', 'instrumentalness']
+
+# Per-track top lists cannot come from the genre/mood cells, so a second rollup keeps one
+# mergeable row per (region, track)
+TRACK_KEYS = ['region', 'track_id']
+TRACK_AGGREGATIONS = {
+    'track_name': 'first',
+    'artist_spotify': 'first',
+    'peak_position': 'min',
+    'weeks_in_chart': 'max',
+    'streams': 'sum'
+}
+
+
+def build_cube(df=None, scan=None):
+    """
+    Count, sums and non-null counts per (month, region, macro_genre, mood) cell in one grouped scan.
+    Rows with a missing mood or genre keep their own cell, so coarser rollups still count them.
+    :param df: Engineered rows
+    :param scan: Alternative scan(base) as accepted by AggregationPlanner.execute() (e.g. a lazy backend)
+    :return: pd.DataFrame with one row per non-empty cell
+    """
+    base = {'keys': DIMENSIONS, 'measures': MEASURES, 'squares': False, 'dropna': False}
+    if scan is None:
+        frame = df.assign(year_month=df['date'].dt.to_period('M'))
+        scan = lambda base: AggregationPlanner()._scan(frame, base)
+
+    data_cube = scan(base).reset_index()
+    # Periods (pandas) and 'YYYY-MM' strings (polars) become the same text key
+    data_cube['year_month'] = data_cube['year_month'].astype(str)
+    return data_cube
+
+
+def build_track_rollup(df):
+    """Name, best peak, longest run and total streams per (region, track)"""
+    return df.groupby(TRACK_KEYS, observed=True).agg(TRACK_AGGREGATIONS).reset_index()
+
+
+def rollup(data_cube, keys, measures=None, stat='mean'):
+    """
+    Roll the cube up to a subset of its dimensions
+    :param keys: Dimensions to keep
+    :param measures: Measures to aggregate; None returns the row count per group
+    :param stat: 'size', 'sum', 'count' or 'mean'
+    :return: Series (row counts) or DataFrame indexed by the keys, as AggregationPlanner returns
+    """
+    request = {'keys': list(keys), 'measures': list(measures or []), 'stat': stat if measures else 'size'}
+    columns = ['_size'] + [f'{m}__{part}' for m in request['measures'] for part in ['sum', 'count']]
+    table = data_cube.groupby(request['keys'], observed=True, sort=True)[columns].sum()
+    return AggregationPlanner._finish(table, request)
+
+
+def _union_categories(frames, columns):
+    """Give the key columns of several frames one set of categories, so concat keeps them categorical"""
+    frames = [apply_schema(frame) for frame in frames]
+    for col in columns:
+        if all(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = frames[0][col].cat.categories.append([f[col].cat.categories for f in frames[1:]]).unique()
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)}) for frame in frames]
+    return frames
+
+
+def merge_cubes(*cubes):
+    """Combine cubes of disjoint rows: every measure is additive, so matching cells are summed"""
+    combined = pd.concat(_union_categories(cubes, DIMENSIONS), ignore_index=True)
+    return combined.groupby(DIMENSIONS, observed=True, sort=True, dropna=False).sum().reset_index()
+
+
+def merge_track_rollups(*rollups):
+    """Combine track rollups of disjoint rows; the earlier rollup's names win"""
+    combined = pd.concat(_union_categories(rollups, TRACK_KEYS), ignore_index=True)
+    return combined.groupby(TRACK_KEYS, observed=True).agg(TRACK_AGGREGATIONS).reset_index()
+
+
+def save_rollups(data_cube, track_rollup, fmt=storage.DEFAULT_FORMAT):
+    storage.write_table(data_cube, CUBE_TABLE, fmt=fmt, partition_cols=['region'])
+    storage.write_table(track_rollup, TRACK_ROLLUP_TABLE, fmt=fmt, partition_cols=['region'])
+
+
+def load_rollups():
+    """
+    The stored cube and track rollup
+    :return: (cube, track rollup)
+    """
+    return tuple(apply_schema(storage.read_table(name)) for name in [CUBE_TABLE, TRACK_ROLLUP_TABLE])
+
+
+def fold_rollups(new_rows):
+    """
+    The stored rollups with newly appended engineered rows folded in, without writing anything
+    :param new_rows: Engineered rows that are not in the rollups yet
+    :return: (cube, track rollup), or None if no rollups are stored yet
+    """
+    if storage.stored_format(CUBE_TABLE) is None or storage.stored_format(TRACK_ROLLUP_TABLE) is None:
+        print("No rollup cube stored yet, run analysis.py to build it")
+        return None
+
+    data_cube, track_rollup = load_rollups()
+    return (merge_cubes(data_cube, build_cube(new_rows)),
+            merge_track_rollups(track_rollup, build_track_rollup(new_rows)))
+
+
+def update_rollups(new_rows):
+    """
+    Fold newly appended engineered rows into the stored rollups and rewrite the files derived from them
+    :return: (cube, track rollup), or None if no rollups are stored yet
+    """
+    rollups = fold_rollups(new_rows)
+    if rollups is not None:
+        save_rollups(*rollups, fmt=storage.stored_format(CUBE_TABLE))
+        write_visualizations(*rollups)
+    return rollups
+
+
+def write_visualizations(data_cube, track_rollup, viz_dir=None):
+    """
+    Derive the aggregate visualization files from the rollups alone
+    :param viz_dir: Output directory (default: data/visualizations)
+    :return: float: Seconds spent
+    """
+    start = time.perf_counter()
+    viz_dir = viz_dir or os.path.join(storage.data_dir(), 'visualizations')
+    os.makedirs(viz_dir, exist_ok=True)
+
+    print("   Monthly genre trends...")
+    monthly_genre = rollup(data_cube, ['year_month', 'macro_genre']).reset_index(name='count')
+    monthly_genre = monthly_genre.rename(columns={'year_month': 'month'})[['macro_genre', 'count', 'month']]
+    monthly_genre.to_csv(os.path.join(viz_dir, 'monthly_genre_trends.csv'), index=False)
+
+    print("   Regional audio feature comparison...")
+    audio_features = ['danceability', 'energy', 'valence', 'tempo', 'acousticness']
+    regional_comparison = rollup(data_cube, ['region'], audio_features).reset_index()
+    regional_comparison.to_csv(os.path.join(viz_dir, 'regional_audio_comparison.csv'), index=False)
+
+    print("   Top tracks by region...")
+    top_by_region = topk.top_k(track_rollup, {'peak_position': 'smallest'}, k=20, by='region')['peak_position']
+    top_by_region.to_csv(os.path.join(viz_dir, 'top_tracks_by_region.csv'), index=False)
+
+    print("   Mood trends over time...")
+    mood_time = rollup(data_cube, ['year_month', 'mood']).reset_index(name='count')
+    mood_time = mood_time.rename(columns={'year_month': 'month'})[['mood', 'count', 'month']]
+    mood_time.to_csv(os.path.join(viz_dir, 'mood_trends.csv'), index=False)
+
+    seconds = time.perf_counter() - start
+    print(f"   Derived from {len(data_cube):,} cube cells and {len(track_rollup):,} track rows "
+          f"in {seconds * 1000:.0f} ms")
+    return seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rollup cube behind the aggregate visualization files")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the rollups from the engineered table")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        import analysis
+        df = analysis.load_data()
+        save_rollups(build_cube(df), build_track_rollup(df),
+                     fmt=storage.stored_format('final_dataset_engineered') or storage.DEFAULT_FORMAT)
+    write_visualizations(*load_rollups())
@@ -0,0 +1,504 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cube
+import instrumentation
+import scope
+import scores
+import star_schema
+import storage
+import track_store
+from feature_engineering import add_scores_and_calendar, add_track_features
+from merge_datasets import clean_columns
+from pipeline import _load_script
+from rank_dynamics import GROUP_KEYS, MOMENTUM_WINDOWS, scale_trend_score
+from schema import apply_schema
+
+RAW_CHARTS = 'spotify-charts.csv'
+FILTERED_TABLE = 'spotify_charts_filtered'
+ENGINEERED_TABLE = 'final_dataset_engineered'
+
+# Carry-over state: one row per (track_id, region) with everything the next chart day needs,
+# plus the day-level improvements that can still fall into a momentum window
+STATE_TABLE = 'chart_state'
+RECENT_TABLE = 'chart_state_recent'
+STATE_META = 'chart_state.json'
+
+# Written before the first write of an append and removed after the last one, so an append that
+# stopped half way is rolled back (on failure, or at the start of the next run) instead of
+# leaving rows that a retry would append a second time
+JOURNAL = 'chart_append_journal.json'
+BACKUP_DIR = 'chart_append_backup'
+
+
+def _state_meta_path():
+    return os.path.join(storage.data_dir(), 'processed', STATE_META)
+
+
+def _journal_path():
+    return os.path.join(storage.data_dir(), 'processed', JOURNAL)
+
+
+def _backup_dir():
+    return os.path.join(storage.data_dir(), 'processed', BACKUP_DIR)
+
+
+def _snapshot(path):
+    """Enough to undo appends to a CSV file (its size) or a Parquet dataset (its files and schema sidecar)"""
+    if not os.path.isdir(path):
+        return {'path': path, 'size': os.path.getsize(path)}
+    with open(os.path.join(path, storage.SCHEMA_FILE)) as f:
+        schema = f.read()
+    files = [os.path.relpath(os.path.join(root, name), path) for root, _, names in os.walk(path) for name in names]
+    return {'path': path, 'files': sorted(files), 'schema': schema}
+
+
+def _undo_appends(snapshot):
+    path = snapshot['path']
+    if 'size' in snapshot:
+        with open(path, 'r+b') as f:
+            f.truncate(snapshot['size'])
+        return
+
+    keep = set(snapshot['files'])
+    for root, dirs, names in os.walk(path, topdown=False):
+        for name in names:
+            if os.path.relpath(os.path.join(root, name), path) not in keep:
+                os.remove(os.path.join(root, name))
+        # Partitions the append created (e.g. a new year) are left empty
+        if root != path and not os.listdir(root):
+            os.rmdir(root)
+    with open(os.path.join(path, storage.SCHEMA_FILE), 'w') as f:
+        f.write(snapshot['schema'])
+
+
+def _begin_append(last_date, appended, rewritten):
+    """
+    Record how to undo the writes of an append before making them
+    :param last_date: Last chart day of the append, saved in the state meta when it commits
+    :param appended: Paths of the files and datasets that rows are appended to
+    :param rewritten: Paths of the files and datasets that are rewritten (backed up whole)
+    """
+    shutil.rmtree(_backup_dir(), ignore_errors=True)
+    os.makedirs(_backup_dir())
+    backups = []
+    for i, path in enumerate(rewritten):
+        backup = os.path.join(_backup_dir(), f'{i}-{os.path.basename(path)}')
+        if os.path.isdir(path):
+            shutil.copytree(path, backup)
+        else:
+            shutil.copy2(path, backup)
+        backups.append({'path': path, 'backup': backup})
+
+    journal = {'last_date': last_date, 'appended': [_snapshot(path) for path in appended], 'rewritten': backups}
+    # Written under another name and renamed, so a journal on disk is always complete
+    with open(_journal_path() + '.tmp', 'w') as f:
+        json.dump(journal, f, indent=2)
+    os.replace(_journal_path() + '.tmp', _journal_path())
+
+
+def _finish_append():
+    os.remove(_journal_path())
+    shutil.rmtree(_backup_dir(), ignore_errors=True)
+
+
+def recover_append():
+    """
+    Roll back an append that did not finish, or clean up after one that finished but stopped
+    before removing its journal
+    :return: bool: True if an append was rolled back
+    """
+    if not os.path.exists(_journal_path()):
+        return False
+    with open(_journal_path()) as f:
+        journal = json.load(f)
+
+    # The state meta is the last write of an append, so a meta at the journal's last day means it committed
+    meta = None
+    if os.path.exists(_state_meta_path()):
+        with open(_state_meta_path()) as f:
+            meta = json.load(f)
+    if meta is not None and meta['last_date'] == journal['last_date'] \
+            and meta['engineered'] == storage.table_signature(ENGINEERED_TABLE):
+        _finish_append()
+        return False
+
+    print(f"\nRolling back an unfinished append of the days up to {journal['last_date']}...")
+    for snapshot in journal['appended']:
+        _undo_appends(snapshot)
+    for entry in journal['rewritten']:
+        if os.path.isdir(entry['path']):
+            shutil.rmtree(entry['path'])
+        elif os.path.exists(entry['path']):
+            os.remove(entry['path'])
+        shutil.move(entry['backup'], entry['path'])
+    if journal['rewritten']:
+        cube.write_visualizations(*cube.load_rollups())
+
+    # The state tables may be half written; without the meta they are rebuilt from the engineered table
+    if os.path.exists(_state_meta_path()):
+        os.remove(_state_meta_path())
+    _finish_append()
+    return True
+
+
+def build_state():
+    """
+    Derive the carry-over state from the engineered table (one full read, after a full run)
+    :return: (state indexed by GROUP_KEYS, recent day-level improvements, meta dict)
+    """
+    print("\nBuilding carry-over state from the engineered table...")
+    fmt = storage.stored_format(ENGINEERED_TABLE)
+    schema = storage.read_schema(ENGINEERED_TABLE, fmt)
+    columns = schema['columns'] if schema else pd.read_csv(storage.processed_path(ENGINEERED_TABLE, fmt), nrows=0).columns
+    if 'best_position_to_date' not in columns:
+        raise ValueError("The engineered table has no best_position_to_date column, rerun feature_engineering.py")
+    df = storage.read_table(ENGINEERED_TABLE,
+                            columns=GROUP_KEYS + ['date', 'rank', 'rank_change', 'best_position_to_date'])
+    df = df.assign(date=pd.to_datetime(df['date']), region=df['region'].astype(str))
+
+    # The first row of each chart day carries that day's rank, as in add_rank_dynamics
+    days = df.drop_duplicates(GROUP_KEYS + ['date']).sort_values(GROUP_KEYS + ['date'], kind='stable')
+    grouped = days.groupby(GROUP_KEYS, sort=False)
+    state = pd.DataFrame({
+        'rows': df.groupby(GROUP_KEYS, sort=False).size(),
+        'last_date': grouped['date'].last(),
+        'last_rank': grouped['rank'].last(),
+        'first_date': grouped['date'].first(),
+        'first_rank': grouped['rank'].first(),
+        'best_rank': grouped['rank'].min(),
+        'best_position': df.groupby(GROUP_KEYS, sort=False)['best_position_to_date'].min(),
+    })
+    best_days = days.join(state['best_rank'], on=GROUP_KEYS)
+    state['best_date'] = (best_days[best_days['rank'] == best_days['best_rank']]
+                          .groupby(GROUP_KEYS, sort=False)['date'].min())
+
+    last_date = df['date'].max()
+    recent = days[days['date'] > last_date - pd.Timedelta(days=max(MOMENTUM_WINDOWS))]
+    recent = recent.assign(improvement=(-recent['rank_change'].astype('float64')).fillna(0))
+
+    meta = {'last_date': str(last_date.date()), 'max_rank': scope.load_scope()['max_rank'],
+            'scores': {name: score['formula'] for name, score in scores.load_scores().items()},
+            'score_constants': scores.catalogue_constants()}
+    print(f"   {len(state):,} (track, region) pairs, {len(recent):,} recent chart days")
+    return state, recent[GROUP_KEYS + ['date', 'improvement']].reset_index(drop=True), meta
+
+
+def save_state(state, recent, meta, fmt):
+    storage.write_table(state.reset_index(), STATE_TABLE, fmt=fmt, partition_cols=['region'])
+    storage.write_table(recent, RECENT_TABLE, fmt=fmt, partition_cols=['region'])
+    with open(_state_meta_path(), 'w') as f:
+        json.dump({**meta, 'engineered': storage.table_signature(ENGINEERED_TABLE)}, f, indent=2)
+
+
+def load_state():
+    """
+    Load the carry-over state, rebuilding it if the engineered table was rewritten since
+    :return: (state, recent, meta)
+    """
+    meta = None
+    if os.path.exists(_state_meta_path()):
+        with open(_state_meta_path()) as f:
+            meta = json.load(f)
+    if meta is None or meta['engineered'] != storage.table_signature(ENGINEERED_TABLE):
+        return build_state()
+
+    state = storage.read_table(STATE_TABLE)
+    state = state.assign(region=state['region'].astype(str)).set_index(GROUP_KEYS)
+    for col in ['first_date', 'best_date', 'last_date']:
+        state[col] = pd.to_datetime(state[col])
+    recent = storage.read_table(RECENT_TABLE)
+    recent = recent.assign(region=recent['region'].astype(str), date=pd.to_datetime(recent['date']))
+    return state, recent, meta
+
+
+def chart_history_features(rows, state, recent, date, max_rank):
+    """
+    Rank dynamics, weeks_in_chart and the best positions of one chart day, from the carry-over state
+    alone: the same values add_rank_dynamics() and engineer_features() give on the full history,
+    except peak_position, which is the best rank as of this day (a full run gives every row the
+    all-time best, so earlier rows of a track that improves keep an older peak until then)
+    :param rows: Merged rows of the day
+    :param state: Carry-over state indexed by GROUP_KEYS (updated in place for the day's tracks)
+    :param recent: Day-level improvements of the trailing momentum window
+    :return: (rows with the new columns, updated state, updated recent)
+    """
+    rows = rows.assign(region=rows['region'].astype(str)).reset_index(drop=True)
+    day = rows.drop_duplicates(GROUP_KEYS)[GROUP_KEYS + ['rank']].set_index(GROUP_KEYS)
+    prior = state.reindex(day.index)
+    seen = prior['rows'].notna().to_numpy()
+
+    rank = day['rank'].to_numpy(dtype='float64')
+    rank_change = np.where(seen, rank - prior['last_rank'].to_numpy(dtype='float64'), np.nan)
+    improvement = np.nan_to_num(-rank_change)
+    features = pd.DataFrame({
+        'rank_change': rank_change,
+        'trend_score': scale_trend_score(np.where(np.isnan(rank_change), max_rank - rank, -rank_change), max_rank),
+    }, index=day.index)
+
+    # Momentum: today's improvement plus the earlier days of the trailing window
+    for window in MOMENTUM_WINDOWS:
+        in_window = recent[recent['date'] > date - pd.Timedelta(days=window)]
+        earlier = in_window.groupby(GROUP_KEYS)['improvement'].sum().reindex(day.index).fillna(0)
+        features[f'momentum_{window}d'] = improvement + earlier.to_numpy()
+
+    first_date = prior['first_date'].where(seen, date)
+    first_rank = prior['first_rank'].where(seen, rank)
+    new_best = ~seen | (rank < prior['best_rank'].to_numpy(dtype='float64'))
+    best_rank = prior['best_rank'].where(~new_best, rank)
+    best_date = prior['best_date'].where(~new_best, date)
+    days_to_peak = (best_date - first_date).dt.days
+    features['days_to_peak'] = days_to_peak
+    features['peak_velocity'] = (first_rank - best_rank) / np.maximum(days_to_peak, 1)
+
+    # Row-level history: running row count and best rank, continuing from the state
+    rows = rows.join(features, on=GROUP_KEYS)
+    previous_rows = prior['rows'].fillna(0).reindex(pd.MultiIndex.from_frame(rows[GROUP_KEYS])).to_numpy()
+    rows['weeks_in_chart'] = (previous_rows + rows.groupby(GROUP_KEYS, sort=False).cumcount() + 1).astype(np.int64)
+    previous_best = prior['best_position'].fillna(np.inf).reindex(pd.MultiIndex.from_frame(rows[GROUP_KEYS]))
+    day_best = rows.groupby(GROUP_KEYS, sort=False)['rank'].cummin().to_numpy()
+    rows['best_position_to_date'] = np.minimum(previous_best.to_numpy(), day_best).astype(np.int64)
+    best_position = rows.groupby(GROUP_KEYS, sort=False)['best_position_to_date'].min()
+    rows['peak_position'] = best_position.reindex(pd.MultiIndex.from_frame(rows[GROUP_KEYS])).to_numpy()
+
+    updated = pd.DataFrame({
+        'rows': prior['rows'].fillna(0) + rows.groupby(GROUP_KEYS, sort=False).size().reindex(day.index),
+        'last_date': date,
+        'last_rank': rank,
+        'first_date': first_date,
+        'first_rank': first_rank,
+        'best_rank': best_rank,
+        'best_date': best_date,
+        'best_position': best_position.reindex(day.index),
+    }, index=day.index)
+    state = pd.concat([state.drop(day.index, errors='ignore'), updated])
+
+    today = pd.DataFrame({'date': date, 'improvement': improvement}, index=day.index).reset_index()
+    recent = pd.concat([recent[recent['date'] > date - pd.Timedelta(days=max(MOMENTUM_WINDOWS))], today],
+                       ignore_index=True)
+    return rows, state, recent
+
+
+def append_days(paths, fmt=None):
+    """
+    Ingest new chart days: filter, merge and engineer only the new rows and append them to the
+    partitioned tables, using the per-(track, region) carry-over state for the history features
+    :param paths: CSV files with the columns of spotify-charts.csv, all dated after the last ingested day
+    :param fmt: Storage format (default: whichever the tables are stored in)
+    :return: pd.DataFrame: The engineered rows that were appended
+    """
+    print("=" * 60)
+    print("DAILY APPEND")
+    print("=" * 60)
+
+    if track_store.merged_layout() != 'wide':
+        raise ValueError("Appending needs the wide merged table, rerun merge_datasets.py --layout wide")
+    if star_schema.engineered_layout() != 'wide':
+        raise ValueError("Appending needs the wide engineered table, rerun feature_engineering.py --layout wide")
+    fmt = fmt or storage.stored_format(ENGINEERED_TABLE)
+    start = time.perf_counter()
+
+    recover_append()
+    state, recent, meta = load_state()
+    registry = scores.load_scores()
+    if (meta.get('scores') != {name: score['formula'] for name, score in registry.items()}
+            or meta.get('score_constants') != scores.catalogue_constants(registry)):
+        raise ValueError("The track catalogue or config/scores.json changed since the last full run, "
+                         "rerun feature_engineering.py")
+
+    # Filter exactly like the filter stage does
+    filter_script = _load_script('filter-spotify_charts.py')
+    with instrumentation.step('filter') as step:
+        raw = pd.concat([pd.read_csv(path, dtype=filter_script.CHART_DTYPES) for path in paths], ignore_index=True)
+        filtered = filter_script._filter_chunk(raw[list(filter_script.CHART_DTYPES)])
+        filtered = filtered.drop_duplicates(subset=['title', 'date', 'region']).reset_index(drop=True)
+        step.update(rows_in=len(raw), rows_out=len(filtered))
+
+    # Checked on the raw days, which all go to the archive, so a day none of whose rows pass the
+    # filter is still recorded as ingested and cannot be archived twice
+    raw_dates = sorted(pd.to_datetime(raw['date']).unique())
+    if raw_dates and raw_dates[0] <= pd.Timestamp(meta['last_date']):
+        raise ValueError(f"Chart days up to {meta['last_date']} are already ingested, "
+                         f"got {pd.Timestamp(raw_dates[0]).date()}")
+    new_dates = sorted(filtered['date'].unique())
+    print(f"\n{len(raw):,} raw rows, {len(filtered):,} kept, days: "
+          f"{', '.join(str(pd.Timestamp(d).date()) for d in raw_dates)}")
+    if not raw_dates:
+        return filtered
+
+    if len(filtered) == 0:
+        merged, engineered, rollups = filtered, filtered, None
+    else:
+        merged, engineered, state, recent = _engineer_days(filtered, new_dates, state, recent, meta)
+        with instrumentation.step('rollups', rows_in=len(engineered)):
+            rollups = cube.fold_rollups(engineered)
+
+    # Everything is computed, now the writes. The state meta goes last: until it is saved the
+    # journal rolls the other writes back, so a failed append can simply be retried.
+    last_date = str(pd.Timestamp(raw_dates[-1]).date())
+    appends = [(filtered, FILTERED_TABLE), (merged, track_store.WIDE_TABLE), (engineered, ENGINEERED_TABLE)]
+    appends = [(rows, name) for rows, name in appends if len(rows)]
+    rollup_tables = [cube.CUBE_TABLE, cube.TRACK_ROLLUP_TABLE] if rollups is not None else []
+    # Keep the raw archive complete, so a full rerun reproduces the appended rows
+    raw_header = pd.read_csv(storage.raw_path(RAW_CHARTS), nrows=0).columns.tolist()
+    with instrumentation.step('write', rows_in=len(engineered)):
+        _begin_append(last_date,
+                      [storage.raw_path(RAW_CHARTS)] + [storage.processed_path(name, fmt) for _, name in appends],
+                      [storage.processed_path(name, storage.stored_format(name)) for name in rollup_tables])
+        try:
+            for rows, name in appends:
+                storage.append_table(rows, name, fmt=fmt)
+            if rollups is not None:
+                cube.save_rollups(*rollups, fmt=storage.stored_format(cube.CUBE_TABLE))
+                cube.write_visualizations(*rollups)
+            raw[raw_header].to_csv(storage.raw_path(RAW_CHARTS), mode='a', header=False, index=False)
+            save_state(state, recent, {**meta, 'last_date': last_date}, fmt)
+        except BaseException:
+            recover_append()
+            raise
+        _finish_append()
+
+    print(f"Appended {len(filtered):,} filtered, {len(merged):,} merged and {len(engineered):,} engineered rows "
+          f"in {time.perf_counter() - start:.2f}s ({len(state):,} (track, region) pairs in the state)")
+    return engineered
+
+
+def _engineer_days(filtered, new_dates, state, recent, meta):
+    """
+    Merge and engineer the filtered rows of new chart days, one day at a time through the carry-over state
+    :return: (merged rows, engineered rows, updated state, updated recent improvements)
+    """
+    with instrumentation.step('merge', rows_in=len(filtered)) as step:
+        merged = clean_columns(track_store.join_features(filtered))
+        step['rows_out'] = len(merged)
+    max_rank = scope.load_scope()['max_rank']
+
+    with instrumentation.step('engineer', rows_in=len(merged)) as step:
+        engineered = []
+        for date in new_dates:
+            rows, state, recent = chart_history_features(merged[merged['date'] == date], state, recent,
+                                                         pd.Timestamp(date), max_rank)
+            engineered.append(rows)
+        engineered = pd.concat(engineered, ignore_index=True)
+        engineered = add_scores_and_calendar(add_track_features(engineered), meta['score_constants'])
+        engineered = apply_schema(engineered)
+        step['rows_out'] = len(engineered)
+    return merged, engineered, state, recent
+
+
+def _same_rows(expected, actual, keys):
+    """Compare two tables regardless of row order, dtype width and category order"""
+    if sorted(expected.columns) != sorted(actual.columns) or len(expected) != len(actual):
+        return False
+    frames = []
+    for frame in [expected, actual[expected.columns]]:
+        frame = frame.assign(**{col: frame[col].astype(object) for col in frame.columns
+                                if isinstance(frame[col].dtype, pd.CategoricalDtype)})
+        frames.append(frame.sort_values(keys, kind='stable').reset_index(drop=True))
+    try:
+        pd.testing.assert_frame_equal(frames[0], frames[1], check_dtype=False, check_exact=False, rtol=1e-6)
+    except AssertionError as error:
+        print(f"      {str(error).splitlines()[0]}")
+        return False
+    return True
+
+
+def verify_append(n_days=3):
+    """
+    Run a full pipeline on the raw charts minus their last n_days days, append those days one
+    at a time, and check every table and rollup matches a full run on all the raw charts
+    :return: bool: True if all tables match
+    """
+    print("=" * 60)
+    print(f"DAILY APPEND vs FULL RECOMPUTE ({n_days} days)")
+    print("=" * 60)
+
+    filter_script = _load_script('filter-spotify_charts.py')
+    analysis = _load_script('analysis.py')
+    raw = pd.read_csv(storage.raw_path(RAW_CHARTS), dtype=str, keep_default_na=False)
+    days = sorted(raw['date'].unique())[-n_days:]
+    stages = [lambda: filter_script.filter_spotify_charts_streaming(),
+              lambda: _load_script('merge_datasets.py').merge_datasets(),
+              lambda: _load_script('feature_engineering.py').engineer_features(),
+              lambda: analysis.create_visualization_data(analysis.load_data())]
+    tables = {FILTERED_TABLE: ['title', 'date', 'region'],
+              track_store.WIDE_TABLE: ['track_id', 'region', 'date', 'track_genre', 'track_name_chart'],
+              ENGINEERED_TABLE: ['track_id', 'region', 'date', 'track_genre', 'track_name_chart'],
+              cube.CUBE_TABLE: cube.DIMENSIONS,
+              cube.TRACK_ROLLUP_TABLE: cube.TRACK_KEYS}
+
+    outputs, timings = {}, []
+    previous = os.environ.get('DS4200_DATA_DIR')
+    features_path = storage.raw_path(track_store.FEATURES_FILE)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in ['full', 'append']:
+                os.environ['DS4200_DATA_DIR'] = os.path.join(tmp, mode)
+                os.makedirs(storage.raw_path(''))
+                shutil.copy(features_path, storage.raw_path(track_store.FEATURES_FILE))
+                history = raw if mode == 'full' else raw[~raw['date'].isin(days)]
+                history.to_csv(storage.raw_path(RAW_CHARTS), index=False)
+                for run in stages:
+                    run()
+
+                if mode == 'append':
+                    for day in days:
+                        day_path = os.path.join(tmp, f'charts-{day}.csv')
+                        raw[raw['date'] == day].to_csv(day_path, index=False)
+                        day_start = time.perf_counter()
+                        append_days([day_path])
+                        timings.append((day, time.perf_counter() - day_start))
+                outputs[mode] = {name: storage.read_table(name) for name in tables}
+    finally:
+        if previous is None:
+            os.environ.pop('DS4200_DATA_DIR', None)
+        else:
+            os.environ['DS4200_DATA_DIR'] = previous
+
+    print("\n" + "=" * 60)
+    for day, seconds in timings:
+        print(f"   append {day}: {seconds:.2f}s")
+    # Appended rows carry the peak as of their day, so peak_position is compared per (track, region),
+    # which is what the rollups and visualizations report
+    for mode, tables_out in outputs.items():
+        engineered = tables_out[ENGINEERED_TABLE]
+        tables_out['peak_position'] = engineered.assign(region=engineered['region'].astype(str)) \
+            .groupby(GROUP_KEYS, as_index=False)['peak_position'].min()
+        tables_out[ENGINEERED_TABLE] = engineered.drop(columns='peak_position')
+    tables['peak_position'] = GROUP_KEYS
+
+    all_match = True
+    for name, keys in tables.items():
+        match = _same_rows(outputs['full'][name], outputs['append'][name], keys)
+        all_match = all_match and match
+        print(f"   {name:28s}: {len(outputs['append'][name]):,} rows [{'MATCH' if match else 'MISMATCH'}]")
+    print(f"\n   Append matches full recompute: {all_match}")
+    return all_match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append new chart days without recomputing the history")
+    parser.add_argument('paths', nargs='*', help="CSV files of new chart days (spotify-charts.csv columns)")
+    parser.add_argument('--rebuild-state', action='store_true',
+                        help="Rebuild the carry-over state from the engineered table")
+    parser.add_argument('--verify', action='store_true',
+                        help="Check that appending the last days of the raw charts matches a full recompute")
+    parser.add_argument('--days', type=int, default=3, help="Days appended by --verify (default: 3)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not (args.verify or args.rebuild_state or args.paths):
+        parser.error("give the CSV files of new chart days, --rebuild-state or --verify")
+    with instrumentation.run('daily_append', enabled=args.profile or args.cprofile, cprofile=args.cprofile):
+        if args.verify:
+            verify_append(args.days)
+        elif args.rebuild_state:
+            save_state(*build_state(), fmt=storage.stored_format(ENGINEERED_TABLE))
+        else:
+            append_days(args.paths)
@@ -0,0 +1,365 @@
+import pandas as pd
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import aiohttp
+except ImportError:  # Only needed to fetch; reading the cache works without it
+    aiohttp = None
+
+import storage
+import track_store
+
+# Overridable so the fetcher can run against a local mock server
+API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+AUTH_URL = os.environ.get('SPOTIFY_AUTH_URL', 'https://accounts.spotify.com/api/token')
+
+# The audio-features endpoint accepts at most 100 IDs per request
+BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 4
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+CACHE_FILE = 'audio_features.sqlite'
+
+# Fields of an audio-features object that match columns of spotify-tracks-features.csv
+AUDIO_FEATURE_COLUMNS = ['danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                         'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_ms', 'time_signature']
+
+# Taken from the chart rows, since the audio-features endpoint has no names
+NAME_COLUMNS = ['track_name', 'artists']
+
+
+def cache_path():
+    """SQLite cache of fetched audio features, next to the other processed data"""
+    return os.path.join(storage.data_dir(), 'processed', CACHE_FILE)
+
+
+def open_cache(path=None):
+    """
+    Open (creating if needed) the audio features cache
+    :return: sqlite3.Connection with one row per fetched track_id; features is NULL when
+        Spotify has no audio features for the track, so it is not asked again
+    """
+    path = path or cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS audio_features "
+                 "(track_id TEXT PRIMARY KEY, features TEXT, fetched_at REAL NOT NULL)")
+    return conn
+
+
+def cached_track_ids(conn):
+    """Every track_id already fetched, with or without features"""
+    return {row[0] for row in conn.execute("SELECT track_id FROM audio_features")}
+
+
+def store_features(conn, track_ids, results, names=None):
+    """
+    Save one batch of results (None = no features for that track)
+    :param names: Optional dict of track_id -> {'track_name', 'artists'} stored with the features
+    """
+    now = time.time()
+    names = names or {}
+    conn.executemany("INSERT OR REPLACE INTO audio_features VALUES (?, ?, ?)",
+                     [(track_id, None if result is None else json.dumps({**result, **names.get(track_id, {})}), now)
+                      for track_id, result in zip(track_ids, results)])
+    conn.commit()
+
+
+def cached_features(path=None):
+    """
+    Load the cached audio features as rows shaped like spotify-tracks-features.csv
+    :return: pd.DataFrame with track_id, NAME_COLUMNS and AUDIO_FEATURE_COLUMNS (empty if there
+        is no cache); popularity, album and genre stay missing for these tracks
+    """
+    path = path or cache_path()
+    columns = ['track_id'] + NAME_COLUMNS + AUDIO_FEATURE_COLUMNS
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns)
+
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT track_id, features FROM audio_features "
+                            "WHERE features IS NOT NULL ORDER BY track_id").fetchall()
+    finally:
+        conn.close()
+
+    records = [{'track_id': track_id, **json.loads(features)} for track_id, features in rows]
+    return pd.DataFrame(records, columns=columns)
+
+
+def missing_tracks(charts_df=None, store=None):
+    """
+    Chart tracks that the inner join in merge_datasets would drop
+    :return: dict of missing track_id -> {'track_name', 'artists'} from its first chart row, sorted by track_id
+    """
+    if charts_df is None:
+        charts_df = storage.read_table('spotify_charts_filtered', columns=['track_id', 'title', 'artist'])
+    store = store or track_store.open_track_store()
+
+    tracks = charts_df.dropna(subset=['track_id']).drop_duplicates('track_id')
+    codes = track_store.encode_track_ids(store, tracks['track_id'])
+    missing = tracks[codes < 0].sort_values('track_id')
+    return {track_id: {'track_name': title, 'artists': artist}
+            for track_id, title, artist in zip(missing['track_id'], missing['title'], missing['artist'])}
+
+
+def _credentials():
+    """Client ID and secret from the environment (or a .env file, as in spotify_api_setup.py)"""
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    client_id = os.getenv("SPOTIFY_CLIENT_ID")
+    client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
+    if not client_id or not client_secret:
+        raise ValueError("Spotify client ID or secret not found in environment variables.")
+    return client_id, client_secret
+
+
+def _backoff(attempt):
+    """Exponential backoff with jitter, capped at BACKOFF_CAP seconds"""
+    return min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+async def _refresh_token(session, state):
+    """Client-credentials token, shared by every request of the session"""
+    async with state['token_lock']:
+        if state.get('token') and state['token'] != state.get('expired'):
+            return
+        credentials = base64.b64encode(f"{state['client_id']}:{state['client_secret']}".encode()).decode()
+        async with session.post(state['auth_url'], data={'grant_type': 'client_credentials'},
+                                headers={'Authorization': f'Basic {credentials}'}) as response:
+            response.raise_for_status()
+            state['token'] = (await response.json())['access_token']
+
+
+async def _fetch_batch(session, track_ids, state, semaphore):
+    """
+    GET one batch of up to BATCH_SIZE audio features, retrying throttled and failed requests
+    :return: list with one features dict (or None) per track_id
+    """
+    url = f"{state['api_url']}/audio-features"
+    for attempt in range(MAX_RETRIES + 1):
+        # A 429 on any request pauses every request until its Retry-After has passed
+        pause = state['resume_at'] - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        try:
+            async with semaphore:
+                await _refresh_token(session, state)
+                async with session.get(url, params={'ids': ','.join(track_ids)},
+                                       headers={'Authorization': f"Bearer {state['token']}"}) as response:
+                    if response.status == 200:
+                        payload = await response.json()
+                        return payload['audio_features']
+                    if response.status == 429:
+                        wait = float(response.headers.get('Retry-After', _backoff(attempt)))
+                        state['resume_at'] = max(state['resume_at'], time.monotonic() + wait)
+                        state['throttled'] += 1
+                        continue
+                    if response.status == 401:
+                        # Token expired mid-run, the next attempt fetches a new one
+                        state['expired'] = state['token']
+                        continue
+                    if response.status < 500:
+                        response.raise_for_status()
+                    state['retries'] += 1
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            state['retries'] += 1
+
+        await asyncio.sleep(_backoff(attempt))
+
+    raise RuntimeError(f"Giving up on a batch of {len(track_ids)} tracks after {MAX_RETRIES} retries")
+
+
+async def fetch_audio_features(track_ids, conn, client_id, client_secret, api_url=None, auth_url=None,
+                               concurrency=DEFAULT_CONCURRENCY, timeout=30, names=None):
+    """
+    Fetch audio features for track_ids in batches over one pooled HTTP session, caching every batch
+    :param track_ids: Track IDs to fetch (none of them should be cached yet)
+    :param conn: Cache connection from open_cache()
+    :param names: Optional track_id -> {'track_name', 'artists'} saved with the features
+    :param concurrency: Requests in flight at once (also the connection pool size)
+    :return: dict with 'fetched', 'found', 'throttled' and 'retries' counts
+    """
+    state = {'api_url': api_url or API_URL, 'auth_url': auth_url or AUTH_URL,
+             'client_id': client_id, 'client_secret': client_secret,
+             'token_lock': asyncio.Lock(), 'resume_at': 0.0, 'throttled': 0, 'retries': 0}
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = [track_ids[i:i + BATCH_SIZE] for i in range(0, len(track_ids), BATCH_SIZE)]
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async def run(batch):
+            return batch, await _fetch_batch(session, batch, state, semaphore)
+
+        fetched = found = 0
+        for done in asyncio.as_completed([run(batch) for batch in batches]):
+            batch, results = await done
+            store_features(conn, batch, results, names)
+            fetched += len(batch)
+            found += sum(result is not None for result in results)
+            if fetched % (BATCH_SIZE * 10) == 0 or fetched == len(track_ids):
+                print(f"   {fetched:,}/{len(track_ids):,} tracks fetched ({found:,} with features)")
+
+    return {'fetched': fetched, 'found': found, 'throttled': state['throttled'], 'retries': state['retries']}
+
+
+def enrich_missing_tracks(charts_df=None, concurrency=DEFAULT_CONCURRENCY, api_url=None, auth_url=None):
+    """
+    Fetch audio features for chart tracks missing from the features file. Cached tracks are
+    never fetched again; track_store picks the cached rows up on its next rebuild.
+    :return: dict of counts from fetch_audio_features() plus 'missing' and 'cached'
+    """
+    if aiohttp is None:
+        raise ImportError("Fetching audio features requires aiohttp (pip install aiohttp)")
+
+    print("\nEnriching chart tracks missing from the features file...")
+    missing = missing_tracks(charts_df)
+    conn = open_cache()
+    try:
+        cached = cached_track_ids(conn)
+        to_fetch = [track_id for track_id in missing if track_id not in cached]
+        print(f"   Missing: {len(missing):,} tracks, already cached: {len(missing) - len(to_fetch):,}, "
+              f"to fetch: {len(to_fetch):,}")
+
+        counts = {'fetched': 0, 'found': 0, 'throttled': 0, 'retries': 0}
+        if to_fetch:
+            client_id, client_secret = _credentials()
+            counts = asyncio.run(fetch_audio_features(to_fetch, conn, client_id, client_secret, api_url=api_url,
+                                                      auth_url=auth_url, concurrency=concurrency, names=missing))
+    finally:
+        conn.close()
+
+    return {'missing': len(missing), 'cached': len(missing) - len(to_fetch), **counts}
+
+
+class _MockSpotifyHandler(BaseHTTPRequestHandler):
+    """Token and audio-features endpoints with random 429s and 500s, for the --mock check"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._send(200, {'access_token': 'mock-token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        ids = parse_qs(url.query).get('ids', [''])[0].split(',')
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            roll = server.rng.random()
+        try:
+            if len(ids) > BATCH_SIZE:
+                return self._send(400, {'error': 'too many ids'})
+            if roll < server.throttle_rate:
+                return self._send(429, {'error': 'rate limited'}, {'Retry-After': '1'})
+            if roll < server.throttle_rate + server.error_rate:
+                return self._send(500, {'error': 'server error'})
+            time.sleep(0.01)
+            # Tracks ending in '0' have no audio features, like some real tracks
+            features = [None if track_id.endswith('0') else
+                        {'id': track_id, **{col: round(server.rng.random(), 3) for col in AUDIO_FEATURE_COLUMNS}}
+                        for track_id in ids]
+            with server.lock:
+                server.served.update(ids)
+            self._send(200, {'audio_features': features})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def mock_check(n_tracks=2000, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Run the fetcher against a local mock server that throttles and fails some requests, then
+    check every track was cached and served once and no more requests than the concurrency
+    limit were in flight
+    :return: bool: True if every check passed
+    """
+    if aiohttp is None:
+        raise ImportError("Fetching audio features requires aiohttp (pip install aiohttp)")
+
+    import tempfile
+    print("=" * 60)
+    print("AUDIO FEATURE FETCHER - MOCK SERVER CHECK")
+    print("=" * 60)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _MockSpotifyHandler)
+    server.lock, server.rng = threading.Lock(), random.Random(0)
+    server.requests = server.in_flight = server.max_in_flight = 0
+    server.served = set()
+    server.throttle_rate, server.error_rate = 0.1, 0.05
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    track_ids = [f'mock{i:018d}' for i in range(n_tracks)]
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, CACHE_FILE)
+        conn = open_cache(path)
+        try:
+            start = time.perf_counter()
+            counts = asyncio.run(fetch_audio_features(track_ids, conn, 'id', 'secret', api_url=f'{base}/v1',
+                                                      auth_url=f'{base}/api/token', concurrency=concurrency))
+            elapsed = time.perf_counter() - start
+            remaining = [track_id for track_id in track_ids if track_id not in cached_track_ids(conn)]
+        finally:
+            conn.close()
+        features = cached_features(path)
+    server.shutdown()
+
+    checks = {
+        'every track cached': not remaining,
+        'each track served once': len(server.served) == n_tracks,
+        f'at most {concurrency} requests in flight': server.max_in_flight <= concurrency,
+        'missing features stored as misses': len(features) == sum(not t.endswith('0') for t in track_ids),
+    }
+    print(f"\n   {n_tracks:,} tracks in {elapsed:.1f}s, {server.requests} requests "
+          f"({counts['throttled']} throttled, {counts['retries']} retried)")
+    for name, ok in checks.items():
+        print(f"   {name:40s}: {'[OK]' if ok else '[FAILED]'}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch audio features for chart tracks missing from the features file")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Requests in flight at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--mock', action='store_true',
+                        help="Check the fetcher against a local mock server instead of the Spotify API")
+    parser.add_argument('--tracks', type=int, default=2000, help="Tracks requested in the --mock check (default: 2000)")
+    args = parser.parse_args()
+
+    if args.mock:
+        print(f"\nAll checks passed: {mock_check(args.tracks, args.concurrency)}")
+    else:
+        counts = enrich_missing_tracks(concurrency=args.concurrency)
+        print(f"\nFetched {counts['fetched']:,} tracks ({counts['found']:,} with features), "
+              f"{counts['throttled']} throttled requests, {counts['retries']} retries")
@@ -0,0 +1,82 @@
+import pandas as pd
+import numpy as np
+
+# Every categorical bucket derived from a numeric column, in one table so other
+# stages can reuse the same definitions.
+#   'cut':    pd.cut with right-closed bins (values outside the bins become NaN)
+#   'select': first matching rule wins, anything else (including NaN) gets 'default'
+BINNING_SPEC = {
+    'energy_level': {
+        'source': 'energy', 'kind': 'cut',
+        'bins': [0, 0.3, 0.6, 1.0],
+        'labels': ['Low Energy', 'Medium Energy', 'High Energy'],
+    },
+    'mood': {
+        'source': 'valence', 'kind': 'cut',
+        'bins': [0, 0.33, 0.66, 1.0],
+        'labels': ['Negative', 'Neutral', 'Positive'],
+    },
+    'danceability_level': {
+        'source': 'danceability', 'kind': 'cut',
+        'bins': [0, 0.5, 0.7, 1.0],
+        'labels': ['Not Danceable', 'Moderately Danceable', 'Very Danceable'],
+    },
+    'tempo_category': {
+        'source': 'tempo', 'kind': 'cut',
+        'bins': [0, 90, 120, 150, 250],
+        'labels': ['Slow', 'Medium', 'Fast', 'Very Fast'],
+    },
+    'sound_type': {
+        'source': 'acousticness', 'kind': 'select',
+        'rules': [('>', 0.5, 'Acoustic'), ('<', 0.2, 'Electronic')],
+        'default': 'Hybrid',
+        'categories': ['Acoustic', 'Electronic', 'Hybrid'],
+    },
+    'popularity_tier': {
+        'source': 'popularity', 'kind': 'cut',
+        'bins': [0, 40, 70, 100],
+        'labels': ['Low Popularity', 'Medium Popularity', 'High Popularity'],
+    },
+    'covid_era': {
+        'source': 'year', 'kind': 'select',
+        'rules': [('in', [2020, 2021], 'During COVID')],
+        'default': 'Post COVID',
+        'categories': ['During COVID', 'Post COVID'],
+    },
+}
+
+_OPERATORS = {
+    '>': lambda values, threshold: values > threshold,
+    '<': lambda values, threshold: values < threshold,
+    '>=': lambda values, threshold: values >= threshold,
+    '<=': lambda values, threshold: values <= threshold,
+    'in': lambda values, options: np.isin(values, options),
+}
+
+
+def bin_column(values, rule):
+    """
+    Bucket one numeric column according to a BINNING_SPEC entry
+    :param values: pd.Series of the source column
+    :param rule: The spec entry
+    :return: pd.Series of categorical labels, aligned with values
+    """
+    if rule['kind'] == 'cut':
+        return pd.cut(values, bins=rule['bins'], labels=rule['labels'])
+
+    array = values.to_numpy()
+    conditions = [_OPERATORS[op](array, threshold) for op, threshold, _ in rule['rules']]
+    labels = np.select(conditions, [label for _, _, label in rule['rules']], default=rule['default'])
+    return pd.Series(pd.Categorical(labels, categories=rule['categories']), index=values.index)
+
+
+def apply_binning(df, spec=BINNING_SPEC, columns=None):
+    """
+    Add the categorical bucket columns to a DataFrame
+    :param df: DataFrame with the source columns
+    :param spec: Bucket definitions (defaults to BINNING_SPEC)
+    :param columns: Only derive these columns (default: every column in the spec)
+    :return: pd.DataFrame with the new columns
+    """
+    columns = list(spec) if columns is None else columns
+    return df.assign(**{name: bin_column(df[spec[name]['source']], spec[name]) for name in columns})
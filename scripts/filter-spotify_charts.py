@@ -1,16 +1,52 @@
 import pandas as pd
+import numpy as np
+import argparse
+import contextlib
+import io
 import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+import instrumentation
+import scope
+import storage
 
-def filter_spotify_charts():
+# Filters shared by every mode, from config/scope.json (or $DS4200_SCOPE)
+SCOPE = scope.load_scope()
+MIN_DATE = SCOPE['min_date']
+MAX_RANK = SCOPE['max_rank']
+
+# Regions that represent different geographic/cultural areas; None keeps every region
+REGIONS_TO_KEEP = SCOPE['regions']
+
+# Columns the later stages actually use ('chart' is dropped by merge_datasets)
+# with explicit dtypes so pandas never has to infer them
+CHART_DTYPES = {
+    'title': str,
+    'rank': 'int16',
+    'date': str,
+    'artist': str,
+    'url': str,
+    'region': 'category',
+    'trend': 'category',
+    'streams': 'float64',
+}
+
+DEFAULT_CHUNK_SIZE = 500_000
+
+# Size of the byte ranges handed to each parallel worker task
+DEFAULT_RANGE_BYTES = 64_000_000
+
+
+def filter_spotify_charts(fmt=storage.DEFAULT_FORMAT):
     """Filter the large Spotify charts dataset to manageable size"""
 
     print("Filtering Spotify Charts Dataset")
 
     # Load the big dataset - use correct path relative to project root
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(script_dir)
-    input_file = os.path.join(project_root, 'data', 'raw', 'spotify-charts.csv')
+    input_file = storage.raw_path('spotify-charts.csv')
 
     print(f"\nLoading {input_file}...")
 
@@ -21,7 +57,9 @@ def filter_spotify_charts():
             f"Please ensure the file exists at: data/raw/spotify-charts.csv"
         )
 
-    df = pd.read_csv(input_file)
+    with instrumentation.step('read_csv') as step:
+        df = pd.read_csv(input_file)
+        step['rows_out'] = len(df)
 
     print(f"Original shape: {df.shape}")
     print(f"Original size: ~3.6 GB")
@@ -33,8 +71,10 @@ def filter_spotify_charts():
     print(f"Sample regions: {df['region'].unique()[:10].tolist()}")
 
     # Filter 1: Keep only recent years (2020-2024)
-    print("\nFiltering by date (2020-01-01 onwards)...")
-    df = df[df['date'] >= '2020-01-01']
+    print(f"\nFiltering by date ({MIN_DATE} onwards)...")
+    with instrumentation.step('date_filter', rows_in=len(df)) as step:
+        df = df[df['date'] >= MIN_DATE]
+        step['rows_out'] = len(df)
     print(f"   After date filter: {df.shape}")
 
     # Filter 2: Keep only specific regions for geographic analysis
@@ -43,37 +83,36 @@ def filter_spotify_charts():
     # First, let's see what regions are available
     print(f"Available regions: {sorted(df['region'].unique())}")
 
-    # Choose regions that represent different geographic/cultural areas
-    regions_to_keep = [
-        'United States',
-        'United Kingdom',
-        'Brazil',
-        'Japan',
-        'India',
-        'Global'  # if available
-    ]
-
     # Only keep regions that exist in the data
-    regions_to_keep = [r for r in regions_to_keep if r in df['region'].unique()]
+    available = df['region'].unique()
+    regions_to_keep = available.tolist() if REGIONS_TO_KEEP is None else [r for r in REGIONS_TO_KEEP if r in available]
     print(f"   Keeping regions: {regions_to_keep}")
 
-    df = df[df['region'].isin(regions_to_keep)]
+    with instrumentation.step('region_filter', rows_in=len(df)) as step:
+        df = df[df['region'].isin(regions_to_keep)]
+        step['rows_out'] = len(df)
     print(f"   After region filter: {df.shape}")
 
-    # Filter 3: Keep only top 50 (not top 200) to reduce size further
-    print("\nFiltering by rank (top 50 only)...")
-    df = df[df['rank'] <= 50]
+    # Filter 3: Keep only the top ranks (top 50 by default) to reduce size further
+    print(f"\nFiltering by rank (top {MAX_RANK} only)...")
+    with instrumentation.step('rank_filter', rows_in=len(df)) as step:
+        df = df[df['rank'] <= MAX_RANK]
+        step['rows_out'] = len(df)
     print(f"   After rank filter: {df.shape}")
 
     # Extract track IDs from Spotify URLs
     print("\nExtracting track IDs from URLs...")
-    df['track_id'] = df['url'].str.extract(r'track/([a-zA-Z0-9]+)')
+    with instrumentation.step('extract_track_ids', rows_in=len(df)) as step:
+        df['track_id'] = df['url'].str.extract(r'track/([a-zA-Z0-9]+)')
+        step['rows_out'] = len(df)
     print(f"   Track IDs extracted: {df['track_id'].notna().sum()} / {len(df)}")
 
     # Remove duplicates (same song, same date, same region)
     print("\n🧹 Removing duplicates...")
     original_len = len(df)
-    df = df.drop_duplicates(subset=['title', 'date', 'region'])
+    with instrumentation.step('drop_duplicates', rows_in=original_len) as step:
+        df = df.drop_duplicates(subset=['title', 'date', 'region'])
+        step['rows_out'] = len(df)
     print(f"   Removed {original_len - len(df)} duplicate rows")
 
     # Final summary
@@ -84,17 +123,288 @@ def filter_spotify_charts():
     print(f"Estimated size: ~{len(df) * 200 / 1_000_000:.1f} MB")
 
     # Save filtered dataset
-    output_file = os.path.join(project_root, 'data', 'processed', 'spotify_charts_filtered.csv')
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    df.to_csv(output_file, index=False)
+    with instrumentation.step('write', rows_in=len(df)):
+        output_file = storage.write_table(df, 'spotify_charts_filtered', fmt=fmt)
 
     print(f"\nFiltered dataset saved to: {output_file}")
 
     return df
 
 
+def _filter_chunk(chunk):
+    """Apply the region, rank and date filters to one chunk and extract track IDs"""
+    # Cheap categorical/integer predicates first so the date parse only sees survivors
+    keep = chunk['rank'] <= MAX_RANK
+    if REGIONS_TO_KEEP is not None:
+        keep &= chunk['region'].isin(REGIONS_TO_KEEP)
+    chunk = chunk[keep]
+    chunk = chunk.assign(date=pd.to_datetime(chunk['date']))
+    chunk = chunk[chunk['date'] >= MIN_DATE]
+    return chunk.assign(track_id=chunk['url'].str.extract(r'track/([a-zA-Z0-9]+)', expand=False))
+
+
+def _open_seen_keys(path):
+    """
+    Open an on-disk store for the (title, date, region) keys written so far, so the streaming
+    dedup stays exact without holding every key in memory
+    :return: sqlite3.Connection with the written 'keys' and a scratch 'chunk_keys' table
+    """
+    conn = sqlite3.connect(path)
+    # Scratch data: nothing to recover after a crash
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    # A key can only repeat within its (date, region) partition, which leads the primary key,
+    # so each lookup only walks the keys of one partition
+    conn.execute("CREATE TABLE keys (date INTEGER, region TEXT, title TEXT, "
+                 "PRIMARY KEY (date, region, title)) WITHOUT ROWID")
+    conn.execute("CREATE TEMP TABLE chunk_keys (row INTEGER, date INTEGER, region TEXT, title TEXT)")
+    return conn
+
+
+def _drop_seen_duplicates(chunk, seen):
+    """
+    Drop rows whose (title, date, region) key was already written by an earlier chunk
+    :param seen: Connection from _open_seen_keys(); the keys of the kept rows are added to it
+    """
+    chunk = chunk.drop_duplicates(subset=['title', 'date', 'region'])
+    # read_csv turns empty titles into NaN, so '' can stand in for a missing title without a clash
+    keys = zip(range(len(chunk)), chunk['date'].to_numpy().astype('int64').tolist(),
+               chunk['region'].astype(str).tolist(), chunk['title'].fillna('').tolist())
+
+    seen.execute("DELETE FROM chunk_keys")
+    seen.executemany("INSERT INTO chunk_keys VALUES (?, ?, ?, ?)", keys)
+    written = [row for row, in seen.execute("SELECT c.row FROM chunk_keys c "
+                                            "JOIN keys k USING (date, region, title)")]
+    seen.execute("INSERT OR IGNORE INTO keys SELECT date, region, title FROM chunk_keys")
+
+    keep = np.ones(len(chunk), dtype=bool)
+    keep[written] = False
+    return chunk[keep]
+
+
+def _raw_charts_path():
+    """Return the raw charts path, checking the file exists"""
+    input_file = storage.raw_path('spotify-charts.csv')
+
+    if not os.path.exists(input_file):
+        raise FileNotFoundError(
+            f"Could not find {input_file}\n"
+            f"Please ensure the file exists at: data/raw/spotify-charts.csv"
+        )
+
+    return input_file
+
+
+def filter_spotify_charts_streaming(chunk_size=DEFAULT_CHUNK_SIZE, fmt=storage.DEFAULT_FORMAT):
+    """
+    Filter the raw Spotify charts dataset in bounded chunks
+    :param chunk_size: Number of raw rows parsed per chunk
+    :param fmt: Storage format of the filtered table ('parquet' or 'csv')
+    :return: str: Path of the filtered table
+    """
+
+    print("Filtering Spotify Charts Dataset (streaming)")
+
+    input_file = _raw_charts_path()
+
+    print(f"\nStreaming {input_file} in chunks of {chunk_size:,} rows...")
+    print(f"   Keeping regions: {REGIONS_TO_KEEP or 'all'}")
+    print(f"   Keeping dates >= {MIN_DATE} and rank <= {MAX_RANK}")
+
+    start = time.perf_counter()
+    rows_read = 0
+
+    # Parsing, filtering and writing interleave chunk by chunk, so the stream is one step
+    reader = pd.read_csv(input_file, usecols=list(CHART_DTYPES), dtype=CHART_DTYPES, chunksize=chunk_size)
+    with instrumentation.step('stream_filter') as step, tempfile.TemporaryDirectory() as scratch, \
+            contextlib.closing(_open_seen_keys(os.path.join(scratch, 'seen_keys.sqlite'))) as seen, \
+            storage.TableWriter('spotify_charts_filtered', fmt) as writer:
+        for i, chunk in enumerate(reader):
+            rows_read += len(chunk)
+            survivors = _drop_seen_duplicates(_filter_chunk(chunk), seen)
+
+            # Always write the first chunk so the output has a header even if it is empty
+            if i == 0 or len(survivors):
+                writer.write(survivors)
+            print(f"   Chunk {i + 1}: read {rows_read:,} rows, kept {writer.rows:,}")
+        step.update(rows_in=rows_read, rows_out=writer.rows)
+
+    output_file = writer.path
+    rows_written = writer.rows
+
+    elapsed = time.perf_counter() - start
+
+    print("FINAL DATASET SUMMARY")
+    print(f"Rows read: {rows_read:,}")
+    print(f"Rows kept: {rows_written:,}")
+    print(f"Elapsed: {elapsed:.1f}s")
+    peak_mb = instrumentation.peak_memory_mb()
+    if peak_mb is not None:
+        print(f"Peak memory (RSS): {peak_mb:,.0f} MB")
+
+    print(f"\nFiltered dataset saved to: {output_file}")
+
+    return output_file
+
+
+def _byte_ranges(path, range_bytes):
+    """
+    Split a CSV into byte ranges that each start and end on a line boundary
+    :param path: CSV file to split
+    :param range_bytes: Approximate size of each range
+    :return: (header bytes, list of (start, end) offsets after the header)
+    """
+    size = os.path.getsize(path)
+    ranges = []
+
+    with open(path, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        while start < size:
+            end = min(start + range_bytes, size)
+            if end < size:
+                # Move the cut forward to the end of the line it landed in
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+
+    return header, ranges
+
+
+def _filter_byte_range(task):
+    """Worker: parse one byte range of the raw CSV and filter it"""
+    path, header, start, end = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    chunk = pd.read_csv(io.BytesIO(header + data), usecols=list(CHART_DTYPES), dtype=CHART_DTYPES)
+    return _filter_chunk(chunk)
+
+
+def filter_spotify_charts_parallel(workers=None, range_bytes=DEFAULT_RANGE_BYTES, fmt=storage.DEFAULT_FORMAT):
+    """
+    Filter the raw Spotify charts dataset with a process pool over newline-aligned byte ranges.
+    Assumes no quoted field contains a newline, which holds for the Kaggle charts export.
+    :param workers: Number of worker processes (defaults to the CPU count)
+    :param range_bytes: Approximate size of each worker task
+    :param fmt: Storage format of the filtered table ('parquet' or 'csv')
+    :return: str: Path of the filtered table
+    """
+
+    print("Filtering Spotify Charts Dataset (parallel)")
+
+    input_file = _raw_charts_path()
+
+    workers = workers or os.cpu_count()
+
+    # Never hand out fewer ranges than workers, even for small inputs
+    range_bytes = min(range_bytes, -(-os.path.getsize(input_file) // workers))
+    header, ranges = _byte_ranges(input_file, range_bytes)
+    tasks = [(input_file, header, start, end) for start, end in ranges]
+    print(f"\nSplit {input_file} into {len(tasks)} byte ranges for {workers} workers...")
+
+    start = time.perf_counter()
+
+    # map() yields results in input order, so concatenating keeps the file order
+    # The workers' CPU time is counted once the pool has shut down
+    with instrumentation.step('filter_ranges') as step:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_filter_byte_range, tasks))
+
+        df = pd.concat(parts, ignore_index=True)
+        step['rows_out'] = len(df)
+
+    # Duplicates can span ranges, so they are only removed after the merge
+    original_len = len(df)
+    with instrumentation.step('drop_duplicates', rows_in=original_len) as step:
+        df = df.drop_duplicates(subset=['title', 'date', 'region'])
+        step['rows_out'] = len(df)
+    print(f"   Removed {original_len - len(df)} duplicate rows")
+
+    with instrumentation.step('write', rows_in=len(df)):
+        output_file = storage.write_table(df, 'spotify_charts_filtered', fmt=fmt)
+
+    elapsed = time.perf_counter() - start
+
+    print("FINAL DATASET SUMMARY")
+    print(f"Rows kept: {len(df):,}")
+    print(f"Elapsed: {elapsed:.1f}s")
+
+    print(f"\nFiltered dataset saved to: {output_file}")
+
+    return output_file
+
+
+def _run_in_scratch_dir(scratch, func, **kwargs):
+    """Run a filter mode with its output redirected to a scratch data directory"""
+    os.makedirs(os.path.join(scratch, 'raw'), exist_ok=True)
+    os.symlink(_raw_charts_path(), os.path.join(scratch, 'raw', 'spotify-charts.csv'))
+
+    previous = os.environ.get('DS4200_DATA_DIR')
+    os.environ['DS4200_DATA_DIR'] = scratch
+    try:
+        start = time.perf_counter()
+        func(**kwargs)
+        elapsed = time.perf_counter() - start
+        # Compare as CSV so categories and partition order do not matter
+        df = storage.read_table('spotify_charts_filtered').astype(str)
+    finally:
+        if previous is None:
+            del os.environ['DS4200_DATA_DIR']
+        else:
+            os.environ['DS4200_DATA_DIR'] = previous
+
+    return elapsed, df
+
+
+def compare_parallel_to_serial(workers=None, chunk_size=DEFAULT_CHUNK_SIZE, fmt=storage.DEFAULT_FORMAT):
+    """Run the streaming and parallel modes, check the outputs match and report the speedup"""
+    with tempfile.TemporaryDirectory() as tmp:
+        serial_time, serial_df = _run_in_scratch_dir(
+            os.path.join(tmp, 'serial'), filter_spotify_charts_streaming, chunk_size=chunk_size, fmt=fmt)
+        parallel_time, parallel_df = _run_in_scratch_dir(
+            os.path.join(tmp, 'parallel'), filter_spotify_charts_parallel, workers=workers, fmt=fmt)
+
+    identical = serial_df.equals(parallel_df)
+
+    print("\nSERIAL vs PARALLEL")
+    print(f"   Serial:   {serial_time:.1f}s")
+    print(f"   Parallel: {parallel_time:.1f}s")
+    print(f"   Speedup:  {serial_time / parallel_time:.2f}x")
+    print(f"   Outputs identical: {identical}")
+
+    return identical
+
+
 if __name__ == "__main__":
-    filtered_df = filter_spotify_charts()
+    parser = argparse.ArgumentParser(description="Filter the raw Spotify charts dataset")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Read the raw file in bounded chunks instead of all at once")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Rows per chunk in streaming mode (default: {DEFAULT_CHUNK_SIZE:,})")
+    parser.add_argument('--parallel', action='store_true',
+                        help="Filter newline-aligned byte ranges of the raw file in a process pool")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes for parallel mode (default: CPU count)")
+    parser.add_argument('--compare', action='store_true',
+                        help="Run both streaming and parallel modes, verify identical output and report speedup")
+    parser.add_argument('--format', choices=storage.FORMATS, default=storage.DEFAULT_FORMAT,
+                        help=f"Storage format of the filtered table (default: {storage.DEFAULT_FORMAT})")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumentation.run('filter', enabled=args.profile or args.cprofile, cprofile=args.cprofile):
+        if args.compare:
+            compare_parallel_to_serial(workers=args.workers, chunk_size=args.chunk_size, fmt=args.format)
+        elif args.parallel:
+            filter_spotify_charts_parallel(workers=args.workers, fmt=args.format)
+        elif args.streaming:
+            filter_spotify_charts_streaming(chunk_size=args.chunk_size, fmt=args.format)
+        else:
+            filtered_df = filter_spotify_charts(fmt=args.format)
 
     print("\nFiltering complete!")
     print("\nNext steps:")
@@ -0,0 +1,181 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import re
+import time
+
+# Get the project root directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_TAXONOMY_PATH = os.path.join(PROJECT_ROOT, 'config', 'genre_taxonomy.json')
+
+# The 114 track_genre values of the Spotify tracks dataset, used for the benchmark
+KNOWN_GENRES = [
+    'acoustic', 'afrobeat', 'alt-rock', 'alternative', 'ambient', 'anime', 'black-metal', 'bluegrass',
+    'blues', 'brazil', 'breakbeat', 'british', 'cantopop', 'chicago-house', 'children', 'chill',
+    'classical', 'club', 'comedy', 'country', 'dance', 'dancehall', 'death-metal', 'deep-house',
+    'detroit-techno', 'disco', 'disney', 'drum-and-bass', 'dub', 'dubstep', 'edm', 'electro',
+    'electronic', 'emo', 'folk', 'forro', 'french', 'funk', 'garage', 'german', 'gospel', 'goth',
+    'grindcore', 'groove', 'grunge', 'guitar', 'happy', 'hard-rock', 'hardcore', 'hardstyle',
+    'heavy-metal', 'hip-hop', 'honky-tonk', 'house', 'idm', 'indian', 'indie-pop', 'indie',
+    'industrial', 'iranian', 'j-dance', 'j-idol', 'j-pop', 'j-rock', 'jazz', 'k-pop', 'kids', 'latin',
+    'latino', 'malay', 'mandopop', 'metal', 'metalcore', 'minimal-techno', 'mpb', 'new-age', 'opera',
+    'pagode', 'party', 'piano', 'pop-film', 'pop', 'power-pop', 'progressive-house', 'psych-rock',
+    'punk-rock', 'punk', 'r-n-b', 'reggae', 'reggaeton', 'rock-n-roll', 'rock', 'rockabilly', 'romance',
+    'sad', 'salsa', 'samba', 'sertanejo', 'show-tunes', 'singer-songwriter', 'ska', 'sleep',
+    'songwriter', 'soul', 'spanish', 'study', 'swedish', 'synth-pop', 'tango', 'techno', 'trance',
+    'trip-hop', 'turkish', 'world-music',
+]
+
+
+def load_taxonomy(path=DEFAULT_TAXONOMY_PATH):
+    """
+    Load the macro-genre rules and compile one alternation regex per bucket
+    :param path: JSON file with 'buckets' (name + keywords), 'default' and 'missing' labels
+    :return: dict with the compiled buckets and the fallback labels
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    buckets = [(bucket['name'], re.compile('|'.join(re.escape(word.lower()) for word in bucket['keywords'])))
+               for bucket in config['buckets']]
+    keywords = {bucket['name']: [word.lower() for word in bucket['keywords']] for bucket in config['buckets']}
+
+    return {'buckets': buckets, 'keywords': keywords, 'default': config['default'], 'missing': config['missing']}
+
+
+def macro_genre_categories(taxonomy):
+    """Every macro genre label, alphabetical so groupby output matches plain strings"""
+    return sorted({name for name, _ in taxonomy['buckets']} | {taxonomy['default'], taxonomy['missing']})
+
+
+def classify_genre(genre, taxonomy):
+    """
+    Map a single granular genre to its macro genre
+    :param genre: The genre of the track
+    :param taxonomy: Rules from load_taxonomy()
+    :return: str: The macro genre
+    """
+    if pd.isna(genre):
+        return taxonomy['missing']
+
+    genre = genre.lower()
+    for name, pattern in taxonomy['buckets']:
+        if pattern.search(genre):
+            return name
+    return taxonomy['default']
+
+
+def classify_genres(genres, taxonomy=None):
+    """
+    Map a column of granular genres to macro genres, classifying each distinct genre only once
+    :param genres: pd.Series of track_genre values
+    :param taxonomy: Rules from load_taxonomy() (defaults to config/genre_taxonomy.json)
+    :return: pd.Series of categorical macro genres, aligned with genres
+    """
+    taxonomy = taxonomy or load_taxonomy()
+    categories = macro_genre_categories(taxonomy)
+
+    # Missing genres get code -1 here, everything else indexes into uniques
+    codes, uniques = pd.factorize(genres)
+    labels = np.array([categories.index(classify_genre(genre, taxonomy)) for genre in uniques]
+                      + [categories.index(taxonomy['missing'])], dtype=np.int8)
+
+    # codes == -1 picks the trailing 'missing' label
+    macro_codes = labels[codes]
+    return pd.Series(pd.Categorical.from_codes(macro_codes, categories=categories),
+                     index=genres.index, name=genres.name)
+
+
+def categorize_genre(genre):
+    """
+    The hard-coded rules feature_engineering.py applied row by row before the taxonomy config,
+    kept as the reference the benchmark times and checks the classifier against
+    :param genre: The genre of the track
+    :return: str: The genre of the track
+    """
+
+    if pd.isna(genre):
+        return "Genre Unknown"
+
+    genre = genre.lower()
+
+    if any(word in genre for word in ['edm', 'house', 'techno', 'electronic', 'dance', 'dubstep', 'trance']):
+        return "Electronic/Dance"
+
+    elif any(word in genre for word in ['hip', 'rap', 'trap', 'drill']):
+        return "Hip-Hop/Rap"
+
+    elif any(word in genre for word in ['pop', 'k-pop', 'j-pop']):
+        return "Pop"
+
+    elif any(word in genre for word in ['rock', 'metal', 'punk', 'grunge', 'alternative', 'indie']):
+        return 'Rock/Alternative'
+
+    elif any(word in genre for word in ['r-n-b', 'r&b', 'soul', 'funk']):
+        return 'R&B/Soul'
+
+    elif any(word in genre for word in ['latin', 'reggaeton', 'salsa', 'bachata', 'samba']):
+        return 'Latin'
+
+    elif 'country' in genre:
+        return 'Country'
+
+    elif any(word in genre for word in ['jazz', 'blues']):
+        return 'Jazz/Blues'
+
+    elif any(word in genre for word in ['classical', 'orchestra']):
+        return 'Classical'
+
+    elif any(word in genre for word in ['acoustic', 'folk', 'singer-songwriter']):
+        return 'Acoustic/Folk'
+
+    else:
+        return 'Other'
+
+
+def benchmark_classifier(n_rows=10_000_000, seed=42):
+    """Compare the original row-wise categorize_genre apply with the vectorized classifier on synthetic genres"""
+    print("=" * 60)
+    print(f"GENRE CLASSIFIER BENCHMARK ({n_rows:,} rows)")
+    print("=" * 60)
+
+    rng = np.random.default_rng(seed)
+    values = np.array(KNOWN_GENRES + [np.nan], dtype=object)
+    genres = pd.Series(values[rng.integers(0, len(values), n_rows)], name='track_genre')
+    taxonomy = load_taxonomy()
+
+    start = time.perf_counter()
+    row_wise = genres.apply(categorize_genre)
+    row_wise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = classify_genres(genres, taxonomy)
+    vectorized_time = time.perf_counter() - start
+
+    identical = bool((row_wise.astype(str) == vectorized.astype(str)).all())
+
+    print(f"\n   Row-wise apply (categorize_genre): {row_wise_time:.2f}s")
+    print(f"   Vectorized (classify_genres):      {vectorized_time:.2f}s")
+    print(f"   Speedup:                           {row_wise_time / vectorized_time:.1f}x")
+    print(f"   Identical output: {identical}")
+
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Macro-genre classification rules")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Time the original row-wise rules and the vectorized classifier on synthetic data")
+    parser.add_argument('--rows', type=int, default=10_000_000,
+                        help="Rows in the synthetic benchmark (default: 10,000,000)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_classifier(n_rows=args.rows)
+    else:
+        taxonomy = load_taxonomy()
+        for genre in KNOWN_GENRES:
+            print(f"   {genre:20s} -> {classify_genre(genre, taxonomy)}")
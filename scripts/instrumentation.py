@@ -0,0 +1,217 @@
+import pandas as pd
+import cProfile
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+
+import storage
+
+# The run steps are recorded into, or None when profiling is off (steps are then no-ops)
+_RUN = None
+
+
+def peak_memory_mb():
+    """Peak resident set size of this process in MB (None where unsupported)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / 1_000_000 if sys.platform == 'darwin' else peak / 1_000
+
+
+def _proc_memory_mb():
+    """(current, peak since the last reset) RSS in MB from /proc, or None off Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if line.startswith(('VmRSS', 'VmHWM')))
+        return int(fields['VmRSS'].split()[0]) / 1_000, int(fields['VmHWM'].split()[0]) / 1_000
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _reset_peak():
+    """Reset the kernel's peak RSS so the next reading belongs to one step (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _memory(resettable):
+    """
+    Current and peak RSS in MB. With a resettable peak (Linux) the peak is since the last
+    _reset_peak(); elsewhere it is the high-water mark of the whole process.
+    """
+    proc = _proc_memory_mb()
+    if proc is not None and resettable:
+        return proc
+    return (proc[0] if proc else None), peak_memory_mb()
+
+
+def _cpu_seconds():
+    """CPU time of this process and of its finished child processes (e.g. a worker pool)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def rows(value):
+    """Row count of a DataFrame or Series, None for anything else"""
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+def logs_dir():
+    return os.path.join(storage.data_dir(), 'logs')
+
+
+@contextlib.contextmanager
+def run(name, enabled=True, cprofile=False):
+    """
+    Record every step() run inside into a JSON run log, data/logs/{name}-{timestamp}.json.
+    A run started inside another one (a script called by the pipeline) joins the outer run.
+    :param name: Name of the run, e.g. 'pipeline' or 'merge_datasets'
+    :param enabled: False makes this and every step() a no-op
+    :param cprofile: Also dump a cProfile of each top-level step next to the log
+    :return: Context manager yielding the run log dict (None when disabled)
+    """
+    global _RUN
+    if not enabled or _RUN is not None:
+        yield _RUN
+        return
+
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    _RUN = {'run': name, 'argv': sys.argv, 'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'status': 'ok',
+            'steps': [], 'stack': [], 'cprofile': cprofile, 'resettable': _reset_peak(),
+            'path': os.path.join(logs_dir(), f'{name}-{stamp}.json')}
+    log = _RUN
+    frame = {'peak_mb': 0.0}
+    log['stack'].append(frame)
+    start_wall, start_cpu = time.perf_counter(), _cpu_seconds()
+    try:
+        yield log
+    except BaseException:
+        log['status'] = 'failed'
+        raise
+    finally:
+        _RUN = None
+        log['stack'].pop()
+        current_mb, peak_mb = _memory(log['resettable'])
+        log.update(seconds=time.perf_counter() - start_wall, cpu_s=_cpu_seconds() - start_cpu,
+                   peak_rss_mb=max(frame['peak_mb'], peak_mb or 0.0), rss_mb=current_mb)
+        os.makedirs(logs_dir(), exist_ok=True)
+        with open(log['path'], 'w') as f:
+            json.dump({key: value for key, value in log.items() if key not in ('stack', 'resettable')},
+                      f, indent=2, default=str)
+        print_summary(log)
+
+
+@contextlib.contextmanager
+def step(name, rows_in=None):
+    """
+    Time a named step of the active run: wall and CPU seconds, peak and final RSS, rows in and out.
+    Steps nest; a step inside 'feature_engineering' is logged as 'feature_engineering/<name>'.
+    :param rows_in: Rows the step starts from, if known
+    :return: Context manager yielding the step record; set record['rows_out'] inside it
+    """
+    log = _RUN
+    if log is None:
+        yield {}
+        return
+
+    stack = log['stack']
+    # The peak so far belongs to the enclosing steps, before it is reset for this one
+    _, peak_mb = _memory(log['resettable'])
+    for frame in stack:
+        frame['peak_mb'] = max(frame['peak_mb'], peak_mb or 0.0)
+    if log['resettable']:
+        _reset_peak()
+
+    names = [frame['name'] for frame in stack if 'name' in frame] + [name]
+    record = {'step': '/'.join(names), 'rows_in': rows_in, 'rows_out': None}
+    frame = {'name': name, 'peak_mb': 0.0}
+    stack.append(frame)
+
+    # One profile per top-level step; a step inside an already profiled one is part of its profile
+    profiler = None
+    if log['cprofile'] and len(names) == 1 and sys.getprofile() is None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start_wall, start_cpu = time.perf_counter(), _cpu_seconds()
+    status = 'ok'
+    try:
+        yield record
+    except BaseException:
+        status = 'failed'
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - start_wall, _cpu_seconds() - start_cpu
+        if profiler is not None:
+            profiler.disable()
+            profile_path = os.path.splitext(log['path'])[0] + f"-{record['step']}.prof"
+            os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+            profiler.dump_stats(profile_path)
+            record['profile'] = profile_path
+
+        stack.pop()
+        current_mb, peak_mb = _memory(log['resettable'])
+        peak_mb = max(frame['peak_mb'], peak_mb or 0.0)
+        for parent in stack:
+            parent['peak_mb'] = max(parent['peak_mb'], peak_mb)
+        record.update(wall_s=wall, cpu_s=cpu, peak_rss_mb=peak_mb, rss_mb=current_mb, status=status)
+        log['steps'].append(record)
+
+
+def instrumented(name=None):
+    """
+    Decorator form of step(): rows in from the first DataFrame argument, rows out from a
+    DataFrame result
+    :param name: Step name (default: the function name)
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            frames = [arg for arg in args if isinstance(arg, pd.DataFrame)]
+            with step(name or func.__name__, rows_in=rows(frames[0]) if frames else None) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = rows(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def print_summary(log):
+    """Print the steps of a run log in the order they finished (nested steps before their parent)"""
+    def fmt_rows(value):
+        return f"{value:,}" if value is not None else '-'
+
+    def fmt_mb(value):
+        return f"{value:,.0f}" if value is not None else '-'
+
+    print("\n" + "=" * 60)
+    print(f"PROFILE: {log['run']}")
+    print("=" * 60)
+    print(f"   {'step':52s} {'wall s':>8s} {'cpu s':>8s} {'peak MB':>8s} {'rows in':>12s} {'rows out':>12s}")
+    for record in log['steps']:
+        print(f"   {record['step']:52s} {record['wall_s']:8.2f} {record['cpu_s']:8.2f} "
+              f"{fmt_mb(record['peak_rss_mb']):>8s} {fmt_rows(record['rows_in']):>12s} "
+              f"{fmt_rows(record['rows_out']):>12s}")
+    print(f"   {'total':52s} {log['seconds']:8.2f} {log['cpu_s']:8.2f} {fmt_mb(log['peak_rss_mb']):>8s}")
+    print(f"\nRun log: {log['path']}")
+    profiles = [record['profile'] for record in log['steps'] if 'profile' in record]
+    if profiles:
+        print(f"cProfile dumps ({len(profiles)}), e.g. python -m pstats {profiles[0]}")
+
+
+def add_arguments(parser):
+    """The --profile and --cprofile flags every script accepts"""
+    parser.add_argument('--profile', action='store_true',
+                        help="Record wall/CPU time, peak RSS and row counts per step to data/logs/")
+    parser.add_argument('--cprofile', action='store_true',
+                        help="As --profile, and dump a cProfile (.prof) of every top-level step")
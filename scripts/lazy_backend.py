@@ -0,0 +1,475 @@
+import pandas as pd
+import numpy as np
+import argparse
+import ast
+import operator
+import os
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import polars as pl
+except ImportError:  # The lazy backend is optional, pandas stays the reference
+    pl = None
+
+import scope
+import scores
+import storage
+import track_store
+from enrichment import cached_features
+from feature_bins import BINNING_SPEC
+from feature_engineering import REGION_MAP
+from genre_taxonomy import load_taxonomy, macro_genre_categories
+from pipeline import _load_script
+from rank_dynamics import GROUP_KEYS, MOMENTUM_WINDOWS, scale_trend_score
+from schema import apply_schema
+
+BACKENDS = ['pandas', 'polars']
+
+# Rows per piece when a lazy result is streamed from its temporary file into storage
+SINK_BATCH_ROWS = 500_000
+
+ENGINEERED_TABLE = 'final_dataset_engineered'
+
+
+def _check_polars():
+    if pl is None:
+        raise ImportError("The polars backend requires polars (pip install polars), or use --backend pandas")
+
+
+def _filter_script():
+    return _load_script('filter-spotify_charts.py')
+
+
+def scan_table(name):
+    """
+    Lazily scan an intermediate table; filters and column selections applied to the result
+    are pushed down into the Parquet/CSV reader
+    :return: pl.LazyFrame with the columns in their stored order
+    """
+    _check_polars()
+    fmt = storage.stored_format(name)
+    if fmt is None:
+        raise FileNotFoundError(f"Could not find {name}, please run the earlier pipeline stages first")
+    path = storage.processed_path(name, fmt)
+
+    if fmt == 'csv':
+        return pl.scan_csv(path, try_parse_dates=True)
+
+    schema = storage.read_schema(name, fmt)
+    lf = pl.scan_parquet(os.path.join(path, '**', '*.parquet'), hive_partitioning=True,
+                         hive_schema={'region': pl.String, 'year': pl.Int32})
+    # Categoricals come back as plain strings; the categories are restored when writing
+    lf = lf.with_columns([pl.col(col).cast(pl.String) for col in schema['categoricals']
+                          if col in lf.collect_schema().names()])
+    return lf.select(schema['columns'])
+
+
+def sink_table(lf, name, fmt=storage.DEFAULT_FORMAT, transform=None):
+    """
+    Run a lazy plan with the streaming engine and write the result as an intermediate table,
+    piece by piece, so neither side has to hold the whole table in memory
+    :param transform: Optional function applied to every pandas piece before it is written
+    :return: str: Path of the written table
+    """
+    scratch = os.path.join(storage.data_dir(), 'processed')
+    os.makedirs(scratch, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=scratch) as tmp:
+        if storage.pa is not None:
+            result = os.path.join(tmp, 'result.parquet')
+            lf.sink_parquet(result)
+            pieces = (batch.to_pandas() for batch in
+                      storage.pq.ParquetFile(result).iter_batches(batch_size=SINK_BATCH_ROWS))
+        else:
+            result = os.path.join(tmp, 'result.csv')
+            lf.sink_csv(result)
+            pieces = pd.read_csv(result, chunksize=SINK_BATCH_ROWS, parse_dates=['date'])
+
+        with storage.TableWriter(name, fmt) as writer:
+            for piece in pieces:
+                writer.write(transform(piece) if transform else piece)
+
+    print(f"   {name}: {writer.rows:,} rows -> {writer.path}")
+    return writer.path
+
+
+def filter_plan():
+    """Raw charts -> regions, top ranks and dates kept, track_id extracted, duplicates dropped"""
+    _check_polars()
+    script = _filter_script()
+    schema = {'title': pl.String, 'rank': pl.Int16, 'date': pl.String, 'artist': pl.String, 'url': pl.String,
+              'region': pl.String, 'trend': pl.String, 'streams': pl.Float64}
+
+    keep = pl.col('rank') <= script.MAX_RANK
+    if script.REGIONS_TO_KEEP is not None:
+        keep = keep & pl.col('region').is_in(script.REGIONS_TO_KEEP)
+
+    return (pl.scan_csv(script._raw_charts_path(), schema_overrides=schema)
+            .select(list(script.CHART_DTYPES))
+            .filter(keep)
+            .with_columns(pl.col('date').str.to_datetime('%Y-%m-%d', time_unit='ns'))
+            .filter(pl.col('date') >= datetime.fromisoformat(script.MIN_DATE))
+            .with_columns(track_id=pl.col('url').str.extract(r'track/([a-zA-Z0-9]+)', 1))
+            .unique(subset=['title', 'date', 'region'], keep='first', maintain_order=True))
+
+
+def merge_plan():
+    """Filtered charts inner-joined with the track features, cleaned like merge_datasets()"""
+    _check_polars()
+    charts = scan_table('spotify_charts_filtered')
+    features = pl.scan_csv(storage.raw_path(track_store.FEATURES_FILE))
+
+    # Tracks fetched by enrichment.py, as in track_store's features
+    fetched = cached_features()
+    if len(fetched):
+        known = features.select('track_id').collect()['track_id']
+        fetched = pl.from_pandas(fetched).filter(~pl.col('track_id').is_in(known.implode()))
+        features = pl.concat([features, fetched.lazy()], how='diagonal_relaxed')
+
+    merged = charts.join(features, on='track_id', how='inner')
+    names = merged.collect_schema().names()
+    return (merged
+            .drop([col for col in ['Unnamed: 0', 'url', 'chart', 'year', 'month'] if col in names])
+            .rename({'title': 'track_name_chart', 'artist': 'artist_chart', 'artists': 'artist_spotify'})
+            .with_columns(pl.col('date').cast(pl.Datetime('ns')))
+            .with_columns(year=pl.col('date').dt.year(), month=pl.col('date').dt.month()))
+
+
+_OPERATORS = {
+    '>': lambda values, threshold: values > threshold,
+    '<': lambda values, threshold: values < threshold,
+    '>=': lambda values, threshold: values >= threshold,
+    '<=': lambda values, threshold: values <= threshold,
+    'in': lambda values, options: values.is_in(options),
+}
+
+
+def _when_chain(cases, default):
+    """pl.when(...).then(...) chain where the first matching case wins"""
+    (condition, label), rest = cases[0], cases[1:]
+    expr = pl.when(condition).then(pl.lit(label))
+    for condition, label in rest:
+        expr = expr.when(condition).then(pl.lit(label))
+    return expr.otherwise(pl.lit(default, dtype=pl.String))
+
+
+def bin_expr(rule):
+    """A BINNING_SPEC entry as a polars expression (same edges and rules as feature_bins)"""
+    values = pl.col(rule['source'])
+    if rule['kind'] == 'cut':
+        edges = rule['bins']
+        cases = [((values > low) & (values <= high), label)
+                 for low, high, label in zip(edges[:-1], edges[1:], rule['labels'])]
+        return _when_chain(cases, None)
+    return _when_chain([(_OPERATORS[op](values, threshold), label) for op, threshold, label in rule['rules']],
+                       rule['default'])
+
+
+def genre_expr(taxonomy=None):
+    """The macro-genre taxonomy as a polars expression (first bucket with a keyword match wins)"""
+    taxonomy = taxonomy or load_taxonomy()
+    genre = pl.col('track_genre').str.to_lowercase()
+    cases = [(genre.str.contains_any(taxonomy['keywords'][name]), name) for name, _ in taxonomy['buckets']]
+    return (pl.when(pl.col('track_genre').is_null()).then(pl.lit(taxonomy['missing']))
+            .otherwise(_when_chain(cases, taxonomy['default'])))
+
+
+_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+                     ast.Div: operator.truediv, ast.Pow: operator.pow, ast.BitAnd: operator.and_,
+                     ast.BitOr: operator.or_, ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt,
+                     ast.LtE: operator.le, ast.Eq: operator.eq, ast.NotEq: operator.ne}
+
+
+def _lit(value):
+    return value if isinstance(value, pl.Expr) else pl.lit(value)
+
+
+def _formula_expr(node, constants):
+    if isinstance(node, ast.Expression):
+        return _formula_expr(node.body, constants)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return constants[node.id] if node.id in constants else pl.col(node.id)
+    if isinstance(node, ast.BinOp):
+        return _BINARY_OPERATORS[type(node.op)](_formula_expr(node.left, constants),
+                                                _formula_expr(node.right, constants))
+    if isinstance(node, ast.UnaryOp):
+        operand = _formula_expr(node.operand, constants)
+        return {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert}[type(node.op)](operand)
+    if isinstance(node, ast.Compare):
+        return _BINARY_OPERATORS[type(node.ops[0])](_lit(_formula_expr(node.left, constants)),
+                                                    _formula_expr(node.comparators[0], constants))
+
+    args = [_lit(_formula_expr(arg, constants)) for arg in node.args]
+    if node.func.id == 'where':
+        return pl.when(args[0]).then(args[1]).otherwise(args[2])
+    return {'abs': pl.Expr.abs, 'sqrt': pl.Expr.sqrt, 'log': pl.Expr.log, 'exp': pl.Expr.exp}[node.func.id](args[0])
+
+
+def score_expr(score, constants):
+    """A config/scores.json formula as a polars expression (same operations as scores.evaluate_scores)"""
+    return _lit(_formula_expr(score['tree'], constants))
+
+
+def rank_dynamics_plan(lf, max_rank=50):
+    """
+    Same features as rank_dynamics.add_rank_dynamics(), computed on one row per chart day
+    and joined back onto every row
+    """
+    keys = GROUP_KEYS
+    days = (lf.select(keys + ['date', 'rank'])
+            .unique(subset=keys + ['date'], keep='first', maintain_order=True)
+            .with_columns(pl.col('rank').cast(pl.Float64)))
+
+    days = days.with_columns(rank_change=(pl.col('rank') - pl.col('rank').shift(1)).over(keys))
+    raw_trend = pl.when(pl.col('rank_change').is_null()).then(max_rank - pl.col('rank')) \
+        .otherwise(-pl.col('rank_change'))
+
+    days = days.with_columns(
+        trend_score=scale_trend_score(raw_trend, max_rank),
+        _improvement=(-pl.col('rank_change')).fill_null(0),
+        _best_rank=pl.col('rank').cum_min().over(keys),
+    )
+    # A new best on the segment's first day and whenever the rank beats the best so far
+    days = days.with_columns(
+        [pl.col('_improvement').rolling_sum_by('date', window_size=f'{window}d').over(keys)
+         .alias(f'momentum_{window}d') for window in MOMENTUM_WINDOWS],
+        _new_best=(pl.col('rank') < pl.col('_best_rank').shift(1)).over(keys).fill_null(True),
+    )
+    days = days.with_columns(
+        _best_date=pl.when(pl.col('_new_best')).then(pl.col('date')).forward_fill().over(keys),
+    )
+    days = days.with_columns(
+        days_to_peak=(pl.col('_best_date') - pl.col('date').first().over(keys)).dt.total_days(),
+    ).with_columns(
+        peak_velocity=(pl.col('rank').first().over(keys) - pl.col('_best_rank'))
+        / pl.max_horizontal(pl.col('days_to_peak'), pl.lit(1)),
+    )
+
+    dynamics = ['rank_change', 'trend_score'] + [f'momentum_{w}d' for w in MOMENTUM_WINDOWS] \
+        + ['days_to_peak', 'peak_velocity']
+    # Row index keeps the sorted row order through the join
+    return (lf.with_row_index('_row')
+            .join(days.select(keys + ['date'] + dynamics), on=keys + ['date'], how='left')
+            .sort('_row').drop('_row'))
+
+
+def engineer_plan(max_rank=None):
+    """The merged table -> the engineered features of feature_engineering.engineer_features()"""
+    _check_polars()
+    max_rank = scope.load_scope()['max_rank'] if max_rank is None else max_rank
+    if track_store.merged_layout() != 'wide':
+        raise ValueError("The polars backend reads the wide merged table, rerun merge_datasets.py --layout wide")
+
+    lf = scan_table(track_store.WIDE_TABLE).sort(GROUP_KEYS + ['date'], maintain_order=True)
+    lf = rank_dynamics_plan(lf, max_rank)
+
+    registry = scores.load_scores()
+    constants = scores.catalogue_constants(registry)
+    return (lf
+            .with_columns(macro_genre=genre_expr())
+            .with_columns([bin_expr(rule).alias(name) for name, rule in BINNING_SPEC.items()])
+            .with_columns(weeks_in_chart=pl.int_range(1, pl.len() + 1).over(GROUP_KEYS),
+                          peak_position=pl.col('rank').min().over(GROUP_KEYS),
+                          best_position_to_date=pl.col('rank').cum_min().over(GROUP_KEYS))
+            .with_columns(
+                **{name: score_expr(score, constants) for name, score in registry.items()},
+                region_category=pl.col('region').replace_strict(REGION_MAP, default=None, return_dtype=pl.String),
+                quarter=pl.col('date').dt.quarter(),
+                month_name=pl.col('date').dt.strftime('%B'),
+                day_of_week=pl.col('date').dt.strftime('%A'),
+                week_of_year=pl.col('date').dt.week(),
+            ))
+
+
+def _engineered_piece(piece, macro_categories):
+    """Give a streamed piece the same categories as the pandas stage, then the compact schema"""
+    categories = {name: rule.get('labels', rule.get('categories')) for name, rule in BINNING_SPEC.items()}
+    categories['macro_genre'] = macro_categories
+    return apply_schema(piece.assign(**{name: pd.Categorical(piece[name], categories=cats)
+                                        for name, cats in categories.items()}))
+
+
+def filter_spotify_charts_lazy(fmt=storage.DEFAULT_FORMAT):
+    """Polars version of filter_spotify_charts(): the raw CSV is streamed, never fully loaded"""
+    print("Filtering Spotify Charts Dataset (polars)")
+    return sink_table(filter_plan(), 'spotify_charts_filtered', fmt,
+                      transform=lambda piece: piece.astype({'region': 'category', 'trend': 'category'}))
+
+
+def merge_datasets_lazy(fmt=storage.DEFAULT_FORMAT):
+    """Polars version of merge_datasets() (wide layout)"""
+    print("Merging Datasets (polars)")
+    return sink_table(merge_plan(), track_store.WIDE_TABLE, fmt)
+
+
+def engineer_features_lazy(fmt=storage.DEFAULT_FORMAT):
+    """Polars version of engineer_features() (wide layout)"""
+    print("Engineering Features (polars)")
+    macro_categories = macro_genre_categories(load_taxonomy())
+    return sink_table(engineer_plan(), ENGINEERED_TABLE, fmt,
+                      transform=lambda piece: _engineered_piece(piece, macro_categories))
+
+
+def lazy_scan(name=ENGINEERED_TABLE):
+    """
+    A scan(base) for AggregationPlanner.execute(): one lazy grouped scan of a stored table per base,
+    reading only the key and measure columns
+    """
+    _check_polars()
+    lf = scan_table(name)
+    schema = storage.read_schema(name) or {'categoricals': {}}
+    derived = {'year_month': pl.col('date').dt.strftime('%Y-%m')}
+
+    def scan(base):
+        keys, measures = base['keys'], base['measures']
+        values = [pl.col(m).cast(pl.Float64) for m in measures]
+        exprs = [pl.len().alias('_size')]
+        exprs += [v.sum().alias(f'{m}__sum') for m, v in zip(measures, values)]
+        if base['squares']:
+            exprs += [(v ** 2).sum().alias(f'{m}__sumsq') for m, v in zip(measures, values)]
+        exprs += [v.count().alias(f'{m}__count') for m, v in zip(measures, values)]
+
+        plan = lf.with_columns([derived[key].alias(key) for key in keys if key in derived])
+        if base.get('dropna', True):
+            plan = plan.drop_nulls(keys)
+        table = plan.group_by(keys).agg(exprs).collect().to_pandas()
+
+        # Order the groups like pandas does: by category order where the table has one
+        for key in keys:
+            if key in schema['categoricals']:
+                table[key] = pd.Categorical(table[key], categories=schema['categoricals'][key]['categories'])
+        return table.set_index(keys).sort_index()
+
+    return scan
+
+
+def lazy_aggregates(planner, name=ENGINEERED_TABLE):
+    """
+    Answer an AggregationPlanner's requests with lazy grouped scans of a stored table
+    :return: dict of request name -> Series/DataFrame, as planner.execute(df) returns
+    """
+    return planner.execute(scan=lazy_scan(name))
+
+
+def _scratch_data_dir(scratch):
+    """A data directory whose raw files link to the real ones"""
+    os.makedirs(os.path.join(scratch, 'raw'), exist_ok=True)
+    for filename in ['spotify-charts.csv', track_store.FEATURES_FILE]:
+        os.symlink(storage.raw_path(filename), os.path.join(scratch, 'raw', filename))
+    return scratch
+
+
+def _frames_match(expected, actual, keys):
+    """Compare two tables regardless of row order and dtype width; floats to a tolerance"""
+    if sorted(expected.columns) != sorted(actual.columns) or len(expected) != len(actual):
+        return False
+    expected = expected.sort_values(keys, kind='stable').reset_index(drop=True)
+    actual = actual[expected.columns].sort_values(keys, kind='stable').reset_index(drop=True)
+
+    for col in expected.columns:
+        left, right = expected[col], actual[col]
+        if pd.api.types.is_float_dtype(left) or pd.api.types.is_float_dtype(right):
+            if not np.allclose(left.astype('float64'), right.astype('float64'), rtol=1e-5, equal_nan=True):
+                return False
+        elif not ((left.isna().to_numpy() == right.isna().to_numpy()).all()
+                  and (left[left.notna()].astype(str).to_numpy() == right[right.notna()].astype(str).to_numpy()).all()):
+            return False
+    return True
+
+
+def compare_backends(fmt=storage.DEFAULT_FORMAT):
+    """
+    Run filter -> merge -> feature engineering and the analysis aggregations with both backends
+    in scratch data directories and check that every output matches
+    :return: bool: True if all outputs match
+    """
+    _check_polars()
+    analysis = _load_script('analysis.py')
+    pandas_stages = [('filter', lambda: _filter_script().filter_spotify_charts_streaming(fmt=fmt)),
+                     ('merge', lambda: _load_script('merge_datasets.py').merge_datasets(fmt=fmt)),
+                     ('feature_engineering',
+                      lambda: _load_script('feature_engineering.py').engineer_features(fmt=fmt))]
+    polars_stages = [('filter', lambda: filter_spotify_charts_lazy(fmt)),
+                     ('merge', lambda: merge_datasets_lazy(fmt)),
+                     ('feature_engineering', lambda: engineer_features_lazy(fmt))]
+    tables = {'filter': ('spotify_charts_filtered', ['title', 'date', 'region']),
+              'merge': (track_store.WIDE_TABLE, ['track_id', 'region', 'date', 'track_genre']),
+              'feature_engineering': (ENGINEERED_TABLE, ['track_id', 'region', 'date', 'track_genre'])}
+
+    outputs = {}
+    previous = os.environ.get('DS4200_DATA_DIR')
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend, stages in [('pandas', pandas_stages), ('polars', polars_stages)]:
+                os.environ['DS4200_DATA_DIR'] = _scratch_data_dir(os.path.join(tmp, backend))
+                outputs[backend] = {'seconds': {}, 'tables': {}}
+                for stage, run in stages:
+                    start = time.perf_counter()
+                    run()
+                    outputs[backend]['seconds'][stage] = time.perf_counter() - start
+                    outputs[backend]['tables'][stage] = storage.read_table(tables[stage][0])
+
+                start = time.perf_counter()
+                if backend == 'pandas':
+                    aggregates = analysis.plan_aggregations().execute(analysis.load_data())
+                else:
+                    aggregates = lazy_aggregates(analysis.plan_aggregations())
+                outputs[backend]['seconds']['aggregations'] = time.perf_counter() - start
+                outputs[backend]['aggregates'] = aggregates
+    finally:
+        if previous is None:
+            os.environ.pop('DS4200_DATA_DIR', None)
+        else:
+            os.environ['DS4200_DATA_DIR'] = previous
+
+    print("\n" + "=" * 60)
+    print("PANDAS vs POLARS")
+    print("=" * 60)
+    all_match = True
+    for stage, (_, keys) in tables.items():
+        match = _frames_match(outputs['pandas']['tables'][stage], outputs['polars']['tables'][stage], keys)
+        all_match = all_match and match
+        print(f"   {stage:20s}: pandas {outputs['pandas']['seconds'][stage]:6.2f}s, "
+              f"polars {outputs['polars']['seconds'][stage]:6.2f}s [{'MATCH' if match else 'MISMATCH'}]")
+
+    for name, expected in outputs['pandas']['aggregates'].items():
+        actual = outputs['polars']['aggregates'][name]
+        match = len(expected) == len(actual) and np.allclose(np.asarray(expected, dtype='float64'),
+                                                             np.asarray(actual, dtype='float64'))
+        # Month keys are Periods in pandas and 'YYYY-MM' strings in polars; compare as text
+        match = match and all((expected.index.get_level_values(level).astype(str)
+                               == actual.index.get_level_values(level).astype(str)).all()
+                              for level in range(expected.index.nlevels))
+        all_match = all_match and match
+        print(f"   aggregate {name:20s}: [{'MATCH' if match else 'MISMATCH'}]")
+
+    print(f"\n   Aggregations: pandas {outputs['pandas']['seconds']['aggregations']:.2f}s (load + scan), "
+          f"polars {outputs['polars']['seconds']['aggregations']:.2f}s (lazy scan)")
+    print(f"   All outputs match: {all_match}")
+    return all_match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lazy, out-of-core polars backend for the pipeline stages")
+    parser.add_argument('--parity', action='store_true',
+                        help="Run both backends in scratch directories and compare every output")
+    parser.add_argument('--stage', choices=['filter', 'merge', 'feature_engineering'],
+                        help="Run one stage with the polars backend")
+    parser.add_argument('--format', choices=storage.FORMATS, default=storage.DEFAULT_FORMAT,
+                        help=f"Storage format of the written tables (default: {storage.DEFAULT_FORMAT})")
+    args = parser.parse_args()
+
+    if args.parity:
+        compare_backends(fmt=args.format)
+    elif args.stage == 'filter':
+        filter_spotify_charts_lazy(args.format)
+    elif args.stage == 'merge':
+        merge_datasets_lazy(args.format)
+    elif args.stage == 'feature_engineering':
+        engineer_features_lazy(args.format)
+    else:
+        parser.print_help()
@@ -1,44 +1,20 @@
 import pandas as pd
-import os
+import numpy as np
+import argparse
 
-# Get the project root directory
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+import enrichment
+import instrumentation
+import storage
+import track_store
 
+LAYOUTS = ['wide', 'star']
 
-def merge_datasets():
-    """Merge Spotify charts with audio features"""
-
-    print("=" * 60)
-    print("Merging Datasets")
-    print("=" * 60)
-
-    # Load datasets
-    print("\nLoading datasets...")
-    charts_path = os.path.join(PROJECT_ROOT, 'data/processed/spotify_charts_filtered.csv')
-    features_path = os.path.join(PROJECT_ROOT, 'data/raw/spotify-tracks-features.csv')
-
-    charts_df = pd.read_csv(charts_path)
-    features_df = pd.read_csv(features_path)
-
-    print(f"   Charts: {len(charts_df):,} rows")
-    print(f"   Features: {len(features_df):,} rows")
-
-    # Merge on track_id
-    print("\nMerging on track_id...")
-    merged_df = charts_df.merge(
-        features_df,
-        on='track_id',
-        how='inner'  # Only keep tracks that exist in both datasets
-    )
-
-    print(f"   Merged: {len(merged_df):,} rows")
-    print(f"   Unique tracks: {merged_df['track_id'].nunique():,}")
-
-    # Clean up columns
-    print("\nCleaning up columns...")
 
+@instrumentation.instrumented()
+def clean_columns(merged_df):
+    """Drop unused columns, rename to the project names and add year/month"""
     # Drop unnecessary columns
-    columns_to_drop = ['Unnamed: 0', 'url', 'chart']
+    columns_to_drop = ['Unnamed: 0', 'url', 'chart', 'year', 'month']
     merged_df = merged_df.drop(columns=[col for col in columns_to_drop if col in merged_df.columns])
 
     # Rename columns for consistency
@@ -55,6 +31,72 @@ def merge_datasets():
     merged_df['year'] = merged_df['date'].dt.year
     merged_df['month'] = merged_df['date'].dt.month
 
+    return merged_df
+
+
+def merge_datasets(fmt=storage.DEFAULT_FORMAT, layout='wide', enrich=False):
+    """
+    Merge Spotify charts with audio features
+    :param fmt: Storage format of the output
+    :param layout: 'wide' writes one table with the features repeated on every chart row;
+        'star' writes a chart_facts table with an integer track_code and keeps the features
+        only in the track store (join them back with track_store.load_merged())
+    :param enrich: Fetch audio features from the Spotify API for chart tracks missing from
+        the features file first, instead of dropping them in the join
+    """
+
+    print("=" * 60)
+    print("Merging Datasets")
+    print("=" * 60)
+
+    # Load datasets
+    print("\nLoading datasets...")
+    with instrumentation.step('load') as step:
+        charts_df = storage.read_table('spotify_charts_filtered')
+        step['rows_out'] = len(charts_df)
+    if enrich:
+        with instrumentation.step('enrich', rows_in=len(charts_df)):
+            enrichment.enrich_missing_tracks(charts_df)
+    store = track_store.open_track_store()
+
+    print(f"   Charts: {len(charts_df):,} rows")
+    print(f"   Features: {store['rows']:,} rows (track store)")
+
+    # Integer track codes replace the string hash join: an unknown track gets code -1
+    print("\nMerging on track_id...")
+    with instrumentation.step('encode_track_ids', rows_in=len(charts_df)) as step:
+        track_codes = track_store.encode_track_ids(store, charts_df['track_id'])
+        step['rows_out'] = len(track_codes)
+
+    if layout == 'star':
+        facts = charts_df.drop(columns=['track_id']).assign(track_code=track_codes.astype(np.int32))
+        facts = facts[track_codes >= 0].reset_index(drop=True)
+        print(f"   Fact rows: {len(facts):,}")
+
+        print("\nCleaning up columns...")
+        facts = clean_columns(facts)
+        with instrumentation.step('write', rows_in=len(facts)):
+            output_path = storage.write_table(facts, track_store.FACT_TABLE, fmt=fmt)
+
+        print(f"\nChart facts saved to: {output_path}")
+        print(f"   Shape: {facts.shape}")
+        print(f"   File size: ~{storage.path_size(output_path) / 1_000_000:.1f} MB "
+              f"(+ {storage.path_size(track_store.store_dir()) / 1_000_000:.1f} MB track store)")
+        return facts
+
+    # Only keep tracks that exist in both datasets
+    with instrumentation.step('join_features', rows_in=len(charts_df)) as step:
+        merged_df = track_store.join_features(charts_df.assign(track_code=track_codes).drop(columns=['track_id']),
+                                              store=store)
+        step['rows_out'] = len(merged_df)
+
+    print(f"   Merged: {len(merged_df):,} rows")
+    print(f"   Unique tracks: {merged_df['track_id'].nunique():,}")
+
+    # Clean up columns
+    print("\nCleaning up columns...")
+    merged_df = clean_columns(merged_df)
+
     print(f"   Final columns: {len(merged_df.columns)}")
 
     # Show breakdown by region
@@ -81,12 +123,12 @@ def merge_datasets():
                   f"max={merged_df[feature].max():.3f}")
 
     # Save merged dataset
-    output_path = os.path.join(PROJECT_ROOT, 'data/processed/merged_charts_features.csv')
-    merged_df.to_csv(output_path, index=False)
+    with instrumentation.step('write', rows_in=len(merged_df)):
+        output_path = storage.write_table(merged_df, 'merged_charts_features', fmt=fmt)
 
     print(f"\nMerged dataset saved to: {output_path}")
     print(f"   Shape: {merged_df.shape}")
-    print(f"   File size: ~{os.path.getsize(output_path) / 1_000_000:.1f} MB")
+    print(f"   File size: ~{storage.path_size(output_path) / 1_000_000:.1f} MB")
 
     # Check if we meet project requirements
 
@@ -101,6 +143,17 @@ def merge_datasets():
 
 
 if __name__ == "__main__":
-    merged_df = merge_datasets()
+    parser = argparse.ArgumentParser(description="Merge Spotify charts with audio features")
+    parser.add_argument('--format', choices=storage.FORMATS, default=storage.DEFAULT_FORMAT,
+                        help=f"Storage format of the merged table (default: {storage.DEFAULT_FORMAT})")
+    parser.add_argument('--layout', choices=LAYOUTS, default='wide',
+                        help="'wide' merged table, or 'star': chart facts + track features store (default: wide)")
+    parser.add_argument('--enrich', action='store_true',
+                        help="Fetch audio features for chart tracks missing from the features file (needs aiohttp)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumentation.run('merge', enabled=args.profile or args.cprofile, cprofile=args.cprofile):
+        merged_df = merge_datasets(fmt=args.format, layout=args.layout, enrich=args.enrich)
 
     print("\nMerge complete!")
@@ -0,0 +1,335 @@
+import argparse
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import sys
+import time
+
+import instrumentation
+import scope
+import storage
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Files read in 1 MB blocks when hashing
+HASH_BLOCK_SIZE = 1 << 20
+
+PROCESSED_OUTPUTS = ['regional_audio_means.csv', 'genre_evolution.csv',
+                     'regional_clusters.csv', 'correlation_matrix.csv',
+                     'region_week_clusters.csv', 'region_week_clusters.json',
+                     'track_clusters.csv', 'track_clusters.json']
+VISUALIZATION_OUTPUTS = ['monthly_genre_trends.csv', 'regional_audio_comparison.csv',
+                         'energy_valence_scatter.csv', 'energy_valence_density.csv',
+                         'energy_valence_tiles/index.json', 'top_tracks_by_region.csv', 'mood_trends.csv']
+
+
+def _load_script(filename):
+    """Import a script from the scripts directory (works for names like filter-spotify_charts.py)"""
+    module_name = os.path.splitext(filename)[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(SCRIPTS_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    # Register it so process-pool workers can unpickle its functions
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _run_filter(fmt, filter_mode, backend):
+    if backend == 'polars':
+        _load_script('lazy_backend.py').filter_spotify_charts_lazy(fmt=fmt)
+        return
+    module = _load_script('filter-spotify_charts.py')
+    if filter_mode == 'parallel':
+        module.filter_spotify_charts_parallel(fmt=fmt)
+    elif filter_mode == 'streaming':
+        module.filter_spotify_charts_streaming(fmt=fmt)
+    else:
+        module.filter_spotify_charts(fmt=fmt)
+
+
+def _run_merge(fmt, filter_mode, backend):
+    if backend == 'polars':
+        _load_script('lazy_backend.py').merge_datasets_lazy(fmt=fmt)
+    else:
+        _load_script('merge_datasets.py').merge_datasets(fmt=fmt)
+
+
+def _run_feature_engineering(fmt, filter_mode, backend):
+    if backend == 'polars':
+        _load_script('lazy_backend.py').engineer_features_lazy(fmt=fmt)
+    else:
+        _load_script('feature_engineering.py').engineer_features(fmt=fmt)
+
+
+def _aggregates(analysis, df, backend):
+    """The shared analysis aggregates, from the loaded frame or a lazy scan of the stored table"""
+    with instrumentation.step('aggregates', rows_in=len(df)):
+        if backend == 'polars':
+            return _load_script('lazy_backend.py').lazy_aggregates(analysis.plan_aggregations())
+        return analysis.plan_aggregations().execute(df)
+
+
+def _run_analysis(fmt, filter_mode, backend):
+    analysis = _load_script('analysis.py')
+    df = analysis.load_data()
+    analysis.run_analyses(df, _aggregates(analysis, df, backend))
+
+
+def _run_visualization(fmt, filter_mode, backend):
+    analysis = _load_script('analysis.py')
+    df = analysis.load_data()
+    data_cube = None
+    if backend == 'polars':
+        data_cube = _load_script('cube.py').build_cube(scan=_load_script('lazy_backend.py').lazy_scan())
+    analysis.create_visualization_data(df, data_cube)
+
+
+# The DAG, in execution order. Inputs and outputs are ('raw', file), ('table', name),
+# ('config', file), ('scope', file) or ('processed'/'visualizations', file); optional inputs
+# may be absent. Code is (script, functions), where None
+# means the whole file, so editing create_visualization_data only invalidates
+# the visualization stage.
+STAGES = [
+    {
+        'name': 'filter',
+        'run': _run_filter,
+        'inputs': [('raw', 'spotify-charts.csv'), ('scope', 'scope.json')],
+        'outputs': [('table', 'spotify_charts_filtered')],
+        'code': [('filter-spotify_charts.py', None), ('instrumentation.py', None), ('scope.py', None),
+                 ('storage.py', None)],
+    },
+    {
+        'name': 'merge',
+        'run': _run_merge,
+        'inputs': [('table', 'spotify_charts_filtered'), ('raw', 'spotify-tracks-features.csv')],
+        'optional_inputs': [('processed', 'audio_features.sqlite')],
+        'outputs': [('table', 'merged_charts_features')],
+        'code': [('merge_datasets.py', None), ('enrichment.py', ['cache_path', 'cached_features']),
+                 ('instrumentation.py', None), ('storage.py', None), ('track_store.py', None)],
+    },
+    {
+        'name': 'feature_engineering',
+        'run': _run_feature_engineering,
+        'inputs': [('table', 'merged_charts_features'), ('config', 'genre_taxonomy.json'),
+                   ('config', 'regions.json'), ('config', 'scores.json'), ('scope', 'scope.json')],
+        'outputs': [('table', 'final_dataset_engineered')],
+        'code': [('feature_engineering.py', None), ('feature_bins.py', None), ('genre_taxonomy.py', None),
+                 ('instrumentation.py', None), ('rank_dynamics.py', None), ('schema.py', None), ('scope.py', None), ('scores.py', None),
+                 ('star_schema.py', None), ('storage.py', None), ('track_store.py', None)],
+    },
+    {
+        'name': 'analysis',
+        'run': _run_analysis,
+        'inputs': [('table', 'final_dataset_engineered')],
+        'outputs': [('processed', f) for f in PROCESSED_OUTPUTS],
+        'code': [('analysis.py', ['load_data', 'regional_audio_analysis', 'genre_evolution_analysis',
+                                  'clustering_analysis', 'top_tracks_analysis', 'correlation_analysis',
+                                  'run_analyses', 'plan_aggregations', '_aggregates']),
+                 ('aggregation.py', None), ('anova.py', None), ('clustering.py', None), ('correlation.py', None),
+                 ('instrumentation.py', None), ('schema.py', None), ('star_schema.py', None), ('storage.py', None), ('topk.py', None)],
+    },
+    {
+        'name': 'visualization',
+        'run': _run_visualization,
+        'inputs': [('table', 'final_dataset_engineered')],
+        'outputs': ([('visualizations', f) for f in VISUALIZATION_OUTPUTS]
+                    + [('table', 'rollup_cube'), ('table', 'region_track_rollup')]),
+        'code': [('analysis.py', ['load_data', 'create_visualization_data']), ('aggregation.py', None),
+                 ('cube.py', None), ('instrumentation.py', None), ('scatter.py', None), ('schema.py', None),
+                 ('star_schema.py', None), ('storage.py', None), ('topk.py', None)],
+    },
+]
+
+STAGE_NAMES = [stage['name'] for stage in STAGES]
+
+
+def _manifest_path():
+    return os.path.join(storage.data_dir(), 'processed', '.pipeline_manifest.json')
+
+
+def _load_manifest():
+    path = _manifest_path()
+    if not os.path.exists(path):
+        return {'stages': {}, 'file_hashes': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest):
+    path = _manifest_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _resolve(ref, fmt):
+    """Turn an input/output reference into a path on disk"""
+    kind, name = ref
+    if kind == 'raw':
+        return storage.raw_path(name)
+    if kind == 'table':
+        return storage.processed_path(name, storage.stored_format(name) or fmt)
+    if kind == 'config':
+        return os.path.join(storage.PROJECT_ROOT, 'config', name)
+    if kind == 'scope':
+        # The scope file in use, which $DS4200_SCOPE can point elsewhere
+        return scope.scope_path()
+    return os.path.join(storage.data_dir(), kind, name)
+
+
+def _files_under(path):
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+
+
+def _hash_file(path, file_hashes):
+    """Content hash of a file, memoized on (size, mtime) so the raw CSV is read only once"""
+    stat = os.stat(path)
+    memo_key = f"{stat.st_size}:{stat.st_mtime_ns}"
+    cached = file_hashes.get(path)
+    if cached and cached['key'] == memo_key:
+        return cached['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+
+    file_hashes[path] = {'key': memo_key, 'sha256': digest.hexdigest()}
+    return file_hashes[path]['sha256']
+
+
+def _hash_path(path, file_hashes):
+    """Content hash of a file or of every file in a directory (e.g. a Parquet dataset)"""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    for f in _files_under(path):
+        digest.update(os.path.relpath(f, path).encode())
+        digest.update(_hash_file(f, file_hashes).encode())
+    return digest.hexdigest()
+
+
+def _hash_code(code):
+    """Hash the source of a stage: whole scripts or just the named functions"""
+    digest = hashlib.sha256()
+    for filename, functions in code:
+        if functions is None:
+            with open(os.path.join(SCRIPTS_DIR, filename), 'rb') as f:
+                digest.update(f.read())
+        else:
+            module = _load_script(filename)
+            for name in functions:
+                digest.update(inspect.getsource(getattr(module, name)).encode())
+    return digest.hexdigest()
+
+
+def _stage_key(stage, fmt, filter_mode, backend, file_hashes):
+    """Hash of everything a stage's outputs depend on: its code, inputs and settings"""
+    inputs = {}
+    for ref in stage['inputs']:
+        path = _resolve(ref, fmt)
+        inputs[f"{ref[0]}:{ref[1]}"] = _hash_path(path, file_hashes)
+        if inputs[f"{ref[0]}:{ref[1]}"] is None:
+            raise FileNotFoundError(f"Stage '{stage['name']}' is missing its input {path}")
+    # Optional inputs hash to None while absent, so creating one reruns the stage
+    for ref in stage.get('optional_inputs', []):
+        inputs[f"{ref[0]}:{ref[1]}"] = _hash_path(_resolve(ref, fmt), file_hashes)
+
+    payload = {'code': _hash_code(stage['code']), 'inputs': inputs, 'format': fmt}
+    if backend != 'pandas':
+        payload['backend'] = backend
+        payload['backend_code'] = _hash_code([('lazy_backend.py', None)])
+    if stage['name'] == 'filter':
+        payload['filter_mode'] = filter_mode
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _outputs_valid(stage, record, fmt, file_hashes):
+    """Cached outputs are valid if they all exist and still have the recorded content"""
+    for ref in stage['outputs']:
+        path = _resolve(ref, fmt)
+        if _hash_path(path, file_hashes) != record['outputs'].get(f"{ref[0]}:{ref[1]}"):
+            return False
+    return True
+
+
+def run_pipeline(force=(), fmt=storage.DEFAULT_FORMAT, filter_mode='streaming', backend='pandas',
+                 profile=False, cprofile=False):
+    """
+    Run the pipeline stages in order, skipping those whose cached outputs are still valid
+    :param force: Stage names to rerun even if their cache is valid
+    :param fmt: Storage format for the intermediate tables
+    :param filter_mode: 'eager', 'streaming' or 'parallel' filtering of the raw charts
+    :param backend: 'pandas' (reference) or 'polars' (lazy, out-of-core plans)
+    :param profile: Log time, memory and rows of every stage and step to data/logs/
+    :param cprofile: Like profile, plus a cProfile dump per stage
+    :return: list of dicts with per-stage status and timing
+    """
+    print("=" * 60)
+    print("DATA PIPELINE")
+    print("=" * 60)
+
+    with instrumentation.run('pipeline', enabled=profile or cprofile, cprofile=cprofile):
+        return _run_stages(force, fmt, filter_mode, backend)
+
+
+def _run_stages(force, fmt, filter_mode, backend):
+    """Run or skip every stage, see run_pipeline()"""
+    manifest = _load_manifest()
+    file_hashes = manifest['file_hashes']
+    timings = []
+
+    for stage in STAGES:
+        name = stage['name']
+        key = _stage_key(stage, fmt, filter_mode, backend, file_hashes)
+        record = manifest['stages'].get(name)
+
+        if name not in force and record and record['key'] == key \
+                and _outputs_valid(stage, record, fmt, file_hashes):
+            print(f"\n[{name}] up to date, skipping")
+            timings.append({'stage': name, 'status': 'cached', 'seconds': 0.0})
+            continue
+
+        print(f"\n[{name}] running...")
+        start = time.perf_counter()
+        with instrumentation.step(name):
+            stage['run'](fmt, filter_mode, backend)
+        elapsed = time.perf_counter() - start
+
+        outputs = {f"{ref[0]}:{ref[1]}": _hash_path(_resolve(ref, fmt), file_hashes)
+                   for ref in stage['outputs']}
+        manifest['stages'][name] = {'key': key, 'outputs': outputs, 'seconds': elapsed,
+                                    'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+        # Save after every stage so a later failure keeps the finished work cached
+        _save_manifest(manifest)
+        timings.append({'stage': name, 'status': 'ran', 'seconds': elapsed})
+
+    print("\n" + "=" * 60)
+    print("STAGE TIMINGS")
+    print("=" * 60)
+    for timing in timings:
+        print(f"   {timing['stage']:20s}: {timing['status']:7s} {timing['seconds']:8.1f}s")
+    print(f"   {'total':20s}: {'':7s} {sum(t['seconds'] for t in timings):8.1f}s")
+
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the data pipeline, reusing cached stage outputs")
+    parser.add_argument('--force', action='append', default=[], choices=STAGE_NAMES, metavar='STAGE',
+                        help=f"Rerun a stage even if its cache is valid (repeatable; one of {STAGE_NAMES})")
+    parser.add_argument('--format', choices=storage.FORMATS, default=storage.DEFAULT_FORMAT,
+                        help=f"Storage format for intermediate tables (default: {storage.DEFAULT_FORMAT})")
+    parser.add_argument('--filter-mode', choices=['eager', 'streaming', 'parallel'], default='streaming',
+                        help="How the raw charts file is filtered with the pandas backend (default: streaming)")
+    parser.add_argument('--backend', choices=['pandas', 'polars'], default='pandas',
+                        help="Execution backend: pandas (reference) or polars lazy plans (default: pandas)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    run_pipeline(force=args.force, fmt=args.format, filter_mode=args.filter_mode, backend=args.backend,
+                 profile=args.profile, cprofile=args.cprofile)
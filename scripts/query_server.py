@@ -0,0 +1,444 @@
+import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+import cube
+import scatter
+import star_schema
+import storage
+import topk
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow responses are optional, JSON always works
+    pa = None
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PORT = 8000
+
+# Rendered responses kept in memory, least recently used evicted first
+CACHE_SIZE = 256
+
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+
+# Chart rows kept in memory for top tracks over arbitrary date ranges
+ROW_COLUMNS = ['region', 'date', 'track_id', 'macro_genre'] + list(cube.TRACK_AGGREGATIONS)
+
+PARAMS = ['region', 'genre', 'start', 'end', 'limit', 'format', 'x0', 'x1', 'y0', 'y1', 'budget']
+MAX_LIMIT = 200
+
+
+def data_version():
+    """Signature of every table the endpoints read; any write or append changes it"""
+    names = [cube.CUBE_TABLE, star_schema.WIDE_TABLE, star_schema.FACT_TABLE]
+    signatures = {name: storage.table_signature(name) for name in names}
+    tile_index = os.path.join(storage.data_dir(), 'visualizations', scatter.TILE_DIR, scatter.TILE_INDEX)
+    signatures['tiles'] = os.stat(tile_index).st_mtime_ns if os.path.exists(tile_index) else None
+    return json.dumps(signatures, sort_keys=True)
+
+
+def parse_params(query):
+    """
+    Validate and normalize the query string
+    :return: dict with 'regions', 'genres' (lists or None), 'start', 'end' (Timestamps or None),
+        'limit' and 'format'
+    """
+    raw = parse_qs(query)
+    unknown = sorted(set(raw) - set(PARAMS))
+    if unknown:
+        raise ValueError(f"Unknown parameter(s): {', '.join(unknown)}")
+
+    def values(name):
+        items = [item for value in raw.get(name, []) for item in value.split(',') if item]
+        return sorted(set(items)) or None
+
+    params = {'regions': values('region'), 'genres': values('genre'), 'start': None, 'end': None}
+    for name in ['start', 'end']:
+        if name in raw:
+            text = raw[name][-1]
+            try:
+                # 'YYYY-MM' means the whole month: its first day as a start, its last as an end
+                if len(text) == 7 and name == 'end':
+                    params[name] = pd.Period(text, 'M').end_time.normalize()
+                else:
+                    params[name] = pd.Timestamp(text)
+            except ValueError:
+                raise ValueError(f"Invalid {name} date '{text}', expected YYYY-MM or YYYY-MM-DD")
+
+    limit = raw.get('limit', ['20'])[-1]
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_LIMIT:
+        raise ValueError(f"limit must be an integer between 1 and {MAX_LIMIT}")
+    params['limit'] = int(limit)
+
+    # Scatter viewport (energy x0-x1, valence y0-y1) and point budget
+    for name, default in [('x0', 0.0), ('x1', 1.0), ('y0', 0.0), ('y1', 1.0)]:
+        try:
+            params[name] = float(raw.get(name, [default])[-1])
+        except ValueError:
+            raise ValueError(f"{name} must be a number")
+    budget = raw.get('budget', [str(scatter.DEFAULT_POINT_BUDGET)])[-1]
+    if not budget.isdigit() or not 1 <= int(budget) <= scatter.DEFAULT_POINT_BUDGET:
+        raise ValueError(f"budget must be an integer between 1 and {scatter.DEFAULT_POINT_BUDGET}")
+    params['budget'] = int(budget)
+
+    params['format'] = raw.get('format', ['json'])[-1]
+    if params['format'] not in ['json', 'arrow']:
+        raise ValueError("format must be 'json' or 'arrow'")
+    if params['format'] == 'arrow' and pa is None:
+        raise ValueError("Arrow responses need pyarrow, use format=json")
+    return params
+
+
+def _filter_cube(data_cube, params):
+    """Cube cells matching the filters; dates select whole months"""
+    keep = np.ones(len(data_cube), dtype=bool)
+    if params['regions']:
+        keep &= data_cube['region'].isin(params['regions']).to_numpy()
+    if params['genres']:
+        keep &= data_cube['macro_genre'].isin(params['genres']).to_numpy()
+    if params['start'] is not None:
+        keep &= (data_cube['year_month'] >= params['start'].strftime('%Y-%m')).to_numpy()
+    if params['end'] is not None:
+        keep &= (data_cube['year_month'] <= params['end'].strftime('%Y-%m')).to_numpy()
+    return data_cube[keep]
+
+
+def genre_trends(data, params):
+    """Charting rows per month and macro genre, as monthly_genre_trends.csv"""
+    counts = cube.rollup(_filter_cube(data.cube, params), ['year_month', 'macro_genre'])
+    return counts.reset_index(name='count').rename(columns={'year_month': 'month'})
+
+
+def mood_trends(data, params):
+    """Charting rows per month and mood, as mood_trends.csv"""
+    counts = cube.rollup(_filter_cube(data.cube, params), ['year_month', 'mood'])
+    return counts.reset_index(name='count').rename(columns={'year_month': 'month'})
+
+
+def regional_comparison(data, params):
+    """Mean audio features per region, as regional_audio_comparison.csv"""
+    features = ['danceability', 'energy', 'valence', 'tempo', 'acousticness']
+    return cube.rollup(_filter_cube(data.cube, params), ['region'], features).reset_index()
+
+
+def top_tracks(data, params):
+    """Best-peaking tracks per region over the selected rows, as top_tracks_by_region.csv"""
+    rows = data.rows
+    keep = np.ones(len(rows), dtype=bool)
+    if params['regions']:
+        keep &= rows['region'].isin(params['regions']).to_numpy()
+    if params['genres']:
+        keep &= rows['macro_genre'].isin(params['genres']).to_numpy()
+    if params['start'] is not None:
+        keep &= (rows['date'] >= params['start']).to_numpy()
+    if params['end'] is not None:
+        keep &= (rows['date'] <= params['end']).to_numpy()
+
+    if not keep.any():
+        return pd.DataFrame(columns=cube.TRACK_KEYS + list(cube.TRACK_AGGREGATIONS))
+    tracks = cube.build_track_rollup(rows[keep])
+    return topk.top_k(tracks, {'peak_position': 'smallest'}, k=params['limit'], by='region')['peak_position']
+
+
+def scatter_points(data, params):
+    """
+    Energy/valence points inside a viewport at full resolution, stratified by genre down to the
+    point budget when the viewport holds more; zooming in returns ever more of the real points
+    """
+    points = data.points
+    keep = (points['energy'].between(params['x0'], params['x1'])
+            & points['valence'].between(params['y0'], params['y1'])).to_numpy()
+    if params['genres']:
+        keep = keep & points['macro_genre'].isin(params['genres']).to_numpy()
+    return scatter.stratified_sample(points[keep], params['budget'])
+
+
+def dimensions(data, params):
+    """Filter values the other endpoints accept"""
+    return pd.DataFrame({'dimension': ['region', 'genre', 'month'],
+                         'values': [sorted(data.cube['region'].dropna().astype(str).unique()),
+                                    sorted(data.cube['macro_genre'].dropna().astype(str).unique()),
+                                    sorted(data.cube['year_month'].unique())]})
+
+
+ENDPOINTS = {
+    '/api/genre-trends': genre_trends,
+    '/api/mood-trends': mood_trends,
+    '/api/regional-comparison': regional_comparison,
+    '/api/top-tracks': top_tracks,
+    '/api/scatter': scatter_points,
+    '/api/dimensions': dimensions,
+}
+
+
+def encode(df, fmt):
+    """
+    Serialize a result
+    :param fmt: 'json' (compact array of records) or 'arrow' (Arrow IPC stream)
+    :return: (bytes, content type)
+    """
+    if fmt == 'arrow':
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), ARROW_TYPE
+    return df.to_json(orient='records', date_format='iso').encode(), 'application/json'
+
+
+class QueryData:
+    """
+    The rollup cube and chart rows the endpoints read, plus an LRU cache of rendered responses.
+    Everything is reloaded when the stored tables change (e.g. after daily_append.py).
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self.version = None
+        self.cube = None
+        self.rows = None
+        self.points = None
+        self.hits = 0
+        self.misses = 0
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Reload the tables if their signature changed since the last load"""
+        version = data_version()
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            if storage.stored_format(cube.CUBE_TABLE) is None:
+                raise FileNotFoundError("No rollup cube found, run analysis.py (or pipeline.py) first")
+            import analysis
+            self.cube = cube.load_rollups()[0]
+            self.rows = analysis.load_data(columns=ROW_COLUMNS)
+            self.points = scatter.load_tiles()
+            self.version = version
+            self._responses.clear()
+
+    def etag(self, path, params):
+        key = json.dumps([self.version, path, {k: str(v) for k, v in params.items()}], sort_keys=True)
+        return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+    def respond(self, path, params):
+        """
+        Rendered response for an endpoint, from the cache when possible
+        :return: (etag, body, content type)
+        """
+        etag = self.etag(path, params)
+        with self._lock:
+            if etag in self._responses:
+                self._responses.move_to_end(etag)
+                self.hits += 1
+                return (etag,) + self._responses[etag]
+
+        body, content_type = encode(ENDPOINTS[path](self, params), params['format'])
+        with self._lock:
+            self.misses += 1
+            self._responses[etag] = (body, content_type)
+            while len(self._responses) > self.cache_size:
+                self._responses.popitem(last=False)
+        return etag, body, content_type
+
+
+class QueryServer(ThreadingHTTPServer):
+    # The default backlog of 5 makes bursts of clients wait for a SYN retry
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class QueryHandler(SimpleHTTPRequestHandler):
+    """Serves /api/* from QueryData and every other path as a static file of the project"""
+
+    data = None
+    quiet = False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not url.path.startswith('/api/'):
+            return super().do_GET()
+        if url.path not in ENDPOINTS:
+            return self._send_error(404, f"Unknown endpoint {url.path}, expected one of {sorted(ENDPOINTS)}")
+
+        try:
+            params = parse_params(url.query)
+        except ValueError as error:
+            return self._send_error(400, str(error))
+
+        self.data.refresh()
+        etag = self.data.etag(url.path, params)
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        try:
+            etag, body, content_type = self.data.respond(url.path, params)
+        except Exception as error:
+            # Answer instead of dropping the connection, and log the error
+            self.log_error("%s failed: %r", self.path, error)
+            return self._send_error(500, f"{type(error).__name__}: {error}")
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(port=DEFAULT_PORT, host='127.0.0.1', quiet=False):
+    """
+    Create the server (call serve_forever() on it)
+    :param port: Port to listen on (0 = any free port)
+    :return: QueryServer (its .data is the shared QueryData)
+    """
+    data = QueryData()
+    handler = type('Handler', (QueryHandler,), {'data': data, 'quiet': quiet})
+    server = QueryServer((host, port), partial(handler, directory=PROJECT_ROOT))
+    server.data = data
+    return server
+
+
+def _percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {'p50': np.percentile(latencies, 50), 'p99': np.percentile(latencies, 99), 'max': latencies.max()}
+
+
+def load_test(n_requests=2000, concurrency=8, seed=0):
+    """
+    Start the server on a free port and measure request latency for cold (uncached) queries,
+    repeated queries served from the LRU cache and ETag revalidations (304)
+    :param n_requests: Requests in each of the cached and revalidation phases
+    :param concurrency: Concurrent client threads
+    :return: dict of phase -> latency percentiles in ms
+    """
+    print("=" * 60)
+    print("QUERY SERVER LOAD TEST")
+    print("=" * 60)
+
+    server = make_server(port=0, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    data = server.data
+
+    # A mix of endpoints, filters and formats, like the visualizations would send
+    rng = np.random.default_rng(seed)
+    regions = sorted(data.cube['region'].astype(str).unique())
+    genres = sorted(data.cube['macro_genre'].dropna().astype(str).unique())
+    months = sorted(data.cube['year_month'].unique())
+    queries = []
+    for path in ['/api/genre-trends', '/api/mood-trends', '/api/regional-comparison', '/api/top-tracks']:
+        queries.append(path)
+        for _ in range(15):
+            first, last = sorted(rng.choice(len(months), 2))
+            query = {'region': ','.join(rng.choice(regions, min(2, len(regions)), replace=False)),
+                     'start': months[first], 'end': months[last]}
+            if rng.random() < 0.5:
+                query['genre'] = rng.choice(genres)
+            if pa is not None and rng.random() < 0.3:
+                query['format'] = 'arrow'
+            queries.append(f'{path}?{urlencode(query, safe=",")}')
+
+    # Scatter viewports from the whole plane down to 1/16 of it
+    queries.append('/api/scatter')
+    for _ in range(15):
+        size = rng.choice([0.25, 0.5, 1.0])
+        x0, y0 = rng.random(2) * (1 - size)
+        queries.append(f'/api/scatter?x0={x0:.3f}&x1={x0 + size:.3f}&y0={y0:.3f}&y1={y0 + size:.3f}')
+
+    def fetch(url, etag=None):
+        request = Request(base_url + url, headers={'If-None-Match': etag} if etag else {})
+        start = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+                status, tag = response.status, response.headers['ETag']
+        except HTTPError as error:
+            status, tag = error.code, error.headers['ETag']
+        return time.perf_counter() - start, status, tag
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            start = time.perf_counter()
+            cold = list(pool.map(fetch, queries))
+            results['cold'] = (cold, time.perf_counter() - start)
+            etags = {url: tag for url, (_, _, tag) in zip(queries, cold)}
+
+            picks = [queries[i] for i in rng.integers(0, len(queries), n_requests)]
+            start = time.perf_counter()
+            results['cached'] = (list(pool.map(fetch, picks)), time.perf_counter() - start)
+
+            start = time.perf_counter()
+            results['revalidate'] = (list(pool.map(lambda url: fetch(url, etags[url]), picks)),
+                                     time.perf_counter() - start)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(f"\n{len(queries)} distinct queries, {concurrency} client threads, "
+          f"cache {data.hits:,} hits / {data.misses:,} misses")
+    print(f"\n{'phase':>12s} {'requests':>9s} {'status':>10s} {'p50 ms':>8s} {'p99 ms':>8s} {'max ms':>8s} {'req/s':>8s}")
+    report = {}
+    for phase, (responses, seconds) in results.items():
+        latency = _percentiles([r[0] for r in responses])
+        statuses = ','.join(str(s) for s in sorted({r[1] for r in responses}))
+        print(f"{phase:>12s} {len(responses):9,d} {statuses:>10s} {latency['p50']:8.2f} {latency['p99']:8.2f} "
+              f"{latency['max']:8.2f} {len(responses) / seconds:8,.0f}")
+        report[phase] = latency
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP API over the visualization data")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to bind (default: 127.0.0.1)")
+    parser.add_argument('--load-test', action='store_true',
+                        help="Start on a free port, send a mix of queries and report p50/p99 latency")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per load test phase (default: 2000)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Load test client threads (default: 8)")
+    args = parser.parse_args()
+
+    if args.load_test:
+        load_test(args.requests, args.concurrency)
+    else:
+        server = make_server(args.port, args.host)
+        print(f"Serving {PROJECT_ROOT} and /api/* on http://{args.host}:{server.server_address[1]}/")
+        print("Endpoints: " + ", ".join(sorted(ENDPOINTS)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,95 @@
+import pandas as pd
+import numpy as np
+
+# Rank dynamics are tracked separately for every track in every regional chart
+GROUP_KEYS = ['track_id', 'region']
+
+# Trailing windows (in days) for the momentum features
+MOMENTUM_WINDOWS = [7, 28]
+
+
+def _segment_starts(df):
+    """True where a new (track_id, region) run starts in a frame sorted by GROUP_KEYS + date"""
+    codes = df.groupby(GROUP_KEYS, sort=False, observed=True).ngroup().to_numpy()
+    return np.r_[True, codes[1:] != codes[:-1]]
+
+
+def _trailing_sum(values, days, segment_ids, window):
+    """Sum of values over the trailing `window` days of each row's own segment"""
+    # One sortable timeline where different segments can never fall into each other's window
+    offset = int(days.max() - days.min()) + window + 1
+    timeline = segment_ids * offset + (days - days.min())
+    window_start = np.searchsorted(timeline, timeline - (window - 1), side='left')
+
+    cumulative = np.r_[0.0, np.cumsum(values)]
+    return cumulative[np.arange(1, len(values) + 1)] - cumulative[window_start]
+
+
+def scale_trend_score(raw_trend, max_rank=50):
+    """
+    Scale raw trend scores to 0-100 against the widest range a top-max_rank chart allows
+    (-(max_rank - 1) to max_rank - 1), so a day's score never depends on the rest of the data
+    """
+    span = max(max_rank - 1, 1)
+    return (raw_trend + span) / (2 * span) * 100
+
+
+def add_rank_dynamics(df, max_rank=50):
+    """
+    Add day-over-day rank dynamics per (track_id, region) in one sorted pass.
+    Every feature only looks at the current and earlier chart days.
+    :param df: Chart rows with track_id, region, date and rank
+    :param max_rank: Lowest chart position kept (used for the first-day trend score)
+    :return: pd.DataFrame sorted by track_id, region, date with the new columns:
+        rank_change    - rank minus the rank on the previous chart day (negative = climbing)
+        trend_score    - how 'viral' a track is on the day, scaled to 0-100
+        momentum_7d    - places gained over the trailing 7 days
+        momentum_28d   - places gained over the trailing 28 days
+        days_to_peak   - days from the first chart day to the best rank so far
+        peak_velocity  - places gained per day on the way to the best rank so far
+    """
+    df = df.sort_values(GROUP_KEYS + ['date'])
+
+    # Duplicate rows for the same chart day (a track listed under several genres)
+    # collapse onto one "day" so they share the same dynamics
+    starts = _segment_starts(df)
+    days = df['date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    day_starts = starts | np.r_[True, days[1:] != days[:-1]]
+    day_of_row = np.cumsum(day_starts) - 1
+
+    rank = df['rank'].to_numpy().astype(np.float64)[day_starts]
+    days = days[day_starts]
+    starts = starts[day_starts]
+    segment_ids = np.cumsum(starts) - 1
+    positions = np.arange(len(rank))
+
+    # Day-over-day delta, undefined on each segment's first day
+    rank_change = np.r_[np.nan, np.diff(rank)]
+    rank_change[starts] = np.nan
+
+    # Trend score: higher = more viral (rapid rank improvement); first days score by position
+    trend_score = scale_trend_score(np.where(np.isnan(rank_change), max_rank - rank, -rank_change), max_rank)
+
+    # Momentum: total places gained over each trailing window
+    improvement = np.nan_to_num(-rank_change)
+    momentum = {f'momentum_{window}d': _trailing_sum(improvement, days, segment_ids, window)
+                for window in MOMENTUM_WINDOWS}
+
+    # Best rank so far and the first day it was reached; segment starts always count as
+    # a new best, so the running maximum never carries a position across segments
+    best_rank = pd.Series(rank).groupby(segment_ids).cummin().to_numpy()
+    new_best = starts | (rank < np.r_[np.inf, best_rank[:-1]])
+    best_position = np.maximum.accumulate(np.where(new_best, positions, 0))
+    first_position = np.maximum.accumulate(np.where(starts, positions, 0))
+
+    days_to_peak = days[best_position] - days[first_position]
+    peak_velocity = (rank[first_position] - best_rank) / np.maximum(days_to_peak, 1)
+
+    # Broadcast the per-day values back onto every row
+    return df.assign(
+        rank_change=rank_change[day_of_row],
+        trend_score=trend_score[day_of_row],
+        **{name: values[day_of_row] for name, values in momentum.items()},
+        days_to_peak=days_to_peak[day_of_row],
+        peak_velocity=peak_velocity[day_of_row],
+    )
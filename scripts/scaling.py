@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import synthetic
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_REGION_COUNTS = [6, 18, 35, 70]
+
+# Per-row cost may grow this much between the smallest and largest run before it is
+# reported as worse than linear (leaves room for timer noise on small runs)
+LINEAR_TOLERANCE = 1.25
+
+
+def _write_scope(path, max_rank, min_date):
+    """Scope file keeping every region up to max_rank, used through $DS4200_SCOPE"""
+    with open(path, 'w') as f:
+        json.dump({'regions': 'all', 'max_rank': max_rank, 'min_date': min_date}, f, indent=2)
+
+
+def _run_child(data_dir, scope_path, fmt):
+    """
+    Run the whole pipeline on one sample in a fresh process, so every run starts cold
+    and the peak RSS belongs to that run alone
+    :return: dict with the stage timings and the peak RSS in MB
+    """
+    env = dict(os.environ, DS4200_DATA_DIR=data_dir, DS4200_SCOPE=scope_path)
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--format', fmt],
+                            env=env, cwd=SCRIPTS_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Pipeline failed on {data_dir}:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _child(fmt):
+    """Entry point of the child process: run every stage and print one JSON line"""
+    import contextlib
+    import io
+
+    import instrumentation
+    import pipeline
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        timings = pipeline.run_pipeline(force=pipeline.STAGE_NAMES, fmt=fmt)
+        peak_mb = instrumentation.peak_memory_mb()
+    print(json.dumps({'timings': {t['stage']: t['seconds'] for t in timings}, 'peak_mb': peak_mb}))
+
+
+def run_scaling(workdir, region_counts=DEFAULT_REGION_COUNTS, max_rank=200, start='2020-01-01',
+                end='2020-06-30', n_tracks=5000, fmt='parquet'):
+    """
+    Run the pipeline on synthetic samples of increasing region count and check that
+    runtime and memory grow at most linearly with the number of chart rows
+    :param workdir: Directory for the samples (one data directory per region count)
+    :param region_counts: Region counts to run, smallest first
+    :param max_rank: Rank cutoff of the scope (200 = the full chart)
+    :return: list of dicts, one per region count
+    """
+    print("=" * 60)
+    print("PIPELINE SCALING")
+    print("=" * 60)
+
+    os.makedirs(workdir, exist_ok=True)
+    scope_path = os.path.join(workdir, 'scope.json')
+    _write_scope(scope_path, max_rank, start)
+
+    results = []
+    for n_regions in region_counts:
+        data_dir = os.path.join(workdir, f'regions_{n_regions}')
+        print(f"\n[{n_regions} regions] generating sample...")
+        start_time = time.perf_counter()
+        counts = synthetic.write_dataset(data_dir, n_regions, n_tracks=n_tracks, start=start, end=end,
+                                         chart_size=max_rank)
+        print(f"   {counts['chart_rows']:,} raw chart rows in {time.perf_counter() - start_time:.1f}s")
+
+        run = _run_child(data_dir, scope_path, fmt)
+        total = sum(run['timings'].values())
+        results.append({'regions': n_regions, 'rows': counts['chart_rows'], 'seconds': total,
+                        'peak_mb': run['peak_mb'], 'stages': run['timings']})
+        stages = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in run['timings'].items())
+        print(f"   pipeline {total:.1f}s, peak {run['peak_mb']:,.0f} MB ({stages})")
+
+    print("\n" + "=" * 60)
+    print(f"{'regions':>8s} {'raw rows':>12s} {'seconds':>9s} {'peak MB':>9s} {'rows/s':>10s} {'us/row':>8s}")
+    for result in results:
+        print(f"{result['regions']:8d} {result['rows']:12,d} {result['seconds']:9.1f} {result['peak_mb']:9,.0f} "
+              f"{result['rows'] / result['seconds']:10,.0f} {result['seconds'] / result['rows'] * 1e6:8.2f}")
+
+    first, last = results[0], results[-1]
+    growth = last['rows'] / first['rows']
+    time_ratio = (last['seconds'] / first['seconds']) / growth
+    memory_ratio = (last['peak_mb'] / first['peak_mb']) / growth
+    print(f"\nRows grew {growth:.1f}x: runtime grew {last['seconds'] / first['seconds']:.1f}x, "
+          f"peak memory {last['peak_mb'] / first['peak_mb']:.1f}x")
+    for label, ratio in [('Runtime', time_ratio), ('Memory', memory_ratio)]:
+        verdict = 'worse than linear' if ratio > LINEAR_TOLERANCE else 'linear or better'
+        print(f"   {label} per row: {ratio:.2f}x of the smallest run ({verdict})")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark how the pipeline scales with the number of regions")
+    parser.add_argument('workdir', nargs='?', default=None,
+                        help="Directory for the synthetic samples (default: a temporary directory)")
+    parser.add_argument('--regions', type=int, nargs='+', default=DEFAULT_REGION_COUNTS,
+                        help=f"Region counts to run (default: {DEFAULT_REGION_COUNTS})")
+    parser.add_argument('--max-rank', type=int, default=200, help="Rank cutoff (default: 200)")
+    parser.add_argument('--start', default='2020-01-01', help="First chart date (default: 2020-01-01)")
+    parser.add_argument('--end', default='2020-06-30', help="Last chart date (default: 2020-06-30)")
+    parser.add_argument('--tracks', type=int, default=5000, help="Distinct tracks (default: 5000)")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='parquet',
+                        help="Storage format for intermediate tables (default: parquet)")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.format)
+    else:
+        import tempfile
+        workdir = args.workdir or tempfile.mkdtemp(prefix='ds4200_scaling_')
+        run_scaling(workdir, sorted(args.regions), max_rank=args.max_rank, start=args.start, end=args.end,
+                    n_tracks=args.tracks, fmt=args.format)
@@ -0,0 +1,149 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+
+import storage
+
+SCATTER_COLUMNS = ['track_id', 'track_name', 'artist_spotify', 'macro_genre',
+                   'danceability', 'energy', 'valence', 'popularity', 'year']
+
+# Points in the overview file; the page payload stays about this size however many tracks chart
+DEFAULT_POINT_BUDGET = 5000
+
+# Energy x valence cells of the density grid (both axes span 0-1)
+DENSITY_BINS = 40
+
+# Full-resolution points are split into 2^z x 2^z tiles, at the coarsest zoom where no tile holds
+# more than the point budget (capped, so very dense spots still get bounded tile counts)
+TILE_DIR = 'energy_valence_tiles'
+TILE_INDEX = 'index.json'
+MAX_ZOOM = 6
+
+
+def scatter_points(df):
+    """One point per track: its first chart row, so the choice does not depend on storage order"""
+    points = df[SCATTER_COLUMNS + ['region', 'date']]
+    return (points.sort_values(['track_id', 'region', 'date'], kind='stable')
+            .drop_duplicates(subset='track_id')
+            .drop(columns=['region', 'date']))
+
+
+def stratified_sample(points, budget, by='macro_genre', seed=0):
+    """
+    Downsample to about budget points, keeping each genre's share of the points
+    (largest-remainder allocation, at least one point per genre) and sampling uniformly
+    within a genre, so the density of every genre's cloud is preserved
+    :return: pd.DataFrame in the original row order
+    """
+    if len(points) <= budget:
+        return points
+
+    sizes = points[by].astype(object).fillna('').value_counts(sort=False)
+    quota = sizes / sizes.sum() * budget
+    allocation = np.maximum(np.floor(quota), 1).astype(int)
+    leftover = budget - allocation.sum()
+    if leftover > 0:
+        allocation[(quota - np.floor(quota)).sort_values(ascending=False).index[:leftover]] += 1
+    allocation = np.minimum(allocation, sizes)
+
+    groups = points.groupby(points[by].astype(object).fillna(''), sort=False)
+    sampled = [group.sample(allocation[name], random_state=seed) for name, group in groups]
+    return points.loc[points.index.isin(pd.concat(sampled).index)]
+
+
+def density_grid(points, bins=DENSITY_BINS):
+    """
+    Track counts per genre on an energy x valence grid, for a heatmap layer under the sampled points
+    :return: pd.DataFrame with macro_genre, the cell centre (energy, valence) and count
+    """
+    cells = points.dropna(subset=['energy', 'valence'])
+    x = np.clip((cells['energy'].to_numpy() * bins).astype(int), 0, bins - 1)
+    y = np.clip((cells['valence'].to_numpy() * bins).astype(int), 0, bins - 1)
+    grid = (pd.DataFrame({'macro_genre': cells['macro_genre'].to_numpy(), 'x': x, 'y': y})
+            .groupby(['macro_genre', 'x', 'y'], observed=True).size().reset_index(name='count'))
+    grid['energy'] = (grid.pop('x') + 0.5) / bins
+    grid['valence'] = (grid.pop('y') + 0.5) / bins
+    return grid[['macro_genre', 'energy', 'valence', 'count']]
+
+
+def tile_keys(points, zoom):
+    """Tile column and row of every point at a zoom level (energy is x, valence is y)"""
+    scale = 2 ** zoom
+    x = np.clip((points['energy'].to_numpy() * scale).astype(int), 0, scale - 1)
+    y = np.clip((points['valence'].to_numpy() * scale).astype(int), 0, scale - 1)
+    return x, y
+
+
+def tile_zoom(points, budget):
+    """Coarsest zoom level at which no tile holds more than budget points"""
+    for zoom in range(MAX_ZOOM + 1):
+        x, y = tile_keys(points, zoom)
+        if np.unique(x * 2 ** zoom + y, return_counts=True)[1].max(initial=0) <= budget:
+            return zoom
+    return MAX_ZOOM
+
+
+def write_tiles(points, tile_dir, budget=DEFAULT_POINT_BUDGET):
+    """
+    Write every point with coordinates into one CSV per tile, {zoom}/{x}_{y}.csv, plus an index
+    of the tiles and their point counts for clients that load tiles as they zoom in
+    :return: dict: The index
+    """
+    if os.path.isdir(tile_dir):
+        shutil.rmtree(tile_dir)
+    points = points.dropna(subset=['energy', 'valence'])
+    zoom = tile_zoom(points, budget)
+    os.makedirs(os.path.join(tile_dir, str(zoom)))
+
+    x, y = tile_keys(points, zoom)
+    tiles = {}
+    for (tx, ty), tile in points.groupby([x, y], sort=True):
+        tile.to_csv(os.path.join(tile_dir, str(zoom), f'{tx}_{ty}.csv'), index=False)
+        tiles[f'{tx}_{ty}'] = len(tile)
+
+    index = {'zoom': zoom, 'x': 'energy', 'y': 'valence', 'budget': budget, 'points': len(points), 'tiles': tiles}
+    with open(os.path.join(tile_dir, TILE_INDEX), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def load_tiles(tile_dir=None):
+    """All full-resolution points back from the tiles"""
+    tile_dir = tile_dir or os.path.join(storage.data_dir(), 'visualizations', TILE_DIR)
+    with open(os.path.join(tile_dir, TILE_INDEX)) as f:
+        index = json.load(f)
+    pieces = [pd.read_csv(os.path.join(tile_dir, str(index['zoom']), f'{key}.csv')) for key in index['tiles']]
+    return pd.concat(pieces, ignore_index=True) if pieces else pd.DataFrame(columns=SCATTER_COLUMNS)
+
+
+def write_scatter(df, viz_dir, budget=DEFAULT_POINT_BUDGET):
+    """
+    Write the energy/valence scatter files: a stratified overview of about budget points,
+    the density grid and the full-resolution tiles
+    :param df: Engineered rows
+    :return: dict with the point counts
+    """
+    points = scatter_points(df)
+    overview = stratified_sample(points, budget)
+    overview.to_csv(os.path.join(viz_dir, 'energy_valence_scatter.csv'), index=False)
+    density_grid(points).to_csv(os.path.join(viz_dir, 'energy_valence_density.csv'), index=False)
+    index = write_tiles(points, os.path.join(viz_dir, TILE_DIR), budget)
+
+    print(f"   {len(points):,} tracks: {len(overview):,} in the overview, "
+          f"{len(index['tiles'])} tiles at zoom {index['zoom']}")
+    return {'tracks': len(points), 'overview': len(overview), 'tiles': len(index['tiles'])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the downsampled energy/valence scatter files")
+    parser.add_argument('--budget', type=int, default=DEFAULT_POINT_BUDGET,
+                        help=f"Points in the overview and per tile (default: {DEFAULT_POINT_BUDGET})")
+    args = parser.parse_args()
+
+    import analysis
+    viz_dir = os.path.join(storage.data_dir(), 'visualizations')
+    os.makedirs(viz_dir, exist_ok=True)
+    write_scatter(analysis.load_data(columns=SCATTER_COLUMNS + ['region', 'date']), viz_dir, args.budget)
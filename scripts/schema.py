@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy as np
+import argparse
+
+import scores
+import storage
+
+# Compact dtypes shared by every stage. Columns not listed keep whatever dtype they have.
+SCHEMA = {
+    # Low-cardinality strings
+    'region': 'category',
+    'trend': 'category',
+    'chart': 'category',
+    'artist_spotify': 'category',
+    'track_genre': 'category',
+    'macro_genre': 'category',
+    'energy_level': 'category',
+    'mood': 'category',
+    'danceability_level': 'category',
+    'tempo_category': 'category',
+    'sound_type': 'category',
+    'popularity_tier': 'category',
+    'region_category': 'category',
+    'month_name': 'category',
+    'day_of_week': 'category',
+    'covid_era': 'category',
+
+    # 0-1 audio features and scores
+    'danceability': 'float32',
+    'energy': 'float32',
+    'valence': 'float32',
+    'acousticness': 'float32',
+    'speechiness': 'float32',
+    'instrumentalness': 'float32',
+    'liveness': 'float32',
+
+    # Other derived floats that do not need double precision
+    'trend_score': 'float32',
+    'rank_change': 'float32',
+    'momentum_7d': 'float32',
+    'momentum_28d': 'float32',
+    'peak_velocity': 'float32',
+
+    # Small integers
+    'rank': 'int16',
+    'peak_position': 'int16',
+    'best_position_to_date': 'int16',
+    'weeks_in_chart': 'int16',
+    'days_to_peak': 'int16',
+    'year': 'int16',
+    'quarter': 'int8',
+    'month': 'int8',
+    'week_of_year': 'int8',
+    'popularity': 'int8',
+    'key': 'int8',
+    'mode': 'int8',
+    'time_signature': 'int8',
+    'duration_ms': 'int32',
+}
+
+
+# Every composite score of config/scores.json is a float32 too, including newly added ones
+SCHEMA.update({name: 'float32' for name in scores.score_names() if name not in SCHEMA})
+
+
+def _cast(series, dtype):
+    """Cast one column, keeping missing values and never overflowing a small integer type"""
+    if dtype == 'category' or dtype.startswith('float'):
+        return series.astype(dtype)
+
+    limits = np.iinfo(dtype)
+    if series.min() < limits.min or series.max() > limits.max:
+        return series
+    # Missing values need pandas' nullable integer type (e.g. Int16)
+    return series.astype(dtype.capitalize() if series.isna().any() else dtype)
+
+
+def apply_schema(df, schema=SCHEMA):
+    """
+    Enforce the compact dtypes on every column the schema knows about
+    :param df: DataFrame from any pipeline stage
+    :param schema: Column -> dtype mapping (defaults to SCHEMA)
+    :return: pd.DataFrame with the compact dtypes
+    """
+    return df.assign(**{col: _cast(df[col], dtype) for col, dtype in schema.items()
+                        if col in df.columns and str(df[col].dtype) != dtype})
+
+
+def default_dtypes(df):
+    """Return df with the dtypes pandas would infer from a CSV (object strings, 64-bit numbers)"""
+    converted = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            converted[col] = df[col].astype(object)
+        elif pd.api.types.is_bool_dtype(dtype):
+            continue
+        elif pd.api.types.is_float_dtype(dtype):
+            converted[col] = df[col].astype('float64')
+        elif pd.api.types.is_integer_dtype(dtype):
+            converted[col] = df[col].astype('float64' if df[col].isna().any() else 'int64')
+    return df.assign(**converted)
+
+
+def memory_report(before, after):
+    """
+    Print bytes per column before and after enforcing the schema
+    :param before: DataFrame with default dtypes
+    :param after: Same data with the compact schema
+    :return: pd.DataFrame with the per-column report
+    """
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_before': before.memory_usage(deep=True, index=False),
+        'bytes_after': after.memory_usage(deep=True, index=False),
+    })
+    report['reduction'] = report['bytes_before'] / report['bytes_after']
+    report = report.sort_values('bytes_before', ascending=False)
+
+    print("=" * 60)
+    print("MEMORY REPORT")
+    print("=" * 60)
+    print(report.to_string(formatters={'bytes_before': '{:,}'.format, 'bytes_after': '{:,}'.format,
+                                       'reduction': '{:.1f}x'.format}))
+
+    total_before = report['bytes_before'].sum()
+    total_after = report['bytes_after'].sum()
+    print(f"\nTotal: {total_before / 1_000_000:.1f} MB -> {total_after / 1_000_000:.1f} MB "
+          f"({total_before / total_after:.1f}x smaller)")
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report memory use of the engineered dataset before/after the schema")
+    parser.add_argument('--table', default='final_dataset_engineered', choices=storage.PIPELINE_TABLES,
+                        help="Intermediate table to report on (default: final_dataset_engineered)")
+    args = parser.parse_args()
+
+    df = storage.read_table(args.table)
+    memory_report(default_dtypes(df), apply_schema(df))
@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+
+# Get the project root directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SCOPE_PATH = os.path.join(PROJECT_ROOT, 'config', 'scope.json')
+DEFAULT_REGIONS_PATH = os.path.join(PROJECT_ROOT, 'config', 'regions.json')
+
+
+def scope_path():
+    """The scope file in use: $DS4200_SCOPE if set (e.g. for benchmarks), else config/scope.json"""
+    return os.environ.get('DS4200_SCOPE', DEFAULT_SCOPE_PATH)
+
+
+def load_scope(path=None):
+    """
+    Load which regions, ranks and dates the pipeline keeps
+    :param path: JSON file with 'regions' (list or "all"), 'max_rank' and 'min_date'
+    :return: dict with 'regions' (None = every region), 'max_rank' and 'min_date'
+    """
+    with open(path or scope_path()) as f:
+        config = json.load(f)
+
+    regions = config['regions']
+    return {
+        'regions': None if regions == 'all' else list(regions),
+        'max_rank': int(config['max_rank']),
+        'min_date': config['min_date'],
+    }
+
+
+def region_continents(path=DEFAULT_REGIONS_PATH):
+    """
+    Load the region -> continent mapping used for region_category
+    :return: dict of region name -> continent
+    """
+    with open(path) as f:
+        return json.load(f)['continents']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the configured pipeline scope")
+    parser.parse_args()
+
+    scope = load_scope()
+    continents = region_continents()
+    regions = scope['regions'] or sorted(continents)
+    print(f"Scope file: {scope_path()}")
+    print(f"Dates >= {scope['min_date']}, rank <= {scope['max_rank']}, "
+          f"{'all regions' if scope['regions'] is None else f'{len(regions)} regions'}")
+    for region in regions:
+        print(f"   {region:25s} -> {continents.get(region, '(no continent)')}")
@@ -0,0 +1,198 @@
+import pandas as pd
+import numpy as np
+import argparse
+import ast
+import json
+import os
+import time
+
+try:
+    import numexpr
+except ImportError:  # numexpr is optional, NumPy evaluates the same formulas
+    numexpr = None
+
+# Get the project root directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SCORES_PATH = os.path.join(PROJECT_ROOT, 'config', 'scores.json')
+
+# Functions a formula may call; numexpr knows the same names
+FUNCTIONS = {'abs': np.abs, 'sqrt': np.sqrt, 'log': np.log, 'exp': np.exp, 'where': np.where}
+
+# Names ending in these are catalogue constants, e.g. loudness_min
+CONSTANT_SUFFIXES = ('_min', '_max')
+
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+                  ast.Constant, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+                  ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq, ast.BitAnd, ast.BitOr, ast.Invert)
+
+
+def parse_formula(formula):
+    """
+    Check that a formula only uses columns, numbers, arithmetic, comparisons and FUNCTIONS
+    :return: dict with the parsed 'tree', its 'inputs' (columns) and 'constants'
+    """
+    tree = ast.parse(formula, mode='eval')
+    functions = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Unsupported syntax in score formula '{formula}': {type(node).__name__}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"Only numbers can be literals in score formula '{formula}'")
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            raise ValueError(f"Chained comparison in score formula '{formula}', write (a < b) & (b < c)")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise ValueError(f"Unknown function in score formula '{formula}', expected one of {list(FUNCTIONS)}")
+            functions.add(id(node.func))
+
+    names = sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in functions})
+    return {'tree': tree,
+            'inputs': [name for name in names if not name.endswith(CONSTANT_SUFFIXES)],
+            'constants': [name for name in names if name.endswith(CONSTANT_SUFFIXES)]}
+
+
+def load_scores(path=DEFAULT_SCORES_PATH):
+    """
+    Load and check the score registry
+    :param path: JSON file with a list of 'scores' (name, description, formula)
+    :return: dict of score name -> {'formula', 'description', 'tree', 'inputs', 'constants'}, in file order
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    scores = {}
+    for score in config['scores']:
+        scores[score['name']] = {'formula': score['formula'], 'description': score.get('description', ''),
+                                 **parse_formula(score['formula'])}
+    return scores
+
+
+def score_names(path=DEFAULT_SCORES_PATH):
+    with open(path) as f:
+        return [score['name'] for score in json.load(f)['scores']]
+
+
+def catalogue_constants(scores=None, store=None):
+    """
+    Values of the <column>_min / <column>_max constants the formulas use, over the whole track
+    catalogue rather than the charted rows, so appending chart days never changes earlier scores
+    :return: dict of constant name -> float
+    """
+    scores = scores or load_scores()
+    names = sorted({name for score in scores.values() for name in score['constants']})
+    if not names:
+        return {}
+
+    import track_store
+    store = store or track_store.open_track_store()
+    constants = {}
+    for name in names:
+        column, stat = name.rsplit('_', 1)
+        if column not in store['columns']:
+            raise ValueError(f"Score constant '{name}' refers to '{column}', which is not a track store column")
+        values = np.asarray(store['columns'][column], dtype='float64')
+        constants[name] = float(np.nanmin(values) if stat == 'min' else np.nanmax(values))
+    return constants
+
+
+def evaluate_scores(scores, columns, constants):
+    """
+    Evaluate every formula over 1-D arrays, with numexpr (one fused pass per formula) if installed
+    :param columns: dict of input column -> float64 np.ndarray
+    :param constants: dict from catalogue_constants()
+    :return: dict of score name -> np.ndarray
+    """
+    results = {}
+    for name, score in scores.items():
+        local = {**{col: columns[col] for col in score['inputs']},
+                 **{const: constants[const] for const in score['constants']}}
+        if numexpr is not None:
+            results[name] = numexpr.evaluate(score['formula'], local_dict=local)
+        else:
+            code = compile(score['tree'], f'<score {name}>', 'eval')
+            results[name] = eval(code, {'__builtins__': {}, **FUNCTIONS}, local)
+    return results
+
+
+def add_scores(df, scores=None, constants=None, key='track_id'):
+    """
+    Add every registered score. Audio features are a property of the track, so each formula
+    is evaluated once per distinct track and copied to the chart rows through the track codes.
+    :param df: Chart rows with the key and the formulas' input columns
+    :param scores: Registry from load_scores() (default: config/scores.json)
+    :param constants: dict from catalogue_constants() (computed here if not given)
+    :param key: Column identifying a track
+    :return: pd.DataFrame with one column per score
+    """
+    scores = scores or load_scores()
+    constants = catalogue_constants(scores) if constants is None else constants
+    inputs = sorted({col for score in scores.values() for col in score['inputs']})
+
+    codes, _ = pd.factorize(df[key], use_na_sentinel=False)
+    # Codes are numbered in order of appearance, so a track's first row is where a new highest code shows up
+    first_rows = np.flatnonzero(codes > np.maximum.accumulate(np.concatenate([[-1], codes[:-1]])))
+    columns = {col: df[col].to_numpy(dtype='float64', na_value=np.nan)[first_rows] for col in inputs}
+
+    for name, values in evaluate_scores(scores, columns, constants).items():
+        df[name] = np.broadcast_to(values, len(first_rows))[codes]
+    return df
+
+
+def benchmark_scores(df, scores=None, repeats=3):
+    """
+    Time per-track evaluation against evaluating every formula on every chart row,
+    and check both give the same values
+    :return: dict with both timings
+    """
+    print("=" * 60)
+    print(f"SCORE ENGINE ({len(df):,} rows, {df['track_id'].nunique():,} tracks)")
+    print("=" * 60)
+
+    scores = scores or load_scores()
+    constants = catalogue_constants(scores)
+    inputs = sorted({col for score in scores.values() for col in score['inputs']})
+
+    def per_row(frame):
+        values = evaluate_scores(scores, {col: frame[col].to_numpy(dtype='float64', na_value=np.nan)
+                                          for col in inputs}, constants)
+        for name, column in values.items():
+            frame[name] = column
+        return frame
+
+    timings, results = {}, {}
+    for label, run in [('per row', per_row), ('per track', lambda frame: add_scores(frame, scores, constants))]:
+        best = float('inf')
+        for _ in range(repeats):
+            frame = df[['track_id'] + inputs].copy()
+            start = time.perf_counter()
+            results[label] = run(frame)
+            best = min(best, time.perf_counter() - start)
+        timings[label] = best
+
+    match = all(np.array_equal(results['per row'][name], results['per track'][name], equal_nan=True)
+                for name in scores)
+    print(f"   Engine: {'numexpr' if numexpr is not None else 'numpy'}, scores: {', '.join(scores)}")
+    print(f"   Per row:   {timings['per row'] * 1000:8.1f} ms")
+    print(f"   Per track: {timings['per track'] * 1000:8.1f} ms")
+    print(f"   Same values: {match}")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Composite score registry (config/scores.json)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Compare per-track and per-row evaluation on the merged table")
+    args = parser.parse_args()
+
+    registry = load_scores()
+    for score_name, entry in registry.items():
+        print(f"{score_name:20s} = {entry['formula']}")
+    constant_values = catalogue_constants(registry)
+    for constant_name, value in constant_values.items():
+        print(f"{constant_name:20s} = {value:.4f} (track catalogue)")
+
+    if args.benchmark:
+        import track_store
+        benchmark_scores(track_store.load_merged(
+            columns=['track_id'] + sorted({col for entry in registry.values() for col in entry['inputs']})))
@@ -0,0 +1,172 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+
+import storage
+
+WIDE_TABLE = 'final_dataset_engineered'
+FACT_TABLE = 'engineered_chart_fact'
+TRACK_TABLE = 'engineered_track_dim'
+DATE_TABLE = 'engineered_date_dim'
+LAYOUT_FILE = 'engineered_star.json'
+
+# Daily chart columns that stay on the fact table; 'date' and 'track_key' join the dimensions
+FACT_COLUMNS = ['date', 'region', 'year', 'rank', 'streams', 'trend', 'rank_change', 'trend_score',
+                'momentum_7d', 'momentum_28d', 'days_to_peak', 'peak_velocity', 'weeks_in_chart',
+                'peak_position', 'best_position_to_date', 'region_category']
+
+# Calendar attributes, one row per date
+DATE_COLUMNS = ['month', 'quarter', 'month_name', 'day_of_week', 'week_of_year', 'covid_era']
+
+# Everything else (track_id, chart and Spotify names, genre, audio features, buckets,
+# composite scores) is a track attribute
+
+
+def _layout_path():
+    return os.path.join(storage.data_dir(), 'processed', LAYOUT_FILE)
+
+
+def write_star(df, fmt=storage.DEFAULT_FORMAT):
+    """
+    Write the engineered dataset as a daily chart fact table plus track and date dimensions
+    :param df: The wide engineered DataFrame
+    :param fmt: Storage format ('parquet' or 'csv')
+    :return: dict of table name -> path
+    """
+    track_columns = [col for col in df.columns if col not in FACT_COLUMNS + DATE_COLUMNS]
+
+    # One dimension row per distinct combination of track attributes (a track listed
+    # under several genres gets one row per genre)
+    track_key = df.groupby(track_columns, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    _, first_rows = np.unique(track_key, return_index=True)
+    track_dim = df[track_columns].iloc[first_rows].reset_index(drop=True)
+    track_dim.insert(0, 'track_key', np.arange(len(track_dim), dtype=np.int32))
+
+    date_dim = (df[['date'] + DATE_COLUMNS].drop_duplicates(subset='date')
+                .sort_values('date').reset_index(drop=True))
+
+    fact = df[FACT_COLUMNS].assign(track_key=track_key.astype(np.int32))
+
+    paths = {
+        FACT_TABLE: storage.write_table(fact, FACT_TABLE, fmt=fmt),
+        TRACK_TABLE: storage.write_table(track_dim, TRACK_TABLE, fmt=fmt, partition_cols=[]),
+        DATE_TABLE: storage.write_table(date_dim, DATE_TABLE, fmt=fmt, partition_cols=[]),
+    }
+
+    with open(_layout_path(), 'w') as f:
+        json.dump({'columns': df.columns.tolist(), 'track_columns': track_columns,
+                   'date_columns': DATE_COLUMNS}, f, indent=2)
+
+    print(f"\nStar schema: {len(fact):,} fact rows, {len(track_dim):,} tracks, {len(date_dim):,} dates")
+    return paths
+
+
+def engineered_layout():
+    """Which engineered layout is on disk ('wide' or 'star'); the newest wins if both exist"""
+    existing = {}
+    for layout, name in [('wide', WIDE_TABLE), ('star', FACT_TABLE)]:
+        fmt = storage.stored_format(name)
+        if fmt is not None:
+            existing[layout] = os.path.getmtime(storage.processed_path(name, fmt))
+    if not existing:
+        raise FileNotFoundError("No engineered dataset found, run feature_engineering.py first")
+    return max(existing, key=existing.get)
+
+
+def _split_columns(columns):
+    """The requested columns by the table they live in: (all, track, date, fact)"""
+    with open(_layout_path()) as f:
+        layout = json.load(f)
+
+    columns = layout['columns'] if columns is None else [c for c in columns if c in layout['columns']]
+    track_columns = [c for c in columns if c in layout['track_columns']]
+    date_columns = [c for c in columns if c in layout['date_columns']]
+    fact_columns = [c for c in columns if c not in track_columns + date_columns]
+    return columns, track_columns, date_columns, fact_columns
+
+
+def _fact_columns(track_columns, date_columns, fact_columns):
+    join_keys = (['track_key'] if track_columns else []) + (['date'] if date_columns else [])
+    return fact_columns + [k for k in join_keys if k not in fact_columns]
+
+
+def _dimensions(track_columns, date_columns):
+    track_dim = date_dim = None
+    if track_columns:
+        track_dim = storage.read_table(TRACK_TABLE, columns=['track_key'] + track_columns)
+        track_dim = track_dim.sort_values('track_key').reset_index(drop=True)
+    if date_columns:
+        date_dim = storage.read_table(DATE_TABLE, columns=['date'] + date_columns)
+    return track_dim, date_dim
+
+
+def _join(fact, columns, track_columns, date_columns, track_dim, date_dim):
+    joined = {}
+    if track_columns:
+        # track_key is the row position in the dimension, so the join is a plain take
+        rows = track_dim[track_columns].take(fact['track_key'].to_numpy()).reset_index(drop=True)
+        joined.update({col: rows[col] for col in track_columns})
+    if date_columns:
+        positions = pd.Index(pd.to_datetime(date_dim['date'])).get_indexer(pd.to_datetime(fact['date']))
+        rows = date_dim[date_columns].take(positions).reset_index(drop=True)
+        joined.update({col: rows[col] for col in date_columns})
+
+    fact = fact.reset_index(drop=True)
+    return pd.DataFrame({col: joined[col] if col in joined else fact[col] for col in columns})
+
+
+def read_star(columns=None, regions=None, years=None):
+    """
+    Read the star layout, joining a dimension only when a requested column lives there
+    :param columns: Only load these columns (default: all, in the wide column order)
+    :param regions: Only load these regions
+    :param years: Only load these years
+    :return: pd.DataFrame shaped like the wide engineered table
+    """
+    columns, track_columns, date_columns, fact_columns = _split_columns(columns)
+    fact = storage.read_table(FACT_TABLE, columns=_fact_columns(track_columns, date_columns, fact_columns),
+                              regions=regions, years=years)
+    return _join(fact, columns, track_columns, date_columns, *_dimensions(track_columns, date_columns))
+
+
+def iter_star(columns=None, batch_rows=storage.ROW_GROUP_ROWS):
+    """
+    Stream the star layout in batches of fact rows; only the dimensions stay in memory
+    :return: Generator of pd.DataFrame shaped like the wide engineered table
+    """
+    columns, track_columns, date_columns, fact_columns = _split_columns(columns)
+    dimensions = _dimensions(track_columns, date_columns)
+    for fact in storage.iter_table(FACT_TABLE, columns=_fact_columns(track_columns, date_columns, fact_columns),
+                                   batch_rows=batch_rows):
+        yield _join(fact, columns, track_columns, date_columns, *dimensions)
+
+
+def storage_report(fmt=None):
+    """Print the on-disk size of the wide engineered table against the star layout"""
+    print("=" * 60)
+    print("WIDE vs STAR STORAGE")
+    print("=" * 60)
+
+    sizes = {}
+    for name in [WIDE_TABLE, FACT_TABLE, TRACK_TABLE, DATE_TABLE]:
+        table_fmt = fmt or storage.stored_format(name)
+        if table_fmt is None or not os.path.exists(storage.processed_path(name, table_fmt)):
+            print(f"   {name:30s}: missing")
+            continue
+        sizes[name] = storage.path_size(storage.processed_path(name, table_fmt))
+        print(f"   {name:30s}: {sizes[name] / 1_000_000:8.2f} MB ({table_fmt})")
+
+    star = sum(size for name, size in sizes.items() if name != WIDE_TABLE)
+    if WIDE_TABLE in sizes and star:
+        print(f"\n   Star layout total: {star / 1_000_000:.2f} MB ({sizes[WIDE_TABLE] / star:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fact/dimension layout of the engineered dataset")
+    parser.add_argument('--format', choices=storage.FORMATS, default=None,
+                        help="Report on this storage format (default: whichever was written last)")
+    args = parser.parse_args()
+
+    storage_report(fmt=args.format)
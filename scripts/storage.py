@@ -0,0 +1,396 @@
+import pandas as pd
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional, CSV always works
+    pa = None
+
+# Get the project root directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORMATS = ['csv', 'parquet']
+DEFAULT_FORMAT = 'parquet' if pa is not None else 'csv'
+
+# Intermediates are partitioned so readers can skip whole regions/years
+PARTITION_COLS = ['region', 'year']
+
+# Rows buffered per partition before a Parquet row group is flushed. Without it every
+# written batch is split across all region partitions, so with ~70 regions the files
+# end up with hundreds of tiny row groups that are slow to read back
+ROW_GROUP_ROWS = 128 * 1024
+
+# Sidecar written next to the Parquet files with column order and categories
+SCHEMA_FILE = '_schema.json'
+
+# The intermediate tables handed between pipeline stages
+PIPELINE_TABLES = ['spotify_charts_filtered', 'merged_charts_features', 'final_dataset_engineered']
+
+
+def data_dir():
+    """Root of the data directory (override with DS4200_DATA_DIR, e.g. for benchmarks)"""
+    return os.environ.get('DS4200_DATA_DIR', os.path.join(PROJECT_ROOT, 'data'))
+
+
+def raw_path(filename):
+    """Path of a file in data/raw"""
+    return os.path.join(data_dir(), 'raw', filename)
+
+
+def processed_path(name, fmt):
+    """Path of an intermediate table: a CSV file or a partitioned Parquet directory"""
+    extension = 'csv' if fmt == 'csv' else 'parquet'
+    return os.path.join(data_dir(), 'processed', f'{name}.{extension}')
+
+
+def stored_format(name):
+    """Return the format an intermediate is stored in (the newest if both exist), or None"""
+    existing = [fmt for fmt in FORMATS if os.path.exists(processed_path(name, fmt))]
+    if not existing:
+        return None
+    return max(existing, key=lambda fmt: os.path.getmtime(processed_path(name, fmt)))
+
+
+def table_signature(name):
+    """
+    Size and mtime of a table's CSV file or Parquet sidecar, which every write (or append) changes
+    :return: dict, or None if the table does not exist
+    """
+    fmt = stored_format(name)
+    if fmt is None:
+        return None
+    path = processed_path(name, fmt)
+    if fmt == 'parquet':
+        path = os.path.join(path, SCHEMA_FILE)
+    stat = os.stat(path)
+    return {'format': fmt, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def path_size(path):
+    """Size in bytes of a file, or of every file under a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def _check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown storage format '{fmt}', expected one of {FORMATS}")
+    if fmt == 'parquet' and pa is None:
+        raise ImportError("Parquet storage requires pyarrow (pip install pyarrow), or use --format csv")
+
+
+class TableWriter:
+    """
+    Write an intermediate table in one or more pieces, e.g. chunk by chunk.
+    CSV pieces are appended to one file; Parquet pieces become extra files in each
+    region/year partition. Use as a context manager so the Parquet schema sidecar
+    is written when the last piece is in.
+    With append=True the pieces are added to the existing table (same columns, in its order)
+    instead of replacing it.
+    """
+
+    def __init__(self, name, fmt=DEFAULT_FORMAT, partition_cols=PARTITION_COLS, append=False):
+        _check_format(fmt)
+        self.fmt = fmt
+        self.path = processed_path(name, fmt)
+        self.partition_cols = partition_cols
+        self.append = append
+        self.rows = 0
+        self._pieces = 0
+        self._columns = None
+        self._categoricals = {}
+        self._basename = 'part'
+
+        if append:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"Cannot append to {self.path}, it does not exist")
+            if fmt == 'parquet':
+                with open(os.path.join(self.path, SCHEMA_FILE)) as f:
+                    schema = json.load(f)
+                self._columns, self._categoricals = schema['columns'], schema['categoricals']
+                # Unique file names so appended pieces never overwrite earlier ones
+                self._basename = f"append-{time.strftime('%Y%m%d%H%M%S')}-{os.urandom(4).hex()}"
+            else:
+                self._columns = pd.read_csv(self.path, nrows=0).columns.tolist()
+            return
+
+        # Start from a clean slate so stale partitions never leak into reads
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, df):
+        """Append one piece of the table"""
+        if self._columns is None:
+            self._columns = df.columns.tolist()
+        elif self.append:
+            df = df[self._columns]
+
+        if self.fmt == 'csv':
+            first = self._pieces == 0 and not self.append
+            df.to_csv(self.path, mode='w' if first else 'a', header=first, index=False)
+        else:
+            self._write_parquet(df)
+
+        self._pieces += 1
+        self.rows += len(df)
+
+    def _write_parquet(self, df):
+        # Partition by year even when the stage has not derived it yet
+        if 'year' in self.partition_cols and 'year' not in df.columns and 'date' in df.columns:
+            df = df.assign(year=pd.to_datetime(df['date']).dt.year)
+
+        # Remember every category seen so readers get one consistent dtype back
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                known = self._categoricals.setdefault(
+                    col, {'categories': [], 'ordered': bool(df[col].cat.ordered)})
+                known['categories'] += [c for c in df[col].cat.categories.tolist()
+                                        if c not in known['categories']]
+
+        partition_cols = [col for col in self.partition_cols if col in df.columns]
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_to_dataset(table, self.path, partition_cols=partition_cols,
+                            basename_template=f'{self._basename}-{self._pieces:05d}-{{i}}.parquet',
+                            min_rows_per_group=ROW_GROUP_ROWS, max_rows_per_group=ROW_GROUP_ROWS)
+
+    def close(self):
+        """Finish the table (writes the Parquet schema sidecar)"""
+        if self.fmt != 'parquet':
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, SCHEMA_FILE), 'w') as f:
+            json.dump({'columns': self._columns or [], 'categoricals': self._categoricals}, f, indent=2)
+
+
+def write_table(df, name, fmt=DEFAULT_FORMAT, partition_cols=PARTITION_COLS):
+    """
+    Write an intermediate table to data/processed
+    :param df: DataFrame to write
+    :param name: Table name, e.g. 'merged_charts_features'
+    :param fmt: 'parquet' (partitioned by region/year) or 'csv'
+    :param partition_cols: Parquet partition columns
+    :return: str: Path of the written file or directory
+    """
+    with TableWriter(name, fmt, partition_cols) as writer:
+        writer.write(df)
+    return writer.path
+
+
+def append_table(df, name, fmt=None, partition_cols=PARTITION_COLS):
+    """
+    Append rows to an existing intermediate table without rewriting it
+    :param df: Rows with the table's columns
+    :param name: Table name
+    :param fmt: 'parquet' or 'csv' (default: whichever was written last)
+    :return: str: Path of the table
+    """
+    fmt = fmt or stored_format(name)
+    with TableWriter(name, fmt, partition_cols, append=True) as writer:
+        writer.write(df)
+    return writer.path
+
+
+def read_schema(name, fmt=None):
+    """
+    Column order and categories recorded when a Parquet table was written
+    :return: dict with 'columns' and 'categoricals', or None for CSV tables
+    """
+    fmt = fmt or stored_format(name)
+    if fmt != 'parquet':
+        return None
+    with open(os.path.join(processed_path(name, fmt), SCHEMA_FILE)) as f:
+        return json.load(f)
+
+
+def _parquet_dataset(path):
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+
+    # Partition values only live in directory names, so type them explicitly
+    partition_fields = [pa.field('region', pa.string()), pa.field('year', pa.int32())]
+    dataset = ds.dataset(path, format='parquet',
+                         partitioning=ds.partitioning(pa.schema(partition_fields), flavor='hive'))
+    return dataset, schema
+
+
+def _restore_categories(df, schema):
+    # Per-file dictionaries lose the category order, restore it from the sidecar
+    for col, info in schema['categoricals'].items():
+        if col in df.columns:
+            df[col] = pd.Categorical(df[col], categories=info['categories'], ordered=info['ordered'])
+    return df
+
+
+def _read_parquet(path, columns=None, regions=None, years=None):
+    dataset, schema = _parquet_dataset(path)
+    stored_columns = schema['columns']
+    columns = stored_columns if columns is None else [c for c in columns if c in stored_columns]
+
+    predicate = None
+    if regions is not None:
+        predicate = ds.field('region').isin(list(regions))
+    if years is not None:
+        year_predicate = ds.field('year').isin([int(y) for y in years])
+        predicate = year_predicate if predicate is None else predicate & year_predicate
+
+    return _restore_categories(dataset.to_table(columns=columns, filter=predicate).to_pandas(), schema)
+
+
+def _read_csv(path, columns=None, regions=None, years=None):
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    usecols = None if columns is None else [c for c in columns if c in header]
+
+    # The filters need their columns even when the caller did not ask for them
+    read_cols = usecols
+    if usecols is not None:
+        read_cols = usecols + [c for c in ['region', 'year', 'date']
+                               if c in header and c not in usecols]
+
+    parse_dates = ['date'] if 'date' in (header if read_cols is None else read_cols) else None
+    df = pd.read_csv(path, usecols=read_cols, parse_dates=parse_dates)
+
+    if regions is not None:
+        df = df[df['region'].isin(list(regions))]
+    if years is not None:
+        year = df['year'] if 'year' in df.columns else df['date'].dt.year
+        df = df[year.isin([int(y) for y in years])]
+
+    if usecols is not None:
+        df = df[usecols]
+    return df.reset_index(drop=True)
+
+
+def _require_format(name, fmt):
+    fmt = fmt or stored_format(name)
+    if fmt is None:
+        raise FileNotFoundError(
+            f"Could not find {name} in {os.path.join(data_dir(), 'processed')}\n"
+            f"Please run the earlier pipeline stages first"
+        )
+    _check_format(fmt)
+    return fmt
+
+
+def read_table(name, columns=None, regions=None, years=None, fmt=None):
+    """
+    Read an intermediate table from data/processed
+    :param name: Table name, e.g. 'final_dataset_engineered'
+    :param columns: Only load these columns (default: all)
+    :param regions: Only load these regions (Parquet skips the other partitions)
+    :param years: Only load these years (Parquet skips the other partitions)
+    :param fmt: Force 'csv' or 'parquet' (default: whichever was written last)
+    :return: pd.DataFrame
+    """
+    fmt = _require_format(name, fmt)
+    path = processed_path(name, fmt)
+    if fmt == 'parquet':
+        return _read_parquet(path, columns, regions, years)
+    return _read_csv(path, columns, regions, years)
+
+
+def iter_table(name, columns=None, batch_rows=ROW_GROUP_ROWS, fmt=None):
+    """
+    Read an intermediate table one batch at a time, so memory is bounded by the batch size
+    rather than the table size
+    :param name: Table name
+    :param columns: Only load these columns (default: all)
+    :param batch_rows: Maximum rows per batch
+    :param fmt: Force 'csv' or 'parquet' (default: whichever was written last)
+    :return: Generator of pd.DataFrame
+    """
+    fmt = _require_format(name, fmt)
+    path = processed_path(name, fmt)
+
+    if fmt == 'parquet':
+        dataset, schema = _parquet_dataset(path)
+        columns = schema['columns'] if columns is None else [c for c in columns if c in schema['columns']]
+        for batch in dataset.to_batches(columns=columns, batch_size=batch_rows):
+            if batch.num_rows:
+                yield _restore_categories(batch.to_pandas(), schema)
+        return
+
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    usecols = None if columns is None else [c for c in columns if c in header]
+    parse_dates = ['date'] if 'date' in (usecols or header) else None
+    for chunk in pd.read_csv(path, usecols=usecols, parse_dates=parse_dates, chunksize=batch_rows):
+        yield chunk if usecols is None else chunk[usecols]
+
+
+def benchmark_formats(names=PIPELINE_TABLES):
+    """Compare load time and size of CSV and Parquet copies of the stored intermediates"""
+    _check_format('parquet')
+    print("=" * 60)
+    print("CSV vs PARQUET")
+    print("=" * 60)
+
+    results = []
+    for name in names:
+        if stored_format(name) is None:
+            print(f"\n{name}: not stored yet, skipping")
+            continue
+        df = read_table(name)
+
+        # Write both copies to a scratch data dir so nothing real is touched
+        with tempfile.TemporaryDirectory() as tmp:
+            previous = os.environ.get('DS4200_DATA_DIR')
+            os.environ['DS4200_DATA_DIR'] = tmp
+            try:
+                seconds, sizes = {}, {}
+                for fmt in FORMATS:
+                    path = write_table(df, name, fmt=fmt)
+                    start = time.perf_counter()
+                    read_table(name, fmt=fmt)
+                    seconds[fmt] = time.perf_counter() - start
+                    sizes[fmt] = path_size(path)
+            finally:
+                if previous is None:
+                    del os.environ['DS4200_DATA_DIR']
+                else:
+                    os.environ['DS4200_DATA_DIR'] = previous
+
+        csv_time, parquet_time = seconds['csv'], seconds['parquet']
+        csv_size, parquet_size = sizes['csv'], sizes['parquet']
+        results.append({'table': name, 'rows': len(df),
+                        'csv_seconds': csv_time, 'parquet_seconds': parquet_time,
+                        'csv_mb': csv_size / 1_000_000, 'parquet_mb': parquet_size / 1_000_000})
+
+        print(f"\n{name} ({len(df):,} rows):")
+        print(f"   Load time: CSV {csv_time:.2f}s, Parquet {parquet_time:.2f}s "
+              f"({csv_time / parquet_time:.1f}x faster)")
+        print(f"   Size:      CSV {csv_size / 1_000_000:.1f} MB, Parquet {parquet_size / 1_000_000:.1f} MB "
+              f"({csv_size / parquet_size:.1f}x smaller)")
+
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline intermediate storage utilities")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Compare load time and size of CSV and Parquet copies of the intermediates")
+    parser.add_argument('--export-csv', metavar='TABLE', choices=PIPELINE_TABLES,
+                        help="Export a stored intermediate table to CSV")
+    args = parser.parse_args()
+
+    if args.export_csv:
+        path = write_table(read_table(args.export_csv), args.export_csv, fmt='csv')
+        print(f"Exported {args.export_csv} to: {path}")
+    if args.benchmark or not args.export_csv:
+        benchmark_formats()
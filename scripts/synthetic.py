@@ -0,0 +1,216 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+import scope
+
+CHART_COLUMNS = ['title', 'rank', 'date', 'artist', 'url', 'region', 'chart', 'trend', 'streams']
+
+GENRES = ['pop', 'k-pop', 'hip-hop', 'edm', 'rock', 'indie', 'latin', 'country', 'jazz', 'classical',
+          'acoustic', 'r-n-b', 'sertanejo', 'j-pop', 'anime', 'funk', 'mpb', 'reggaeton', 'metal', 'soul']
+
+ID_ALPHABET = np.array(list('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'))
+
+# Charted tracks missing from the features file, as in the real data
+UNKNOWN_TRACK_SHARE = 0.15
+
+# Positions of the daily 'viral50' chart every region has next to its top chart
+VIRAL_CHART_SIZE = 50
+
+# Sizing a sample by row count: at least the default scope's six markets (the region analyses
+# cluster regions), more until a region covers about a year of days, and one distinct track
+# per TRACK_ROWS chart rows within the bounds below
+MIN_REGIONS = 6
+DAYS_PER_REGION = 365
+TRACK_ROWS = 200
+MIN_TRACKS, MAX_TRACKS = 1000, 50_000
+
+# Chart rows buffered before they are appended to the CSV
+WRITE_CHUNK_ROWS = 1_000_000
+
+
+def synthetic_regions(n_regions):
+    """
+    The first n regions of config/regions.json, with the default scope's markets first
+    so every sample size contains the regions of the default pipeline
+    """
+    default = scope.load_scope(scope.DEFAULT_SCOPE_PATH)['regions'] or []
+    others = [region for region in scope.region_continents() if region not in default]
+    regions = default + others
+    if n_regions > len(regions):
+        raise ValueError(f"Only {len(regions)} regions are configured, asked for {n_regions}")
+    return regions[:n_regions]
+
+
+def generate_features(n_tracks, seed=0):
+    """
+    Generate a tracks features table with the columns of spotify-tracks-features.csv
+    :param n_tracks: Number of distinct tracks (5% are listed again under a second genre)
+    :param seed: Random seed
+    :return: pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    track_ids = [''.join(chars) for chars in rng.choice(ID_ALPHABET, size=(n_tracks, 22))]
+    index = np.arange(n_tracks)
+
+    features = pd.DataFrame({
+        'track_id': track_ids,
+        'artists': [f'Artist {i % max(n_tracks // 6, 1)}' for i in index],
+        'album_name': [f'Album {i}' for i in index],
+        'track_name': [f'Song {i}' for i in index],
+        'popularity': rng.integers(0, 100, n_tracks),
+        'duration_ms': rng.integers(100_000, 300_000, n_tracks),
+        'explicit': rng.random(n_tracks) < 0.3,
+        'danceability': rng.random(n_tracks).round(3),
+        'energy': rng.random(n_tracks).round(3),
+        'key': rng.integers(0, 12, n_tracks),
+        'loudness': (-rng.random(n_tracks) * 20).round(3),
+        'mode': rng.integers(0, 2, n_tracks),
+        'speechiness': rng.random(n_tracks).round(3),
+        'acousticness': rng.random(n_tracks).round(3),
+        'instrumentalness': rng.random(n_tracks).round(3),
+        'liveness': rng.random(n_tracks).round(3),
+        'valence': rng.random(n_tracks).round(3),
+        'tempo': (60 + rng.random(n_tracks) * 140).round(3),
+        'time_signature': 4,
+        'track_genre': rng.choice(GENRES, n_tracks),
+    })
+
+    second_genre = features.sample(frac=0.05, random_state=seed).assign(track_genre='dance')
+    features = pd.concat([features, second_genre], ignore_index=True)
+    features.insert(0, 'Unnamed: 0', np.arange(len(features)))
+    return features
+
+
+def iter_charts(track_ids, regions, start='2019-06-01', end='2021-12-31', chart_size=200, seed=0):
+    """
+    Generate daily charts with the columns of spotify-charts.csv, one chart of one day at a time.
+    Every region has its own slowly drifting popularity per track, so tracks stay on a chart for
+    weeks like real ones.
+    :param track_ids: Track IDs of the features table
+    :param regions: Region names
+    :param chart_size: Positions of the 'top200' chart (a 50-position 'viral50' chart is added too)
+    :return: Generator of pd.DataFrame, in date order
+    """
+    rng = np.random.default_rng(seed)
+    n_unknown = int(len(track_ids) * UNKNOWN_TRACK_SHARE)
+    pool = np.concatenate([np.asarray(track_ids, dtype=object),
+                           [f'unknown{i:015d}' for i in range(n_unknown)]])
+    titles = np.array([f'Song {i}' for i in range(len(pool))], dtype=object)
+    artists = np.array([f'Artist {i % max(len(pool) // 6, 1)}' for i in range(len(pool))], dtype=object)
+    urls = 'https://open.spotify.com/track/' + pool
+
+    n_regions = len(regions)
+    charts = {'top200': (min(chart_size, len(pool)), 0.0), 'viral50': (min(VIRAL_CHART_SIZE, len(pool)), 1.0)}
+    scores = {chart: rng.standard_normal((n_regions, len(pool))) for chart in charts}
+    previous = {chart: np.zeros((n_regions, len(pool)), dtype=np.int32) for chart in charts}
+    region_rows = np.arange(n_regions)[:, None]
+
+    for date in pd.date_range(start, end).strftime('%Y-%m-%d'):
+        for chart, (size, drift) in charts.items():
+            # Random walk of each track's popularity; the top scores make the chart
+            scores[chart] += rng.standard_normal(scores[chart].shape) * (0.1 + drift * 0.2)
+            top = np.argpartition(-scores[chart], size - 1, axis=1)[:, :size]
+            top = np.take_along_axis(top, np.argsort(-scores[chart][region_rows, top], axis=1), axis=1)
+            ranks = np.broadcast_to(np.arange(1, size + 1, dtype=np.int16), top.shape)
+
+            before = previous[chart][region_rows, top]
+            trend = np.select([before == 0, before > ranks, before < ranks],
+                              ['NEW_ENTRY', 'MOVE_UP', 'MOVE_DOWN'], 'SAME_POSITION')
+            previous[chart][:] = 0
+            previous[chart][region_rows, top] = ranks
+
+            if chart == 'top200':
+                streams = (2_000_000 / ranks ** 0.8 * rng.uniform(0.8, 1.2, top.shape)).round()
+            else:
+                streams = np.full(top.shape, np.nan)
+
+            flat = top.ravel()
+            yield pd.DataFrame({
+                'title': titles[flat], 'rank': ranks.ravel(), 'date': date, 'artist': artists[flat],
+                'url': urls[flat], 'region': np.repeat(np.asarray(regions, dtype=object), size),
+                'chart': chart, 'trend': trend.ravel(), 'streams': streams.ravel(),
+            })[CHART_COLUMNS]
+
+
+def generate_charts(track_ids, regions, start='2019-06-01', end='2021-12-31', chart_size=200, seed=0):
+    """Every day of iter_charts() in one frame"""
+    return pd.concat(iter_charts(track_ids, regions, start=start, end=end, chart_size=chart_size, seed=seed),
+                     ignore_index=True)
+
+
+def plan_rows(rows, chart_size=200, start='2020-01-01'):
+    """
+    Regions, tracks and dates of a sample with a given number of raw chart rows
+    :param rows: Target raw chart rows, e.g. 10_000 to 100_000_000
+    :param chart_size: Positions of the top chart
+    :param start: First chart date
+    :return: dict of write_dataset() arguments (n_regions, n_tracks, start, end, max_rows)
+    """
+    per_region_day = chart_size + VIRAL_CHART_SIZE
+    n_regions = max(MIN_REGIONS, -(-rows // (per_region_day * DAYS_PER_REGION)))
+    n_regions = int(min(n_regions, len(scope.region_continents())))
+    days = -(-rows // (n_regions * per_region_day))
+    end = (pd.Timestamp(start) + pd.Timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    return {'n_regions': n_regions, 'n_tracks': int(min(max(rows // TRACK_ROWS, MIN_TRACKS), MAX_TRACKS)),
+            'start': start, 'end': end, 'max_rows': rows}
+
+
+def write_dataset(data_dir, n_regions, n_tracks=5000, start='2019-06-01', end='2021-12-31', chart_size=200, seed=0,
+                  max_rows=None):
+    """
+    Write raw/spotify-charts.csv and raw/spotify-tracks-features.csv under data_dir.
+    The charts are appended to the CSV in chunks, so memory stays flat at any size.
+    :param max_rows: Stop after this many chart rows (the last day may be cut short)
+    :return: dict with the row counts written
+    """
+    raw_dir = os.path.join(data_dir, 'raw')
+    os.makedirs(raw_dir, exist_ok=True)
+
+    features = generate_features(n_tracks, seed=seed)
+    features.to_csv(os.path.join(raw_dir, 'spotify-tracks-features.csv'), index=False)
+
+    charts_path = os.path.join(raw_dir, 'spotify-charts.csv')
+    pd.DataFrame(columns=CHART_COLUMNS).to_csv(charts_path, index=False)
+    chart_rows, buffered = 0, []
+    for piece in iter_charts(features['track_id'].unique(), synthetic_regions(n_regions),
+                             start=start, end=end, chart_size=chart_size, seed=seed):
+        if max_rows is not None:
+            piece = piece.iloc[:max_rows - chart_rows]
+        buffered.append(piece)
+        chart_rows += len(piece)
+        if sum(len(part) for part in buffered) >= WRITE_CHUNK_ROWS or chart_rows == max_rows:
+            pd.concat(buffered).to_csv(charts_path, mode='a', header=False, index=False)
+            buffered = []
+        if chart_rows == max_rows:
+            break
+    if buffered:
+        pd.concat(buffered).to_csv(charts_path, mode='a', header=False, index=False)
+
+    return {'chart_rows': chart_rows, 'feature_rows': len(features)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic raw chart and track feature files")
+    parser.add_argument('data_dir', help="Data directory to write raw/ into (point DS4200_DATA_DIR here)")
+    parser.add_argument('--regions', type=int, default=6, help="Number of regions (default: 6)")
+    parser.add_argument('--tracks', type=int, default=5000, help="Number of distinct tracks (default: 5000)")
+    parser.add_argument('--start', default='2019-06-01', help="First chart date (default: 2019-06-01)")
+    parser.add_argument('--end', default='2021-12-31', help="Last chart date (default: 2021-12-31)")
+    parser.add_argument('--chart-size', type=int, default=200, help="Positions per daily chart (default: 200)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument('--rows', type=int, default=None,
+                        help="Size the sample by raw chart rows instead (sets regions, tracks and end date)")
+    args = parser.parse_args()
+
+    if args.rows:
+        plan = plan_rows(args.rows, chart_size=args.chart_size, start=args.start)
+        print(f"{args.rows:,} rows: {plan['n_regions']} regions, {plan['n_tracks']:,} tracks, "
+              f"{plan['start']} to {plan['end']}")
+        counts = write_dataset(args.data_dir, chart_size=args.chart_size, seed=args.seed, **plan)
+    else:
+        counts = write_dataset(args.data_dir, args.regions, n_tracks=args.tracks, start=args.start, end=args.end,
+                               chart_size=args.chart_size, seed=args.seed)
+    print(f"Wrote {counts['chart_rows']:,} chart rows and {counts['feature_rows']:,} feature rows "
+          f"to {os.path.join(args.data_dir, 'raw')}")
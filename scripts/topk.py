@@ -0,0 +1,176 @@
+import pandas as pd
+import numpy as np
+import argparse
+import time
+
+
+def _order_values(values, largest):
+    """Values to sort ascending: negated for 'largest', missing values last either way"""
+    values = np.asarray(values, dtype='float64')
+    values = -values if largest else values
+    return np.where(np.isnan(values), np.inf, values)
+
+
+def _select(order_values, k):
+    """Positions of the k smallest order values, smallest first, ties in position order"""
+    positions = np.arange(len(order_values))
+    if len(order_values) > k:
+        # O(n) partition to the k-th best value; only the items at or above it get sorted
+        kth = order_values[np.argpartition(order_values, k - 1)[k - 1]]
+        positions = positions[order_values <= kth]
+    return positions[np.argsort(order_values[positions], kind='stable')][:k]
+
+
+def select_top(values, k, largest=True, groups=None):
+    """
+    Positions of the k best values, best first; ties keep the earlier position
+    (like nlargest(keep='first') or a stable sort followed by head(k))
+    :param values: 1-D array of the metric
+    :param k: Items to keep (per group)
+    :param largest: Keep the largest values (False: the smallest)
+    :param groups: Optional group codes (integers), one top-k per group, groups in code order
+    :return: np.ndarray of positions
+    """
+    order_values = _order_values(values, largest)
+    if groups is None:
+        return _select(order_values, k)
+
+    # One stable sort of the group codes, then a partition per group instead of a full sort
+    by_group = np.argsort(groups, kind='stable')
+    segments = np.split(by_group, np.flatnonzero(np.diff(groups[by_group])) + 1)
+    selected = [segment[_select(order_values[segment], k)] for segment in segments if len(segment)]
+    # No rows means no segments, and np.concatenate() needs at least one array
+    return np.concatenate(selected) if selected else np.empty(0, dtype=np.intp)
+
+
+def top_k(df, metrics, k=10, by=None):
+    """
+    Top-k rows of several metrics in one call
+    :param df: One row per item (e.g. per track, or per (region, track))
+    :param metrics: {column: 'largest' or 'smallest'} (a list means 'largest' for all)
+    :param k: Rows to keep per metric (and per group)
+    :param by: Optional grouping column(s); one top-k list per group
+    :return: dict of metric -> DataFrame of the selected rows, best first within each group
+    """
+    if not isinstance(metrics, dict):
+        metrics = {metric: 'largest' for metric in metrics}
+    groups = None
+    if by is not None:
+        groups = df.groupby(by, observed=True, sort=True, dropna=False).ngroup().to_numpy()
+        # Small integer codes let numpy's stable sort use radix sort
+        groups = groups.astype(np.min_scalar_type(max(groups.max(initial=0), 0)))
+
+    return {metric: df.iloc[select_top(df[metric].to_numpy(), k, direction == 'largest', groups)]
+            for metric, direction in metrics.items()}
+
+
+class TopK:
+    """
+    Bounded top-k lists of several metrics per group that can be updated with new or changed items.
+    Only the current top-k of each list is kept, so an update touches k rows per group plus the
+    new items. This is exact when an item's value only ever moves towards the top (running
+    totals, best peaks, longest runs) or never changes once seen.
+
+    leaders = TopK({'streams': 'largest', 'peak_position': 'smallest'}, k=20, by='region', key='track_id')
+    leaders.update(first_rollup)
+    leaders.update(changed_rows)      # rows of new or changed items, with their new values
+    leaders.result('streams')
+    """
+
+    def __init__(self, metrics, k=10, by=None, key='track_id'):
+        self.metrics = metrics if isinstance(metrics, dict) else {metric: 'largest' for metric in metrics}
+        self.k = k
+        self.by = [by] if isinstance(by, str) else by
+        self.key = key
+        self.lists = {}
+
+    def update(self, items):
+        """
+        Merge items into every list; an item already listed is replaced by its new row
+        :param items: DataFrame with the key, grouping and metric columns (plus any payload)
+        :return: self
+        """
+        identity = (self.by or []) + [self.key]
+        for metric, direction in self.metrics.items():
+            current = self.lists.get(metric)
+            candidates = items if current is None else pd.concat([current, items], ignore_index=True)
+            # Ties are broken by group and key, so the lists do not depend on the order of updates
+            candidates = (candidates.drop_duplicates(subset=identity, keep='last')
+                          .sort_values(identity, kind='stable').reset_index(drop=True))
+            self.lists[metric] = top_k(candidates, {metric: direction}, self.k, self.by)[metric]
+        return self
+
+    def result(self, metric):
+        """Current top-k rows of a metric, best first within each group"""
+        return self.lists[metric].reset_index(drop=True)
+
+
+def verify_top_k(n_items=1_000_000, n_groups=50, k=20, seed=0):
+    """
+    Compare top_k() with pandas nlargest / stable sort + head on random data with many ties,
+    and an incremental TopK with a one-shot selection
+    :return: bool: True if every list matches
+    """
+    print("=" * 60)
+    print(f"TOP-K SELECTION ({n_items:,} items, {n_groups} groups, k={k})")
+    print("=" * 60)
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'track_id': np.arange(n_items),
+        'region': rng.integers(0, n_groups, n_items),
+        'streams': rng.integers(0, 10_000, n_items).astype('float64'),
+        'popularity': rng.integers(0, 100, n_items),
+        'peak_position': rng.integers(1, 200, n_items),
+    })
+    df.loc[rng.choice(n_items, n_items // 100, replace=False), 'streams'] = np.nan
+    metrics = {'streams': 'largest', 'popularity': 'largest', 'peak_position': 'smallest'}
+
+    start = time.perf_counter()
+    ungrouped = top_k(df, metrics, k)
+    grouped = top_k(df, metrics, k, by='region')
+    seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected_ungrouped = {metric: df.nlargest(k, metric) if direction == 'largest' else df.nsmallest(k, metric)
+                          for metric, direction in metrics.items()}
+    expected_grouped = {metric: df.sort_values(['region', metric], ascending=[True, direction != 'largest'],
+                                               kind='stable', na_position='last').groupby('region').head(k)
+                        for metric, direction in metrics.items()}
+    pandas_seconds = time.perf_counter() - start
+
+    # Incremental: the same totals arriving in two halves, values only growing
+    half = df.assign(streams=df['streams'] / 2)
+    leaders = TopK({'streams': 'largest'}, k=k, by='region').update(half)
+    leaders.update(df[df['track_id'] % 2 == 0]).update(df[df['track_id'] % 2 == 1])
+
+    checks = {f'{metric} (all)': (expected_ungrouped[metric], ungrouped[metric]) for metric in metrics}
+    checks.update({f'{metric} (per region)': (expected_grouped[metric], grouped[metric]) for metric in metrics})
+    checks['streams (incremental)'] = (expected_grouped['streams'], leaders.result('streams'))
+
+    # No rows at all (e.g. a filter that matched nothing) gives empty lists, not an error
+    empty = df.iloc[:0]
+    checks.update({f'{metric} (empty, per region)': (empty, top_k(empty, metrics, k, by='region')[metric])
+                   for metric in metrics})
+
+    all_match = True
+    for name, (expected, actual) in checks.items():
+        match = expected['track_id'].tolist() == actual['track_id'].tolist()
+        all_match = all_match and match
+        print(f"   {name:36s}: [{'MATCH' if match else 'MISMATCH'}]")
+    print(f"\n   top_k: {seconds:.2f}s for {len(metrics) * 2} lists, pandas: {pandas_seconds:.2f}s")
+    print(f"   All lists match: {all_match}")
+    return all_match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Top-k selection per metric and group")
+    parser.add_argument('--verify', action='store_true', help="Check top_k() and TopK against pandas")
+    parser.add_argument('--items', type=int, default=1_000_000, help="Random items for --verify (default: 1,000,000)")
+    parser.add_argument('--k', type=int, default=20, help="k for --verify (default: 20)")
+    args = parser.parse_args()
+
+    if args.verify:
+        verify_top_k(args.items, k=args.k)
+    else:
+        parser.print_help()
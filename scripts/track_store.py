@@ -0,0 +1,228 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+
+import storage
+
+FEATURES_FILE = 'spotify-tracks-features.csv'
+
+# Table names of the two merge layouts
+WIDE_TABLE = 'merged_charts_features'
+FACT_TABLE = 'chart_facts'
+
+META_FILE = 'meta.json'
+
+
+def store_dir():
+    """Directory of the persistent track-features store"""
+    return os.path.join(storage.data_dir(), 'processed', 'track_store')
+
+
+def _source_signature(path):
+    """Size and modification time of a source file, used to detect a stale store"""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _sources():
+    """Signatures of the raw features file and of the fetched audio features cache"""
+    # Imported here to avoid a cycle: enrichment uses this module to find missing tracks
+    from enrichment import cache_path
+    return {'features': _source_signature(storage.raw_path(FEATURES_FILE)),
+            'enrichment': _source_signature(cache_path())}
+
+
+def _load_features():
+    """The raw features file plus any tracks fetched by enrichment.py that it does not contain"""
+    from enrichment import cached_features
+
+    features_df = pd.read_csv(storage.raw_path(FEATURES_FILE))
+    fetched = cached_features()
+    fetched = fetched[~fetched['track_id'].isin(features_df['track_id'])]
+    if len(fetched):
+        print(f"   + {len(fetched):,} tracks from the audio features cache")
+        features_df = pd.concat([features_df, fetched], ignore_index=True)
+    return features_df
+
+
+def build_track_store():
+    """
+    Convert the raw features CSV (plus tracks fetched by enrichment.py) into one .npy file per
+    column, keyed by an integer track code. String columns are dictionary-encoded (int32 codes +
+    a JSON list of values, -1 = missing).
+    :return: str: Path of the store
+    """
+    print(f"\nBuilding track store from {storage.raw_path(FEATURES_FILE)}...")
+    features_df = _load_features()
+
+    path = store_dir()
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    columns = []
+    for col in features_df.columns:
+        values = features_df[col]
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            np.save(os.path.join(path, f'{col}.npy'), values.to_numpy())
+            columns.append({'name': col, 'kind': 'numeric'})
+        else:
+            codes, uniques = pd.factorize(values)
+            np.save(os.path.join(path, f'{col}.npy'), codes.astype(np.int32))
+            with open(os.path.join(path, f'{col}.dict.json'), 'w') as f:
+                json.dump(list(uniques), f)
+            columns.append({'name': col, 'kind': 'dictionary'})
+
+    # Track code = code of track_id; store rows grouped by track code, so every code maps
+    # to a contiguous run of rows (a track listed under several genres has several rows)
+    track_codes = np.load(os.path.join(path, 'track_id.npy'))
+    row_order = np.argsort(track_codes, kind='stable')
+    offsets = np.searchsorted(track_codes[row_order], np.arange(track_codes.max() + 2))
+    np.save(os.path.join(path, '_row_order.npy'), row_order)
+    np.save(os.path.join(path, '_offsets.npy'), offsets)
+
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({'rows': len(features_df), 'columns': columns, 'sources': _sources()}, f, indent=2)
+
+    print(f"   {len(features_df):,} rows, {int(track_codes.max()) + 1:,} unique tracks, "
+          f"{storage.path_size(path) / 1_000_000:.1f} MB")
+    return path
+
+
+def open_track_store():
+    """
+    Open the store (building it first if missing or older than the raw features file or the
+    audio features cache)
+    :return: dict with the memory-mapped 'columns', their 'dictionaries', 'row_order' and 'offsets'
+    """
+    path = store_dir()
+    meta_path = os.path.join(path, META_FILE)
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    if meta is None or meta.get('sources') != _sources():
+        build_track_store()
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    store = {'rows': meta['rows'], 'columns': {}, 'dictionaries': {}}
+    for col in meta['columns']:
+        store['columns'][col['name']] = np.load(os.path.join(path, f"{col['name']}.npy"), mmap_mode='r')
+        if col['kind'] == 'dictionary':
+            with open(os.path.join(path, f"{col['name']}.dict.json")) as f:
+                store['dictionaries'][col['name']] = pd.Index(json.load(f))
+    store['row_order'] = np.load(os.path.join(path, '_row_order.npy'), mmap_mode='r')
+    store['offsets'] = np.load(os.path.join(path, '_offsets.npy'), mmap_mode='r')
+    return store
+
+
+def encode_track_ids(store, track_ids):
+    """Map track_id strings to integer track codes (-1 where the track is not in the store)"""
+    return store['dictionaries']['track_id'].get_indexer(track_ids)
+
+
+def match_rows(store, track_codes):
+    """
+    Inner-join positions between rows with the given track codes and the store
+    :return: (left_rows, store_rows) so that left_rows[i] joins store_rows[i], in left order
+    """
+    track_codes = np.asarray(track_codes)
+    offsets = store['offsets']
+    present = track_codes >= 0
+    starts = np.where(present, offsets[np.maximum(track_codes, 0)], 0)
+    counts = np.where(present, offsets[np.maximum(track_codes, 0) + 1] - starts, 0)
+
+    left_rows = np.repeat(np.arange(len(track_codes)), counts)
+    # Position within each run of matches, added to that run's first store row
+    run_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    store_rows = np.asarray(store['row_order'])[np.repeat(starts, counts) + run_offsets]
+    return left_rows, store_rows
+
+
+def gather_columns(store, store_rows, columns=None):
+    """
+    Read feature columns for the given store rows with integer take, decoding dictionary columns
+    :return: pd.DataFrame with one row per entry of store_rows
+    """
+    columns = [col for col in store['columns'] if col != 'track_id'] if columns is None else columns
+    gathered = {}
+    for col in columns:
+        values = np.take(store['columns'][col], store_rows)
+        if col in store['dictionaries']:
+            uniques = store['dictionaries'][col].to_numpy(dtype=object)
+            decoded = uniques[np.maximum(values, 0)]
+            decoded[values < 0] = np.nan
+            values = decoded
+        gathered[col] = values
+    return pd.DataFrame(gathered)
+
+
+def join_features(charts_df, columns=None, store=None):
+    """
+    Inner-join chart rows with the track features store, like
+    charts_df.merge(features_df, on='track_id', how='inner') but with an integer gather
+    :param charts_df: Rows with a 'track_code' or 'track_id' column
+    :param columns: Feature columns to attach (default: all)
+    :return: pd.DataFrame
+    """
+    store = store or open_track_store()
+    if 'track_code' in charts_df.columns:
+        codes = charts_df['track_code'].to_numpy()
+    else:
+        codes = encode_track_ids(store, charts_df['track_id'])
+
+    left_rows, store_rows = match_rows(store, codes)
+    left = charts_df.iloc[left_rows].reset_index(drop=True)
+    features = gather_columns(store, store_rows, columns)
+
+    if 'track_id' not in left.columns:
+        # Decode the track codes of a fact table back to track_id, in the same position
+        track_ids = store['dictionaries']['track_id'].to_numpy(dtype=object)
+        left.insert(left.columns.get_loc('track_code'), 'track_id', track_ids[codes[left_rows]])
+    return pd.concat([left.drop(columns=['track_code'], errors='ignore'), features], axis=1)
+
+
+def merged_layout():
+    """Which merge layout is on disk ('wide' or 'star'); the newest wins if both exist"""
+    existing = {}
+    for layout, name in [('wide', WIDE_TABLE), ('star', FACT_TABLE)]:
+        fmt = storage.stored_format(name)
+        if fmt is not None:
+            existing[layout] = os.path.getmtime(storage.processed_path(name, fmt))
+    if not existing:
+        raise FileNotFoundError("No merged table found, run merge_datasets.py first")
+    return max(existing, key=existing.get)
+
+
+def load_merged(columns=None, regions=None, years=None):
+    """
+    Load the merged charts + features table from whichever layout was written last
+    :return: pd.DataFrame with the same columns as the wide merged table
+    """
+    if merged_layout() == 'wide':
+        return storage.read_table(WIDE_TABLE, columns=columns, regions=regions, years=years)
+
+    # Imported here to avoid a cycle: merge_datasets uses this module to build both layouts
+    from merge_datasets import clean_columns
+
+    facts = storage.read_table(FACT_TABLE, regions=regions, years=years)
+    merged = clean_columns(join_features(facts))
+    return merged[columns] if columns is not None else merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent, memory-mapped track features store")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the store from the raw features CSV")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        build_track_store()
+    store = open_track_store()
+    print(f"Track store: {store['rows']:,} rows, {len(store['dictionaries']['track_id']):,} tracks, "
+          f"columns: {', '.join(store['columns'])}")
@@ -1,5 +1,8 @@
 
-d3.csv("./data/visualizations/monthly_genre_trends.csv").then(data => {
+// Ask the local query server first (python scripts/query_server.py); static hosting falls back to the CSV
+d3.json("/api/genre-trends")
+  .catch(() => d3.csv("./data/visualizations/monthly_genre_trends.csv"))
+  .then(data => {
 
   data.forEach(d => {
     d.count = +d.count;